@@ -1,10 +1,22 @@
 import numpy
-import array
 from pydub import AudioSegment
 from pydub.utils import get_array_type
 
 
 class Audio(object):
+    """Audio held as a contiguous floating point buffer in [-1.0, 1.0]
+
+    Samples are along the last axis: the buffer is 1-D for mono audio and
+    (channels, samples) otherwise. Files are downmixed to mono on load unless
+    mono=False. Integer PCM samples (interleaved) and the pydub AudioSegment
+    are only built (and then cached) when something asks for them, e.g. a
+    pydub effect or export.
+
+    A data buffer without an old_audio needs its sample_rate, and is turned
+    into sample_width byte PCM when that's needed. C-contiguous float32 and
+    float64 buffers are used as they are, without a copy.
+    """
+
     def __init__(
         self,
         path=None,
@@ -13,42 +25,123 @@ class Audio(object):
         old_audio=None,
         sound=None,
         sample_rate=None,
+        data=None,
+        mono=True,
+        sample_width=2,
     ):
-        if (
-            (path and (samples is not None))
-            or (path and sound)
-            or (sound and (samples is not None))
-        ):
+        sources = [bool(path), samples is not None, sound is not None, data is not None]
+        if sum(sources) > 1:
             raise ValueError(
-                "Only pass one of path[+ext] or samples[+old_audio] or sound[+old_audio]"
+                "Only pass one of path[+ext] or samples[+old_audio] or sound[+old_audio] or data[+old_audio]"
             )
 
+        self._samples = None
+        self._sound = None
+
         if path:
             if not ext:
                 ext = path.split(".")[-1]
-            self.sound = AudioSegment.from_file(file=path, format=ext).set_channels(1)
-            self.samples = self.sound.get_array_of_samples()
-            self.sample_rate = self.sound.frame_rate
+            sound = AudioSegment.from_file(file=path, format=ext)
+            if mono:
+                sound = sound.set_channels(1)
             self.format = ext
+        if sound is not None:
+            self._from_sound(sound)
+            if not path:
+                self.format = old_audio.format if old_audio is not None else "wav"
         if samples is not None:
-            self.samples = samples
-            if sample_rate:
-                self.sample_rate = sample_rate
-            else:
-                self.sample_rate = old_audio.sample_rate
-            self.sample_rate = int(self.sample_rate)
-            self.sound = AudioSegment(
-                data=self.samples,
-                sample_width=old_audio.sound.sample_width,
+            samples = numpy.frombuffer(
+                samples, dtype=get_array_type(8 * old_audio.sample_width)
+            )
+            self.sample_width = old_audio.sample_width
+            self.data = _deinterleave(
+                _pcm_to_float(samples, self.sample_width), old_audio.channels
+            )
+            self._samples = samples
+        if data is not None:
+            self.sample_width = (
+                old_audio.sample_width if old_audio is not None else sample_width
+            )
+            self.data = numpy.ascontiguousarray(data)
+            if self.data.dtype not in (numpy.float32, numpy.float64):
+                self.data = self.data.astype(numpy.float64)
+        if samples is not None or data is not None:
+            self.sample_rate = int(
+                sample_rate if sample_rate else old_audio.sample_rate
+            )
+            self.format = old_audio.format if old_audio is not None else "wav"
+
+    def _from_sound(self, sound):
+        self._sound = sound
+        self._samples = numpy.frombuffer(sound.raw_data, dtype=sound.array_type)
+        self.sample_width = sound.sample_width
+        self.sample_rate = sound.frame_rate
+        self.data = _deinterleave(
+            _pcm_to_float(self._samples, self.sample_width), sound.channels
+        )
+
+    def __len__(self):
+        """Length in milliseconds, like pydub.AudioSegment"""
+        return round(1000 * (self.data.shape[-1] / self.sample_rate))
+
+    @property
+    def channels(self):
+        return 1 if self.data.ndim == 1 else self.data.shape[0]
+
+    @property
+    def samples(self):
+        """
+        Integer PCM samples, interleaved, converted from the float buffer on
+        first use
+        """
+        if self._samples is None:
+            self._samples = _float_to_pcm(_interleave(self.data), self.sample_width)
+        return self._samples
+
+    @property
+    def sound(self):
+        """pydub AudioSegment, built from the PCM samples on first use"""
+        if self._sound is None:
+            self._sound = AudioSegment(
+                data=self.samples.tobytes(),
+                sample_width=self.sample_width,
                 frame_rate=self.sample_rate,
-                channels=1,
+                channels=self.channels,
             )
-            self.format = old_audio.format
-        if sound:
-            self.sound = sound
-            self.samples = self.sound.get_array_of_samples()
-            self.sample_rate = sound.frame_rate
-            self.format = old_audio.format
+        return self._sound
+
+    @property
+    def power(self):
+        """Mean power of the samples"""
+        return float(numpy.mean(numpy.square(self.data, dtype=numpy.float64)))
 
     def export(self, path):
         self.sound.export(out_f=path, format="wav")
+
+
+def _full_scale(sample_width):
+    return float(2 ** (8 * sample_width - 1))
+
+
+def _pcm_to_float(samples, sample_width):
+    # float32 holds 8 and 16 bit PCM exactly, wider samples need float64
+    dtype = numpy.float32 if sample_width <= 2 else numpy.float64
+    return samples.astype(dtype) / dtype(_full_scale(sample_width))
+
+
+def _float_to_pcm(data, sample_width):
+    array_type = get_array_type(8 * sample_width)
+    limits = numpy.iinfo(array_type)
+    pcm = numpy.rint(data * _full_scale(sample_width))
+    numpy.clip(pcm, limits.min, limits.max, out=pcm)
+    return pcm.astype(array_type)
+
+
+def _interleave(data):
+    return data if data.ndim == 1 else data.T.ravel()
+
+
+def _deinterleave(samples, channels):
+    if channels == 1:
+        return samples
+    return numpy.ascontiguousarray(samples.reshape(-1, channels).T)
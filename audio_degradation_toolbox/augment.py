@@ -0,0 +1,207 @@
+"""
+Randomized augmentation: many degraded variants of one decoded input
+
+An augmentation is a list of degradations like a chain, except that any
+parameter may be a distribution, given as a JSON object with one key:
+
+    {"uniform": [low, high]}      a float in [low, high)
+    {"loguniform": [low, high]}   a float whose log is uniform, e.g. a cutoff
+    {"normal": [mean, std]}       clipped to the parameter's range
+    {"randint": [low, high]}      an integer in [low, high], both included
+    {"choice": [a, b, ...]}       one of the values, e.g. IR paths
+
+Numbers drawn for an integer parameter are rounded. The name of a degradation
+can't be a distribution.
+
+Each variant samples every distribution anew from a seeded generator, which
+also seeds its noise steps, so the same seed gives the same variants. The
+input is decoded once for all of them, and IRs and mix files are only loaded
+the first time a variant uses them.
+"""
+
+from .chain import DEGRADATIONS, Chain, _resolve
+from .core import Degradation
+from collections import namedtuple
+import contextlib
+import math
+import numpy
+
+# index of the variant, the seed of numpy's global generator while it ran
+# (for random mix offsets), the degradations sampled for it and its audio
+Variant = namedtuple("Variant", ["index", "seed", "degradations", "audio"])
+
+
+class Augmentation(object):
+    """
+    A list of degradations whose parameters may be distributions, checked up
+    front: every distribution must be well formed, and its bounds (or every
+    choice) must be valid values for the parameter
+    """
+
+    def __init__(self, degradations):
+        self.degradations = []
+        errors = []
+        for i, d in enumerate(degradations, 1):
+            name = d.get("name", "?") if isinstance(d, dict) else "?"
+            step, step_errors = _parse_step(d)
+            errors.extend("step {0} ({1}): {2}".format(i, name, e) for e in step_errors)
+            self.degradations.append(step)
+        if errors:
+            raise ValueError("Invalid augmentation:\n  " + "\n  ".join(errors))
+
+    def sample(self, rng):
+        """Degradations with every distribution replaced by a value drawn from rng"""
+        return [
+            {
+                key: value.sample(rng) if isinstance(value, Distribution) else value
+                for key, value in d.items()
+            }
+            for d in self.degradations
+        ]
+
+    def variants(self, audio, n, seed=None, hooks=()):
+        """
+        Yield n Variants of audio (an Audio, which is never modified), each
+        from a chain sampled with a generator seeded with seed; noise steps
+        without a seed get one from it
+        """
+        rng = numpy.random.RandomState(seed)
+        for index in range(n):
+            degradations = self.sample(rng)
+            for d in degradations:
+                if d["name"] == "noise" and d.get("seed") is None:
+                    d["seed"] = int(rng.randint(2**31 - 1))
+            variant_seed = int(rng.randint(2**31 - 1))
+
+            deg = Degradation(audio=audio, hooks=hooks)
+            with _seeded(variant_seed):
+                deg.apply_degradations(Chain(degradations))
+            yield Variant(index, variant_seed, degradations, deg.file_audio)
+
+
+@contextlib.contextmanager
+def _seeded(seed):
+    # random mix offsets draw from numpy's global generator
+    state = numpy.random.get_state()
+    numpy.random.seed(seed)
+    try:
+        yield
+    finally:
+        numpy.random.set_state(state)
+
+
+def _parse_step(d):
+    if not isinstance(d, dict):
+        return d, _resolve(d)[1]
+
+    if isinstance(d.get("name"), dict):
+        return d, ["name can't be a distribution, got {0!r}".format(d["name"])]
+    if "name" in d and not isinstance(d["name"], str):
+        return d, ["name must be a string, got {0!r}".format(d["name"])]
+
+    spec = DEGRADATIONS.get(d.get("name"))
+    params = {p.name: p for p in spec.params} if spec else {}
+    step = {}
+    errors = []
+    for key, value in d.items():
+        try:
+            step[key] = (
+                Distribution.parse(value, params.get(key))
+                if isinstance(value, dict)
+                else value
+            )
+        except ValueError as e:
+            errors.append("{0}: {1}".format(key, e))
+    if errors:
+        return step, errors
+
+    # resolve the step with each distribution at each of its candidate values,
+    # and every other distribution at its first candidate
+    distributions = [k for k, v in step.items() if isinstance(v, Distribution)]
+    first = {k: step[k].candidates[0] for k in distributions}
+    trials = [first]
+    for key in distributions:
+        trials.extend(dict(first, **{key: value}) for value in step[key].candidates[1:])
+    for trial in trials:
+        for e in _resolve(dict(step, **trial))[1]:
+            if e not in errors:
+                errors.append(e)
+    return step, errors
+
+
+class Distribution(object):
+    """
+    A parameter drawn anew for every variant; only the candidates are checked
+    up front, so numbers drawn for param (a chain.Param, if it's given) are
+    rounded for an integer parameter and clipped into its range, which the
+    unbounded draws of a normal can leave
+    """
+
+    def __init__(self, kind, args, param=None):
+        self.kind = kind
+        self.args = args
+        self.param = param
+
+    @classmethod
+    def parse(cls, value, param=None):
+        if len(value) != 1 or next(iter(value)) not in _SAMPLERS:
+            raise ValueError(
+                "expected a distribution, one of {0}, got {1!r}".format(
+                    ", ".join(sorted(_SAMPLERS)), value
+                )
+            )
+        kind, args = next(iter(value.items()))
+        if not isinstance(args, list) or not args:
+            raise ValueError(
+                "{0} needs a list of arguments, got {1!r}".format(kind, args)
+            )
+
+        if kind != "choice":
+            if len(args) != 2 or not all(_is_number(a) for a in args):
+                raise ValueError("{0} needs two numbers, got {1!r}".format(kind, args))
+            if kind == "randint" and not all(float(a).is_integer() for a in args):
+                raise ValueError("randint needs two integers, got {0!r}".format(args))
+            if kind != "normal" and args[0] > args[1]:
+                raise ValueError("{0} needs low <= high, got {1!r}".format(kind, args))
+            if kind == "loguniform" and args[0] <= 0:
+                raise ValueError(
+                    "loguniform needs positive bounds, got {0!r}".format(args)
+                )
+            if kind == "normal" and args[1] < 0:
+                raise ValueError("normal needs std >= 0, got {0!r}".format(args))
+        return cls(kind, args, param)
+
+    @property
+    def candidates(self):
+        """Values checked up front: the choices, the bounds, or the mean"""
+        if self.kind == "normal":
+            return [self.args[0]]
+        return list(self.args)
+
+    def sample(self, rng):
+        value = _SAMPLERS[self.kind](rng, self.args)
+        if (
+            self.kind != "choice"
+            and self.param is not None
+            and self.param.kind in (int, float)
+        ):
+            value = self.param.clip(value)
+        return value
+
+    def __repr__(self):
+        return "{{{0!r}: {1!r}}}".format(self.kind, self.args)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+_SAMPLERS = {
+    "uniform": lambda rng, args: float(rng.uniform(args[0], args[1])),
+    "loguniform": lambda rng, args: float(
+        math.exp(rng.uniform(math.log(args[0]), math.log(args[1])))
+    ),
+    "normal": lambda rng, args: float(rng.normal(args[0], args[1])),
+    "randint": lambda rng, args: int(rng.randint(int(args[0]), int(args[1]) + 1)),
+    "choice": lambda rng, args: args[rng.randint(len(args))],
+}
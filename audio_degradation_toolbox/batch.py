@@ -0,0 +1,204 @@
+from .chain import Chain
+from .core import Degradation
+from .hooks import Trace
+from .stream import stream_degradations
+from multiprocessing import Pool
+import glob
+import os
+import sys
+import traceback
+
+AUDIO_EXTENSIONS = (".wav", ".aif", ".aiff", ".flac", ".mp3", ".ogg", ".m4a")
+
+# set once per worker process by _init_worker
+_chain = None
+_trim_on_load = False
+_block_size = None
+_mono = True
+_profile = False
+_cache = None
+
+
+def expand_inputs(patterns):
+    """
+    Expand input files, globs and directories (searched recursively for audio
+    files) into (input_path, relative_dir) pairs, where relative_dir is the
+    file's directory relative to the directory it was found in
+    """
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, dirs, files in os.walk(pattern):
+                dirs.sort()
+                for f in sorted(files):
+                    if f.lower().endswith(AUDIO_EXTENSIONS):
+                        yield os.path.join(root, f), os.path.relpath(root, pattern)
+        elif any(c in pattern for c in "*?["):
+            for path in sorted(glob.glob(pattern, recursive=True)):
+                if os.path.isfile(path):
+                    yield path, ""
+        else:
+            # missing files are passed through and reported as failures
+            yield pattern, ""
+
+
+def output_path_for(input_path, relative_dir, output_template):
+    """
+    Format the output template with the {stem}, {name} and {reldir} of the
+    input; a template without fields is an output directory
+    """
+    name = os.path.basename(input_path)
+    stem = os.path.splitext(name)[0]
+    reldir = "" if relative_dir == os.curdir else relative_dir
+
+    if "{" not in output_template:
+        return os.path.join(output_template, reldir, stem + ".wav")
+    return output_template.format(stem=stem, name=name, reldir=reldir)
+
+
+def _init_worker(chain, trim_on_load, block_size, mono, profile, cache):
+    global _chain, _trim_on_load, _block_size, _mono, _profile, _cache
+    _chain = chain
+    _trim_on_load = trim_on_load
+    _block_size = block_size
+    _mono = mono
+    _profile = profile
+    _cache = cache
+
+    # logging from thousands of files is noise, failures are reported back to
+    # the parent instead
+    sys.stdout = open(os.devnull, "w")
+
+
+def _degrade_file(job):
+    input_path, output_path = job
+    trace = Trace()
+    try:
+        output_dir = os.path.dirname(output_path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+
+        def degrade():
+            if _block_size:
+                stream_degradations(
+                    input_path,
+                    output_path,
+                    _chain,
+                    block_size=_block_size,
+                    trim_on_load=_trim_on_load,
+                )
+                return
+
+            deg = Degradation(
+                path=input_path,
+                trim_on_load=_trim_on_load,
+                mono=_mono,
+                hooks=[trace] if _profile else (),
+            )
+            deg.apply_degradations(_chain)
+            deg.file_audio.export(output_path)
+
+        if _cache is None:
+            degrade()
+            cached = False
+        else:
+            cached = _cache.produce(
+                input_path,
+                output_path,
+                _chain,
+                degrade,
+                trim_on_load=_trim_on_load,
+                mono=_mono,
+                block_size=_block_size,
+            )
+    except Exception as e:
+        return (
+            input_path,
+            output_path,
+            "".join(traceback.format_exception_only(type(e), e)),
+            trace.events,
+            False,
+        )
+    return input_path, output_path, None, trace.events, cached
+
+
+def run_batch(
+    inputs,
+    output_template,
+    degradations,
+    jobs=None,
+    trim_on_load=False,
+    block_size=None,
+    mono=True,
+    trace=None,
+    cache=None,
+):
+    """
+    Apply the same degradations to every input, spread over `jobs` worker
+    processes (default: one per CPU), streaming each file in blocks of
+    block_size samples if it's set and keeping every channel unless mono;
+    returns the number of failed files
+
+    If trace (a hooks.Trace) is given, the step events of every file are
+    added to it; streamed files, and files served from the cache (an
+    output_cache.OutputCache, if given), don't report steps
+
+    The degradations (a Chain, or a list) are validated before any file is
+    read, and raise ValueError if any step is invalid
+    """
+    chain = degradations if isinstance(degradations, Chain) else Chain(degradations)
+    work = []
+    seen = set()
+    for input_path, relative_dir in expand_inputs(inputs):
+        output_path = output_path_for(input_path, relative_dir, output_template)
+        if output_path in seen:
+            print(
+                "Skipping {0}: output {1} already claimed by another input".format(
+                    input_path, output_path
+                ),
+                file=sys.stderr,
+            )
+            continue
+        seen.add(output_path)
+        work.append((input_path, output_path))
+
+    failures = 0
+    hits = 0
+    with Pool(
+        processes=jobs,
+        initializer=_init_worker,
+        initargs=(chain, trim_on_load, block_size, mono, trace is not None, cache),
+    ) as pool:
+        for done, (input_path, output_path, error, events, cached) in enumerate(
+            pool.imap_unordered(_degrade_file, work), 1
+        ):
+            hits += cached
+            if trace is not None:
+                trace.events.extend(events)
+            if error:
+                failures += 1
+                print(
+                    "[{0}/{1}] FAILED {2}: {3}".format(
+                        done, len(work), input_path, error
+                    ),
+                    file=sys.stderr,
+                )
+            else:
+                print(
+                    "[{0}/{1}] {2} -> {3}{4}".format(
+                        done,
+                        len(work),
+                        input_path,
+                        output_path,
+                        " (cached)" if cached else "",
+                    )
+                )
+
+    print(
+        "Degraded {0} of {1} files, {2} failed{3}".format(
+            len(work) - failures,
+            len(work),
+            failures,
+            ", {0} from the cache".format(hits) if cache is not None else "",
+        )
+    )
+    return failures
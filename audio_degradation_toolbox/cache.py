@@ -0,0 +1,56 @@
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Least-recently-used cache bounded by the total size in bytes of its values
+
+    Values are usually numpy arrays and are sized by their nbytes, anything
+    else needs an explicit size when it's stored
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        try:
+            value, _ = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, nbytes=None):
+        if nbytes is None:
+            nbytes = value.nbytes
+        if key in self._entries:
+            self.nbytes -= self._entries.pop(key)[1]
+        if nbytes > self.max_bytes:
+            # would evict everything else and still not fit
+            return value
+
+        while self._entries and self.nbytes + nbytes > self.max_bytes:
+            _, (_, evicted_nbytes) = self._entries.popitem(last=False)
+            self.nbytes -= evicted_nbytes
+
+        self._entries[key] = (value, nbytes)
+        self.nbytes += nbytes
+        return value
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
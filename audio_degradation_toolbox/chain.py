@@ -0,0 +1,543 @@
+"""
+Degradation specs and chains compiled from them
+
+Every degradation is registered with the parameters it accepts, their types,
+defaults and valid ranges. A Chain resolves a list of degradations against
+those specs up front, so an unknown name or parameter, a value of the wrong
+type or out of range, or a missing IR or mix file is reported before any audio
+is decoded, and the resolved chain can then be applied to any number of inputs.
+"""
+
+from .degradations import (
+    FILTER_TYPES,
+    apply_aliasing,
+    apply_band_pass,
+    apply_clipping,
+    apply_delay,
+    apply_dynamic_range_compression,
+    apply_eq,
+    apply_gain,
+    apply_harmonic_distortion,
+    apply_high_pass,
+    apply_impulse_response,
+    apply_low_pass,
+    apply_mix,
+    apply_multiband_eq,
+    apply_noise,
+    apply_normalization,
+    apply_pitch_shift,
+    apply_resample,
+    apply_speedup,
+    apply_time_stretch,
+    apply_wow_flutter,
+    mp3_transcode,
+    trim_millis,
+)
+from .plan import compile_plan
+from .resample import RESAMPLE_QUALITIES
+from .stretch import STRETCH_ENGINES
+import json
+import math
+import os
+import sys
+
+# degradation name -> Spec, filled by @register
+DEGRADATIONS = {}
+
+NOISE_COLORS = ("white", "pink", "blue", "brown", "violet")
+
+REQUIRED = object()
+
+
+def register(name, *params, check=None):
+    """
+    Register a handler(audio, **params) returning the degraded audio, with the
+    parameters it takes and optionally a check(step) of how they combine
+    """
+
+    def decorator(handler):
+        DEGRADATIONS[name] = Spec(name, handler, params, check)
+        return handler
+
+    return decorator
+
+
+class Spec(object):
+    def __init__(self, name, handler, params, check=None):
+        self.name = name
+        self.handler = handler
+        self.params = params
+        self.check = check
+
+    def resolve(self, d):
+        """Step for the degradation d, and a list of what's wrong with it"""
+        errors = [
+            "unknown parameter {0}".format(key)
+            for key in d
+            if key != "name" and key not in [p.name for p in self.params]
+        ]
+        step = Step(name=self.name)
+        for param in self.params:
+            try:
+                step[param.name] = param.resolve(d)
+            except ValueError as e:
+                errors.append(str(e))
+
+        problem = self.check(step) if self.check and not errors else None
+        if problem:
+            errors.append(problem)
+        return step, errors
+
+
+class Param(object):
+    """
+    A degradation parameter: its type (int, float, bool or str), default, and
+    optionally a check(value) returning an error message (or None), literal
+    values accepted as they are (e.g. "random"), or that it's a file path
+    """
+
+    def __init__(
+        self, name, kind, default=REQUIRED, check=None, literals=(), path=False
+    ):
+        self.name = name
+        self.kind = kind
+        self.default = default
+        self.check = check
+        self.literals = literals
+        self.path = path
+
+    def resolve(self, d):
+        value = d.get(self.name, self.default)
+        if value is REQUIRED:
+            raise ValueError("missing required parameter {0}".format(self.name))
+        if value in self.literals:
+            return value
+
+        value = self._convert(value)
+        problem = self.check(value) if self.check else None
+        if problem is None and self.path and not os.path.isfile(value):
+            problem = "is not a file"
+        if problem:
+            raise ValueError("{0} {1}, got {2!r}".format(self.name, problem, value))
+        return value
+
+    def clip(self, value):
+        """
+        A number moved into the range the check declares (if it declares
+        one), and rounded for an int parameter
+        """
+        low, high = getattr(self.check, "bounds", (None, None))
+        if self.kind is int:
+            value = int(round(value))
+            low = None if low is None else int(math.ceil(low))
+            high = None if high is None else int(math.floor(high))
+        if low is not None and value < low:
+            value = low
+        if high is not None and value > high:
+            value = high
+        return value
+
+    def _convert(self, value):
+        if self.kind is bool:
+            if not isinstance(value, bool):
+                raise ValueError(
+                    "{0} must be true or false, got {1!r}".format(self.name, value)
+                )
+            return value
+        if self.kind is str:
+            if not isinstance(value, str):
+                raise ValueError(
+                    "{0} must be a string, got {1!r}".format(self.name, value)
+                )
+            return value
+
+        try:
+            if isinstance(value, bool):
+                raise TypeError
+            number = float(value)
+        except (TypeError, ValueError):
+            raise ValueError("{0} must be a number, got {1!r}".format(self.name, value))
+        if self.kind is int:
+            if not number.is_integer():
+                raise ValueError(
+                    "{0} must be an integer, got {1!r}".format(self.name, value)
+                )
+            return int(number)
+        return number
+
+
+class Bands(Param):
+    """
+    The bands of a multi-band equalizer: a list of objects, each resolved
+    against the given params
+    """
+
+    def __init__(self, name, params):
+        super().__init__(name, list, None)
+        self.params = params
+
+    def resolve(self, d):
+        bands = d.get(self.name)
+        if bands is None:
+            return None
+        if not isinstance(bands, list) or not bands:
+            raise ValueError(
+                "{0} must be a non-empty list of bands, got {1!r}".format(
+                    self.name, bands
+                )
+            )
+
+        resolved = []
+        for i, band in enumerate(bands, 1):
+            if not isinstance(band, dict):
+                raise ValueError(
+                    "band {0} must be an object, got {1!r}".format(i, band)
+                )
+            names = [p.name for p in self.params]
+            errors = ["unknown parameter {0}".format(k) for k in band if k not in names]
+            values = {}
+            for param in self.params:
+                try:
+                    values[param.name] = param.resolve(band)
+                except ValueError as e:
+                    errors.append(str(e))
+            if errors:
+                raise ValueError("band {0}: {1}".format(i, "; ".join(errors)))
+            resolved.append(values)
+        return resolved
+
+
+# the checks of numbers declare the closed range they accept as bounds, with
+# None for no limit; a positive float is at least the smallest normal float
+
+
+def _positive(value):
+    return None if value > 0 else "must be positive"
+
+
+_positive.bounds = (sys.float_info.min, None)
+
+
+def _non_negative(value):
+    return None if value >= 0 else "must not be negative"
+
+
+_non_negative.bounds = (0, None)
+
+
+def _between(low, high):
+    def check(value):
+        if low <= value <= high:
+            return None
+        return "must be between {0} and {1}".format(low, high)
+
+    check.bounds = (low, high)
+    return check
+
+
+def _one_of(*choices):
+    def check(value):
+        if value in choices:
+            return None
+        return "must be one of {0}".format(", ".join(choices))
+
+    return check
+
+
+class Step(dict):
+    """A degradation with every parameter resolved, i.e. converted and checked"""
+
+    @property
+    def spec(self):
+        return DEGRADATIONS[self["name"]]
+
+    def apply(self, audio):
+        params = {k: v for k, v in self.items() if k != "name"}
+        return self.spec.handler(audio, **params)
+
+    def describe(self):
+        # parameters left unset (None) aren't worth mentioning
+        return ", ".join(
+            "{0}: {1}".format(k, v)
+            for k, v in self.items()
+            if k != "name" and v is not None
+        )
+
+
+def resolve_step(d):
+    """Resolve one degradation, raising ValueError if it isn't valid"""
+    step, errors = _resolve(d)
+    if errors:
+        raise ValueError(
+            "Invalid degradation {0}: {1}".format(d.get("name"), "; ".join(errors))
+        )
+    return step
+
+
+def _resolve(d):
+    if not isinstance(d, dict) or "name" not in d:
+        return None, ["expected an object with a name, got {0!r}".format(d)]
+    if d["name"] not in DEGRADATIONS:
+        return None, ["unknown degradation {0!r}".format(d["name"])]
+    return DEGRADATIONS[d["name"]].resolve(d)
+
+
+class Chain(object):
+    """
+    A list of degradations resolved and validated once, then applied (as a
+    plan that fuses runs of linear filters) to any number of inputs
+    """
+
+    def __init__(self, degradations):
+        self.steps = []
+        errors = []
+        for i, d in enumerate(degradations, 1):
+            step, step_errors = _resolve(d)
+            name = d.get("name", "?") if isinstance(d, dict) else "?"
+            errors.extend("step {0} ({1}): {2}".format(i, name, e) for e in step_errors)
+            self.steps.append(step)
+        if errors:
+            raise ValueError("Invalid degradations:\n  " + "\n  ".join(errors))
+
+        self.plan = compile_plan(self.steps)
+
+    @classmethod
+    def load(cls, path):
+        """Chain of the degradations in a JSON file"""
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __iter__(self):
+        return iter(self.steps)
+
+
+@register(
+    "noise",
+    Param("color", str, "pink", _one_of(*NOISE_COLORS)),
+    Param("snr", float, 20.0),
+    Param("seed", int, None, _between(0, 2**32 - 1), literals=(None,)),
+)
+def _noise(audio, color, snr, seed):
+    return apply_noise(audio, color, snr, seed)
+
+
+@register("mp3", Param("bitrate", int, 320, _between(8, 320)))
+def _mp3(audio, bitrate):
+    return mp3_transcode(audio, bitrate)
+
+
+@register("gain", Param("volume", float, 10.0))
+def _gain(audio, volume):
+    return apply_gain(audio, volume)
+
+
+@register("normalize")
+def _normalize(audio):
+    return apply_normalization(audio)
+
+
+# the design of the low, high and band pass filters: ripple is the passband
+# ripple in dB of cheby1 and ellip, attenuation the stopband attenuation in dB
+# of cheby2 and ellip
+FILTER_DESIGN = (
+    Param("type", str, "rc", _one_of(*FILTER_TYPES)),
+    Param("order", int, 1, _between(1, 20)),
+    Param("ripple", float, 1.0, _positive),
+    Param("attenuation", float, 40.0, _positive),
+    Param("zero_phase", bool, False),
+)
+
+
+def _check_design(step):
+    if step["type"] == "rc" and step["order"] != 1:
+        return "rc filters are first order, pick another type for order {0}".format(
+            step["order"]
+        )
+    return None
+
+
+@register(
+    "low_pass",
+    Param("cutoff", float, 1000.0, _positive),
+    *FILTER_DESIGN,
+    check=_check_design
+)
+def _low_pass(audio, cutoff, type, order, ripple, attenuation, zero_phase):
+    return apply_low_pass(audio, cutoff, type, order, ripple, attenuation, zero_phase)
+
+
+@register(
+    "high_pass",
+    Param("cutoff", float, 1000.0, _positive),
+    *FILTER_DESIGN,
+    check=_check_design
+)
+def _high_pass(audio, cutoff, type, order, ripple, attenuation, zero_phase):
+    return apply_high_pass(audio, cutoff, type, order, ripple, attenuation, zero_phase)
+
+
+def _check_band(step):
+    if step["low_cutoff"] >= step["high_cutoff"]:
+        return "low_cutoff must be below high_cutoff"
+    return _check_design(step)
+
+
+@register(
+    "band_pass",
+    Param("low_cutoff", float, 300.0, _positive),
+    Param("high_cutoff", float, 3400.0, _positive),
+    *FILTER_DESIGN,
+    check=_check_band
+)
+def _band_pass(
+    audio, low_cutoff, high_cutoff, type, order, ripple, attenuation, zero_phase
+):
+    return apply_band_pass(
+        audio, low_cutoff, high_cutoff, type, order, ripple, attenuation, zero_phase
+    )
+
+
+@register(
+    "trim_millis",
+    Param("amount", int, 100, _non_negative),
+    Param("offset", int, 0, lambda v: None if v >= -1 else "must be -1 or more"),
+)
+def _trim_millis(audio, amount, offset):
+    return trim_millis(audio, amount, offset)
+
+
+@register(
+    "mix",
+    Param("path", str, path=True),
+    Param("snr", float, 20.0),
+    Param("offset", float, 0.0, _non_negative, literals=("random",)),
+)
+def _mix(audio, path, snr, offset):
+    return apply_mix(audio, path, snr, offset)
+
+
+# the resampling filter of every step that resamples
+QUALITY = Param("quality", str, "medium", _one_of(*RESAMPLE_QUALITIES))
+
+
+@register("speedup", Param("speed", float, check=_positive), QUALITY)
+def _speedup(audio, speed, quality):
+    return apply_speedup(audio, speed, quality)
+
+
+@register("resample", Param("rate", int, check=_positive), QUALITY)
+def _resample(audio, rate, quality):
+    return apply_resample(audio, rate, quality)
+
+
+@register(
+    "pitch_shift",
+    Param("octaves", float),
+    Param("engine", str, "resample", _one_of("resample", *STRETCH_ENGINES)),
+    QUALITY,
+)
+def _pitch_shift(audio, octaves, engine, quality):
+    return apply_pitch_shift(audio, octaves, engine, quality)
+
+
+@register(
+    "dynamic_range_compression",
+    Param(
+        "threshold", float, -20.0, lambda v: None if v <= 0 else "must be at most 0 dB"
+    ),
+    Param("ratio", float, 4.0, lambda v: None if v >= 1 else "must be at least 1"),
+    Param("attack", float, 5.0, _non_negative),
+    Param("release", float, 50.0, _non_negative),
+    Param("knee", float, 0.0, _non_negative),
+    Param("sample_accurate", bool, False),
+)
+def _dynamic_range_compression(
+    audio, threshold, ratio, attack, release, knee, sample_accurate
+):
+    return apply_dynamic_range_compression(
+        audio, threshold, ratio, attack, release, knee, sample_accurate
+    )
+
+
+@register("impulse_response", Param("path", str, path=True))
+def _impulse_response(audio, path):
+    return apply_impulse_response(audio, path)
+
+
+_EQ_BAND = (
+    Param("frequency", float, check=_positive),
+    Param("bandwidth", float, 1.0, _positive),
+    Param("gain", float, -3.0),
+)
+
+
+@register(
+    "equalizer",
+    Param("frequency", float, None, _positive, literals=(None,)),
+    Param("bandwidth", float, 1.0, _positive),
+    Param("gain", float, -3.0),
+    Bands("bands", _EQ_BAND),
+    check=lambda step: (
+        "specify one of frequency or bands"
+        if (step["frequency"] is None) == (step["bands"] is None)
+        else None
+    ),
+)
+def _equalizer(audio, frequency, bandwidth, gain, bands):
+    if bands is None:
+        return apply_eq(audio, frequency, bandwidth, gain)
+    return apply_multiband_eq(
+        audio, [(b["frequency"], b["bandwidth"], b["gain"]) for b in bands]
+    )
+
+
+@register(
+    "time_stretch",
+    Param("factor", float, check=_positive),
+    Param("engine", str, "phase_vocoder", _one_of(*STRETCH_ENGINES)),
+)
+def _time_stretch(audio, factor, engine):
+    return apply_time_stretch(audio, factor, engine)
+
+
+@register("delay", Param("samples", int, check=_non_negative))
+def _delay(audio, samples):
+    return apply_delay(audio, samples)
+
+
+@register(
+    "clipping",
+    Param("samples", int, 0, _non_negative),
+    Param("percent_samples", float, 0.0, _between(0, 100)),
+    Param("threshold_samples", int, 0, _non_negative),
+    check=lambda step: (
+        "only specify one of samples or percent_samples"
+        if step["samples"] and step["percent_samples"]
+        else None
+    ),
+)
+def _clipping(audio, samples, percent_samples, threshold_samples):
+    return apply_clipping(audio, samples, percent_samples / 100.0, threshold_samples)
+
+
+@register(
+    "wow_flutter",
+    Param("intensity", float, 1.5, _between(0, 100)),
+    Param("frequency", float, 0.5, _positive),
+    Param("upsampling_factor", float, 5.0, _positive),
+)
+def _wow_flutter(audio, intensity, frequency, upsampling_factor):
+    return apply_wow_flutter(audio, intensity, frequency, upsampling_factor)
+
+
+@register("aliasing", Param("dest_frequency", float, 8000.0, _positive))
+def _aliasing(audio, dest_frequency):
+    return apply_aliasing(audio, dest_frequency)
+
+
+@register("harmonic_distortion", Param("num_passes", int, 3, _non_negative))
+def _harmonic_distortion(audio, num_passes):
+    return apply_harmonic_distortion(audio, num_passes)
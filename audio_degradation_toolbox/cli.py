@@ -1,36 +1,91 @@
 from .core import Degradation
 from .playback import playback_shim
+from .batch import run_batch
+from .stream import stream_degradations, BLOCK_SIZE
+from .chain import Chain
+from .augment import Augmentation
+from .plan import compile_plan, describe_plan
+from .hooks import Trace, print_step
+from .output_cache import (
+    DEFAULT_MAX_BYTES,
+    OutputCache,
+    describe_stats,
+    format_size,
+    parse_size,
+    uncacheable,
+)
 import argparse
 import json
+import os
+import sys
 
 INTRO = """
 Apply controlled degradations to an audio file, specified in a JSON file containing an array of degradations (executed in order).
 
 Paths are relative to the execution dir, and square brackets denote optional arguments along with their default values.
 
-    { "name": "noise", ["snr": 20, "color": "pink"] }
+    { "name": "noise", ["snr": 20, "color": "pink", "seed": INT] }
     { "name": "mp3", ["bitrate": 320] }
     { "name": "gain", ["volume": 10.0] }
     { "name": "normalize" }
-    { "name": "low_pass", ["cutoff": 1000.0] }
-    { "name": "high_pass", ["cutoff": 1000.0] }
+    { "name": "low_pass", ["cutoff": 1000.0, "type": "rc", "order": 1, "ripple": 1.0, "attenuation": 40.0, "zero_phase": false] }
+    { "name": "high_pass", ["cutoff": 1000.0, "type": "rc", "order": 1, "ripple": 1.0, "attenuation": 40.0, "zero_phase": false] }
+    { "name": "band_pass", ["low_cutoff": 300.0, "high_cutoff": 3400.0, "type": "rc", "order": 1, "ripple": 1.0, "attenuation": 40.0, "zero_phase": false] }
     { "name": "trim_millis", ["amount": 100, "offset": 0] }
-    { "name": "mix", "path": STRING, ["snr": 20.0] }
-    { "name": "speedup", "speed": FLOAT }
-    { "name": "resample", "rate": INT }
-    { "name": "pitch_shift", "octaves": FLOAT }
-    { "name": "dynamic_range_compression", ["threshold": -20.0, "ratio": 4.0, "attack": 5.0, "release": 50.0] }
+    { "name": "mix", "path": STRING, ["snr": 20.0, "offset": 0.0 or "random"] }
+    { "name": "speedup", "speed": FLOAT, ["quality": "medium"] }
+    { "name": "resample", "rate": INT, ["quality": "medium"] }
+    { "name": "pitch_shift", "octaves": FLOAT, ["engine": "resample", "quality": "medium"] }
+    { "name": "dynamic_range_compression", ["threshold": -20.0, "ratio": 4.0, "attack": 5.0, "release": 50.0, "knee": 0.0, "sample_accurate": false] }
     { "name": "impulse_response", "path": STRING }
     { "name": "equalizer", "frequency": FLOAT, ["bandwidth": 1.0, "gain": -3.0] }
-    { "name": "time_stretch", "factor": FLOAT }
+    { "name": "equalizer", "bands": [{ "frequency": FLOAT, ["bandwidth": 1.0, "gain": -3.0] }, ...] }
+    { "name": "time_stretch", "factor": FLOAT, ["engine": "phase_vocoder"] }
     { "name": "delay", "samples": INT }
-    { "name": "clipping", ["samples": 0, "percent_samples": 0.0] }
+    { "name": "clipping", ["samples": 0, "percent_samples": 0.0, "threshold_samples": 0] }
     { "name": "wow_flutter", ["intensity": 1.5, "frequency": 0.5, "upsampling_factor": 5.0 ] }
     { "name": "aliasing", ["dest_frequency": 8000.0] }
     { "name": "harmonic_distortion", ["num_passes": 3] }
+
+With --batch, every input_path may be a file, a glob or a directory (searched recursively), and output_path is an output directory or a template using the fields {stem}, {name} and {reldir}, e.g. "out/{reldir}/{stem}_degraded.wav".
+
+time_stretch and pitch_shift take an engine, phase_vocoder or wsola (faster, time-domain); pitch_shift's default engine, resample, only changes the sample rate. resample, speedup and pitch_shift filter at a quality of fast, medium or high.
+
+The filter type of low_pass, high_pass and band_pass is one of rc (pydub's first order filter), butter, cheby1, cheby2, ellip or bessel; zero_phase runs it forward and backward.
+
+Consecutive gain, low_pass, high_pass, band_pass, equalizer and delay steps are fused into one filter cascade applied in a single pass; --dump-plan prints the resulting plan.
+
+Inputs are downmixed to mono unless --multichannel is given, which keeps every channel through the degradations and in the output WAV; mix files and impulse responses are mono and apply to every channel.
+
+With --augment N, any parameter may instead be a distribution, {"uniform": [low, high]}, {"loguniform": [low, high]}, {"normal": [mean, std]} (clipped to the parameter's range), {"randint": [low, high]} or {"choice": [...]}, sampled anew for each of N variants of the input, which is decoded once. --seed makes the variants reproducible, and output_path is an output directory or a template using the fields {stem}, {name} and {index}.
+
+With --profile, the wall time, CPU time, input and output length and peak memory growth of every step (per input file in batch mode) are written to a JSON trace.
+
+With --stream, the input is degraded in blocks of --block-size samples so long recordings need bounded memory. gain, normalize, low_pass, high_pass, band_pass (unless zero phase), equalizer, noise, mix, impulse_response, delay and harmonic_distortion run block by block; any other degradation (and --trim) is reported and run on a full buffer.
+
+With --cache DIR, outputs are kept in DIR under a hash of the input file's bytes, the chain with its defaults filled in, the contents of its IR and mix files, the load options and the toolbox version, and a later run with the same ones copies the output from there (or hard links it, with --cache-link) instead of degrading the input again. The least recently used outputs are evicted beyond --cache-size, and --cache-stats prints the cache's hit rate and the bytes it has saved. Chains with noise steps without a seed, or mixes at a random offset, aren't cached.
 """
 
 
+def variant_path(input_path, index, output_template):
+    """
+    Format the output template with the {stem}, {name} and {index} of a
+    variant; a template without fields is an output directory
+    """
+    name = os.path.basename(input_path)
+    stem = os.path.splitext(name)[0]
+    if "{" not in output_template:
+        return os.path.join(output_template, "{0}_{1}.wav".format(stem, index))
+    return output_template.format(stem=stem, name=name, index=index)
+
+
+def _size(text):
+    try:
+        return parse_size(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
 def main():
     parser = argparse.ArgumentParser(
         prog="audio-degradation-toolbox",
@@ -50,21 +105,237 @@ def main():
     parser.add_argument(
         "-t", "--trim", action="store_true", help="Trim trailing and leading silences"
     )
-    parser.add_argument("input_path", help="Path to input file")
-    parser.add_argument("output_path", help="Path to output WAV file")
+    parser.add_argument(
+        "-b",
+        "--batch",
+        action="store_true",
+        help="Degrade many inputs on a pool of worker processes",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of worker processes in batch mode (default: one per CPU)",
+    )
+    parser.add_argument(
+        "-m",
+        "--multichannel",
+        action="store_true",
+        help="Keep every channel instead of downmixing the input to mono",
+    )
+    parser.add_argument(
+        "-s",
+        "--stream",
+        action="store_true",
+        help="Degrade block by block with bounded memory",
+    )
+    parser.add_argument(
+        "--block-size",
+        type=int,
+        default=BLOCK_SIZE,
+        help="Block size in samples for --stream (default: {0})".format(BLOCK_SIZE),
+    )
+    parser.add_argument(
+        "--dump-plan",
+        action="store_true",
+        help="Print the degradation plan, showing which linear steps are fused",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="TRACE_JSON",
+        help="Write the wall time, CPU time, lengths and memory growth of every step to a JSON trace",
+    )
+    parser.add_argument(
+        "-a",
+        "--augment",
+        type=int,
+        metavar="N",
+        help="Write N variants of the input, sampling every distribution in the degradations anew for each",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed for --augment, to reproduce the same variants",
+    )
+    parser.add_argument(
+        "--cache",
+        metavar="DIR",
+        help="Keep outputs in DIR and reuse them for the same input, degradations and options",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=_size,
+        default=DEFAULT_MAX_BYTES,
+        metavar="SIZE",
+        help="Evict the least recently used outputs beyond SIZE, e.g. 500M or 10G (default: {0})".format(
+            format_size(DEFAULT_MAX_BYTES)
+        ),
+    )
+    parser.add_argument(
+        "--cache-link",
+        action="store_true",
+        help="Hard link outputs to the cache instead of copying them",
+    )
+    parser.add_argument(
+        "--cache-stats",
+        action="store_true",
+        help="Print the hit rate and bytes saved of the --cache and exit",
+    )
+    parser.add_argument(
+        "input_path",
+        nargs="*",
+        help="Path to input file (batch mode: files, globs or directories)",
+    )
+    parser.add_argument(
+        "output_path",
+        nargs="?",
+        help="Path to output WAV file (batch mode: output directory or template)",
+    )
     args = parser.parse_args()
 
-    deg = Degradation(path=args.input_path, trim_on_load=args.trim)
+    cache = None
+    if args.cache:
+        cache = OutputCache(args.cache, max_bytes=args.cache_size, link=args.cache_link)
+    if args.cache_stats:
+        if cache is None:
+            parser.error("--cache-stats needs --cache")
+        print(describe_stats(cache.stats(), cache.max_bytes))
+        return
 
+    # the input paths take every positional argument, leaving the last one
+    if args.output_path is None and len(args.input_path) > 1:
+        args.output_path = args.input_path.pop()
+    if args.output_path is None:
+        parser.error("the following arguments are required: input_path, output_path")
+
+    degradations = []
     if args.degradations_file:
         with open(args.degradations_file) as f:
             degradations = json.load(f)
 
-            if args.play:
-                print("Playing audio before degradations")
-                playback_shim(deg.file_audio)
+    # check every step before any audio is decoded
+    try:
+        chain = Augmentation(degradations) if args.augment else Chain(degradations)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.dump_plan:
+        # which steps get fused only depends on their names, so every variant
+        # of an augmentation follows the plan of its unsampled degradations
+        plan = compile_plan(chain.degradations) if args.augment else chain.plan
+        print(describe_plan(plan))
+
+    if args.play and (args.batch or args.stream):
+        parser.error("--play can't be used with --batch or --stream")
+    if args.multichannel and args.stream:
+        parser.error("--multichannel can't be used with --stream")
+    if args.profile and args.stream:
+        parser.error("--profile can't be used with --stream")
+    if args.augment is not None and args.augment < 1:
+        parser.error("--augment needs at least 1 variant")
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs needs at least 1 worker")
+    if args.augment and (args.batch or args.stream or args.play):
+        parser.error("--augment can't be used with --batch, --stream or --play")
+    if cache is not None and (args.augment or args.play):
+        parser.error("--cache can't be used with --augment or --play")
+    if cache is not None and uncacheable(chain):
+        print(
+            "Not caching: {0}, so its output is random".format(uncacheable(chain)),
+            file=sys.stderr,
+        )
+        cache = None
+
+    trace = Trace() if args.profile else None
+
+    if args.batch:
+        failures = run_batch(
+            args.input_path,
+            args.output_path,
+            chain,
+            jobs=args.jobs,
+            trim_on_load=args.trim,
+            block_size=args.block_size if args.stream else None,
+            mono=not args.multichannel,
+            trace=trace,
+            cache=cache,
+        )
+        if trace:
+            trace.dump(args.profile)
+        sys.exit(1 if failures else 0)
+
+    if len(args.input_path) > 1:
+        parser.error("multiple input paths need --batch")
+
+    if args.augment:
+        deg = Degradation(
+            path=args.input_path[0],
+            trim_on_load=args.trim,
+            mono=not args.multichannel,
+        )
+        for variant in chain.variants(
+            deg.file_audio,
+            args.augment,
+            seed=args.seed,
+            hooks=[trace] if trace else (),
+        ):
+            output_path = variant_path(
+                args.input_path[0], variant.index, args.output_path
+            )
+            output_dir = os.path.dirname(output_path)
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+            variant.audio.export(output_path)
+            print(
+                "Variant {0} -> {1} with degradations {2}".format(
+                    variant.index, output_path, json.dumps(variant.degradations)
+                )
+            )
+        if trace:
+            trace.dump(args.profile)
+        return
+
+    def degrade():
+        if args.stream:
+            stream_degradations(
+                args.input_path[0],
+                args.output_path,
+                chain,
+                block_size=args.block_size,
+                trim_on_load=args.trim,
+            )
+            return
+
+        deg = Degradation(
+            path=args.input_path[0],
+            trim_on_load=args.trim,
+            mono=not args.multichannel,
+            hooks=[print_step],
+        )
+        if trace:
+            deg.add_hook(trace)
+
+        if args.play:
+            print("Playing audio before degradations")
+            playback_shim(deg.file_audio)
+
+        deg.apply_degradations(chain, play_=args.play)
 
-            for degradation in degradations:
-                deg.apply_degradation(degradation, play_=args.play)
+        deg.file_audio.export(args.output_path)
 
-    deg.file_audio.export(args.output_path)
+    if cache is None:
+        degrade()
+    elif cache.produce(
+        args.input_path[0],
+        args.output_path,
+        chain,
+        degrade,
+        trim_on_load=args.trim,
+        mono=not args.multichannel,
+        block_size=args.block_size if args.stream else None,
+    ):
+        print("Served {0} from the cache".format(args.output_path))
+    if trace:
+        trace.dump(args.profile)
@@ -1,158 +1,104 @@
-import numpy
-from pydub import AudioSegment
-from pydub.utils import get_array_type
 from .playback import playback_shim
-from acoustics import Signal
-from acoustics.generator import noise
-import math
-from tempfile import NamedTemporaryFile
-from .degradations import (
-    trim,
-    apply_noise,
-    apply_mix,
-    mp3_transcode,
-    apply_gain,
-    apply_normalization,
-    apply_high_pass,
-    apply_low_pass,
-    trim_millis,
-    apply_speedup,
-    apply_resample,
-    apply_pitch_shift,
-    apply_dynamic_range_compression,
-    apply_impulse_response,
-    apply_time_stretch,
-    apply_eq,
-    apply_delay,
-    apply_clipping,
-    apply_wow_flutter,
-    apply_aliasing,
-    apply_harmonic_distortion,
-)
+from .degradations import trim
 from .audio import Audio
+from .chain import Chain, Step, resolve_step
+from .plan import FusedFilter
+from .hooks import StepTimer
+import numpy
+
+
+def degrade(data, sample_rate, degradations, sample_width=2, hooks=()):
+    """
+    Apply a Chain, or a list of degradations, to a float array in [-1.0, 1.0]
+    (1-D for mono, (channels, samples) otherwise) and return the degraded
+    array, with the same dtype, and its sample rate, which steps that
+    resample (resample, speedup, and pitch_shift's resample engine) change
+
+    No files are read or written besides the chain's mix and IR files, and
+    only mp3 converts to sample_width byte PCM and back. A C-contiguous
+    float32 or float64 array is used without a copy, and never modified. Its
+    contents aren't remembered between calls either (the caches of analyses
+    are keyed on contents), so a loader can refill the same buffer each time.
+    """
+    data = numpy.asarray(data)
+    if data.dtype not in (numpy.float32, numpy.float64):
+        raise ValueError(
+            "expected a float32 or float64 array, got {0}".format(data.dtype)
+        )
+    if data.ndim not in (1, 2):
+        raise ValueError(
+            "expected a (samples,) or (channels, samples) array, got shape {0}".format(
+                data.shape
+            )
+        )
+
+    deg = Degradation(
+        audio=Audio(data=data, sample_rate=sample_rate, sample_width=sample_width),
+        hooks=hooks,
+    )
+    deg.apply_degradations(degradations)
+
+    out = deg.file_audio.data
+    if numpy.may_share_memory(out, data):
+        # e.g. a chain that's a no-op, or a trim that returned a view
+        out = out.copy()
+    return out.astype(data.dtype, copy=False), deg.file_audio.sample_rate
 
 
 class Degradation(object):
-    def __init__(self, path, ext=None, trim_on_load=False):
-        self.file_audio = Audio(path, ext=ext)
+    def __init__(
+        self, path=None, ext=None, trim_on_load=False, audio=None, mono=True, hooks=()
+    ):
+        if (path is None) == (audio is None):
+            raise ValueError("Pass one of path[+ext] or audio")
+
+        self.path = path
+        # called with a hooks.StepEvent after every step
+        self.hooks = list(hooks)
+        self.file_audio = (
+            audio if audio is not None else Audio(path, ext=ext, mono=mono)
+        )
         if trim_on_load:
             self.file_audio = trim(self.file_audio)
 
-    def apply_degradation(self, d, play_=False):
-        name = d["name"]
-        params = ""
+    def apply_degradations(self, degradations, play_=False):
+        """
+        Apply a Chain, or a list of degradations which are all validated
+        before the first one runs; runs of linear filters are fused
+        """
+        chain = degradations if isinstance(degradations, Chain) else Chain(degradations)
+        for step in chain.plan:
+            self.apply_degradation(step, play_=play_)
 
-        if name == "noise":
-            color = d.get("color", "pink")
-            snr = d.get("snr", 20)
-            params = "color: {0}, snr: {1}".format(color, snr)
-            self.file_audio = apply_noise(self.file_audio, color, snr)
-        elif name == "mp3":
-            bitrate = d.get("bitrate", 320)
-            params = "bitrate: {0}".format(bitrate)
-            self.file_audio = mp3_transcode(self.file_audio, bitrate)
-        elif name == "gain":
-            volume = float(d.get("volume", 10.0))
-            self.file_audio = apply_gain(self.file_audio, volume)
-            params = "volume: {0}".format(volume)
-        elif name == "normalize":
-            self.file_audio = apply_normalization(self.file_audio)
-        elif name == "low_pass":
-            cutoff = float(d.get("cutoff", 1000.0))
-            self.file_audio = apply_low_pass(self.file_audio, cutoff)
-            params = "cutoff: {0}".format(cutoff)
-        elif name == "high_pass":
-            cutoff = float(d.get("cutoff", 1000.0))
-            self.file_audio = apply_high_pass(self.file_audio, cutoff)
-            params = "cutoff: {0}".format(cutoff)
-        elif name == "trim_millis":
-            amount = int(d.get("amount", 100))
-            offset = int(d.get("offset", 0))
-            self.file_audio = trim_millis(self.file_audio, amount, offset)
-            params = "amount: {0}, offset: {1}".format(amount, offset)
-        elif name == "mix":
-            mix_path = d["path"]
-            snr = float(d.get("snr", 20.0))
-            self.file_audio = apply_mix(self.file_audio, mix_path, snr)
-            params = "mix_path: {0}, snr: {1}".format(mix_path, snr)
-        elif name == "speedup":
-            speed = float(d["speed"])
-            self.file_audio = apply_speedup(self.file_audio, speed)
-            params = "speed: {0}".format(speed)
-        elif name == "resample":
-            rate = int(d["rate"])
-            self.file_audio = apply_resample(self.file_audio, rate)
-            params = "rate: {0}".format(rate)
-        elif name == "pitch_shift":
-            octaves = float(d["octaves"])
-            self.file_audio = apply_pitch_shift(self.file_audio, octaves)
-            params = "octaves: {0}".format(octaves)
-        elif name == "dynamic_range_compression":
-            threshold = float(d.get("threshold", -20.0))
-            ratio = float(d.get("ratio", 4.0))
-            attack = float(d.get("attack", 5.0))
-            release = float(d.get("release", 50.0))
-            self.file_audio = apply_dynamic_range_compression(
-                self.file_audio, threshold, ratio, attack, release
-            )
-            params = "threshold: {0}, ratio: {1}, attack: {2}, release: {3}".format(
-                threshold, ratio, attack, release
-            )
-        elif name == "impulse_response":
-            path = d["path"]
-            self.file_audio = apply_impulse_response(self.file_audio, path)
-            params = "path: {0}".format(path)
-        elif name == "equalizer":
-            frequency = float(d["frequency"])
-            bandwidth = float(d.get("bandwidth", 1.0))
-            gain = float(d.get("gain", -3.0))
-            self.file_audio = apply_eq(self.file_audio, frequency, bandwidth, gain)
-            params = "frequency: {0}, bandwidth: {1}, gain: {2}".format(
-                frequency, bandwidth, gain
-            )
-        elif name == "time_stretch":
-            factor = float(d["factor"])
-            self.file_audio = apply_time_stretch(self.file_audio, factor)
-            params = "factor: {0}".format(factor)
-        elif name == "delay":
-            n_samples = int(d["samples"])
-            self.file_audio = apply_delay(self.file_audio, n_samples)
-            params = "samples: {0}".format(n_samples)
-        elif name == "clipping":
-            n_samples = int(d.get("samples", 0))
-            percent_samples = float(d.get("percent_samples", 0.0)) / 100.0
-            self.file_audio = apply_clipping(
-                self.file_audio, n_samples, percent_samples
-            )
-            params = "samples: {0}, percent_samples: {1}".format(
-                n_samples, percent_samples
-            )
-        elif name == "wow_flutter":
-            intensity = float(d.get("intensity", 1.5))
-            frequency = float(d.get("frequency", 0.5))
-            upsampling_factor = float(d.get("upsampling_factor", 5.0))
-            self.file_audio = apply_wow_flutter(
-                self.file_audio, intensity, frequency, upsampling_factor
-            )
-            params = "intensity: {0}, frequency: {1}, upsampling_factor: {2}".format(
-                intensity, frequency, upsampling_factor
-            )
-        elif name == "aliasing":
-            dest_frequency = float(d.get("dest_frequency", 8000.0))
-            self.file_audio = apply_aliasing(self.file_audio, dest_frequency)
-            params = "dest_frequency: {0}".format(dest_frequency)
-        elif name == "harmonic_distortion":
-            num_passes = int(d.get("num_passes", 3))
-            self.file_audio = apply_harmonic_distortion(self.file_audio, num_passes)
-            params = "num_passes: {0}".format(num_passes)
+    def add_hook(self, hook):
+        """Call hook(event) with a hooks.StepEvent after every step"""
+        self.hooks.append(hook)
+
+    def apply_degradation(self, d, play_=False):
+        if isinstance(d, FusedFilter):
+            step = d
+            name = d.name
+            params = {"steps": [dict(s) for s in d.steps]}
         else:
-            raise ValueError("Invalid degradation {0}".format(name))
+            step = d if isinstance(d, Step) else resolve_step(d)
+            name = step["name"]
+            params = {k: v for k, v in step.items() if k != "name"}
 
-        print(
-            "Applied degradation {0}{1}".format(
-                name, " with params {0}".format(params) if params else ""
+        timer = StepTimer()
+        input_samples = self.file_audio.data.shape[-1]
+        timer.start()
+        self.file_audio = step.apply(self.file_audio)
+        if self.hooks:
+            event = timer.event(
+                self.path,
+                name,
+                params,
+                input_samples,
+                self.file_audio.data.shape[-1],
             )
-        )
+            for hook in self.hooks:
+                hook(event)
+
         if play_:
             print("Playing audio after degradation")
             playback_shim(self.file_audio)
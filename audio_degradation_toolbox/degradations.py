@@ -1,183 +1,379 @@
 import numpy
-import pydub.effects as pydub_effects
-import pydub.scipy_effects
-from acoustics.generator import noise
+from pydub import AudioSegment
+import functools
+import io
 import math
 from tempfile import NamedTemporaryFile
-from .audio import Audio
-import array
+from .audio import Audio, _deinterleave, _interleave
+from .cache import LRUCache
+from .lazy import lazy_import
+from .noise import noise_bank
+from .resample import resample
+from .stretch import pitch_shift, time_stretch
+import os
+import subprocess
 import sys
-import scipy.signal as scipy_signal
-import scipy.interpolate as scipy_interpolate
-import librosa
-import numba
-from pysndfx import AudioEffectsChain
+
+librosa = lazy_import("librosa")
+numba = lazy_import("numba")
+scipy_fft = lazy_import("scipy.fft")
+scipy_signal = lazy_import("scipy.signal")
+soundfile = lazy_import("soundfile")
+
+# decoded and resampled impulse responses and their spectra, shared by every
+# Degradation in the process
+ir_cache = LRUCache(max_bytes=256 * 1024 * 1024)
+
+# decoded and resampled mix sources, shared the same way
+mix_cache = LRUCache(max_bytes=256 * 1024 * 1024)
+
+# samples an mp3 round trip is delayed by without a LAME header to undo it:
+# LAME's encoder delay plus the delay of the layer III decoder
+MP3_DELAY = 576 + 529
+
+# designs of the low, high and band pass filters: pydub's first order RC
+# filter, or an IIR design from scipy.signal of any order
+FILTER_TYPES = ("rc", "butter", "cheby1", "cheby2", "ellip", "bessel")
 
 
 def mp3_transcode(audio, bitrate):
+    try:
+        return _mp3_transcode_pipe(audio, bitrate)
+    except (ImportError, OSError, RuntimeError, subprocess.CalledProcessError):
+        # e.g. no soundfile, or a libsndfile too old to decode mp3
+        return _mp3_transcode_tempfile(audio, bitrate)
+
+
+def _mp3_transcode_pipe(audio, bitrate):
+    # encode in memory through ffmpeg's stdin/stdout, passing the float
+    # samples straight through, and decode the mp3 in process with libsndfile
+    encoded = subprocess.run(
+        [
+            AudioSegment.converter,
+            "-v",
+            "error",
+            "-f",
+            "f32le",
+            "-ac",
+            str(audio.channels),
+            "-ar",
+            str(audio.sample_rate),
+            "-i",
+            "pipe:0",
+            "-f",
+            "mp3",
+            "-b:a",
+            "{0}k".format(bitrate),
+            "pipe:1",
+        ],
+        input=_interleave(audio.data).astype("<f4").tobytes(),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=True,
+    ).stdout
+    decoded, _ = soundfile.read(io.BytesIO(encoded), dtype="float32", always_2d=True)
+
+    # a non-seekable output gets no LAME header for the decoder to trim the
+    # delay and padding by, so cut the input's samples back out here
+    n_samples = audio.data.shape[-1]
+    decoded = decoded[MP3_DELAY : MP3_DELAY + n_samples]
+    if len(decoded) < n_samples:
+        decoded = numpy.pad(decoded, [(0, n_samples - len(decoded)), (0, 0)])
+    return Audio(
+        data=_deinterleave(decoded.reshape(-1), audio.channels), old_audio=audio
+    )
+
+
+def _mp3_transcode_tempfile(audio, bitrate):
     # do a pydub round trip through an mp3 file
     ret = None
     with NamedTemporaryFile() as tmp_mp3_f:
         audio.sound.export(
             out_f=tmp_mp3_f.name, format="mp3", bitrate="{0}k".format(bitrate)
         )
-        ret = Audio(path=tmp_mp3_f, ext="mp3")
+        ret = Audio(path=tmp_mp3_f, ext="mp3", mono=False)
     return ret
 
 
 def apply_gain(audio, gain_dbs):
-    return Audio(sound=audio.sound.apply_gain(gain_dbs), old_audio=audio)
-
+    return Audio(data=audio.data * _db_to_float(gain_dbs), old_audio=audio)
 
-def apply_normalization(audio):
-    return Audio(sound=pydub_effects.normalize(audio.sound), old_audio=audio)
 
-
-def apply_low_pass(audio, cutoff):
-    return Audio(
-        sound=pydub_effects.low_pass_filter(audio.sound, cutoff), old_audio=audio
+def apply_normalization(audio, headroom=0.1):
+    # same as pydub.effects.normalize: peak at headroom dB below full scale
+    peak = numpy.max(numpy.abs(audio.data))
+    if peak == 0:
+        return audio
+    return Audio(data=audio.data * (_db_to_float(-headroom) / peak), old_audio=audio)
+
+
+def apply_low_pass(
+    audio,
+    cutoff,
+    filter_type="rc",
+    order=1,
+    ripple=1.0,
+    attenuation=40.0,
+    zero_phase=False,
+):
+    sos = _filter_sos(
+        "lowpass", cutoff, audio.sample_rate, filter_type, order, ripple, attenuation
+    )
+    return _apply_sos(audio, sos, filter_type == "rc", zero_phase)
+
+
+def apply_high_pass(
+    audio,
+    cutoff,
+    filter_type="rc",
+    order=1,
+    ripple=1.0,
+    attenuation=40.0,
+    zero_phase=False,
+):
+    sos = _filter_sos(
+        "highpass", cutoff, audio.sample_rate, filter_type, order, ripple, attenuation
+    )
+    return _apply_sos(audio, sos, filter_type == "rc", zero_phase)
+
+
+def apply_band_pass(
+    audio,
+    low_cutoff,
+    high_cutoff,
+    filter_type="rc",
+    order=1,
+    ripple=1.0,
+    attenuation=40.0,
+    zero_phase=False,
+):
+    sos = _filter_sos(
+        "bandpass",
+        (low_cutoff, high_cutoff),
+        audio.sample_rate,
+        filter_type,
+        order,
+        ripple,
+        attenuation,
     )
+    return _apply_sos(audio, sos, filter_type == "rc", zero_phase)
 
 
-def apply_high_pass(audio, cutoff):
-    return Audio(
-        sound=pydub_effects.high_pass_filter(audio.sound, cutoff), old_audio=audio
-    )
+def _apply_sos(audio, sos, rc, zero_phase):
+    x = audio.data
+    if x.shape[-1] == 0:
+        return audio
+    if zero_phase:
+        # forward and backward, so the magnitude response is squared; short
+        # inputs get less padding than sosfiltfilt's default
+        padlen = min(3 * (2 * len(sos) + 1), x.shape[-1] - 1)
+        filtered = scipy_signal.sosfiltfilt(sos, x, padlen=padlen)
+    else:
+        filtered, _ = _sos_filter(x, sos, rc)
+    return Audio(data=filtered.astype(x.dtype, copy=False), old_audio=audio)
 
 
 def trim_millis(audio, amount, offset):
-    if amount >= len(audio.sound):
+    if amount >= len(audio):
         print(
-            "Not trimming amount {0} longer than file {1}".format(
-                amount, len(audio.sound)
-            ),
+            "Not trimming amount {0} longer than file {1}".format(amount, len(audio)),
             file=sys.stderr,
         )
         return audio
 
     ret = None
     if offset == -1:
-        ret = Audio(sound=audio.sound[: len(audio.sound) - amount], old_audio=audio)
+        ret = Audio(
+            data=audio.data[..., : _frames(audio, len(audio) - amount)],
+            old_audio=audio,
+        )
     else:
         ret = Audio(
-            sound=(audio.sound[: offset + 1] + audio.sound[offset + amount + 1 :]),
+            data=numpy.concatenate(
+                (
+                    audio.data[..., : _frames(audio, offset + 1)],
+                    audio.data[..., _frames(audio, offset + amount + 1) :],
+                ),
+                axis=-1,
+            ),
             old_audio=audio,
         )
 
-    print("New length: {0}".format(len(ret.sound)))
+    print("New length: {0}".format(len(ret)))
     return ret
 
 
-def apply_mix(audio, mix, snr):
-    mix_audio = Audio(path=mix)
-    mix_audio = _stretch_mix(audio, mix_audio)
+def apply_mix(audio, mix, snr, offset=0):
+    """
+    Mix in a file at the given SNR, looped or cut to the length of the audio
+    and starting `offset` milliseconds into the mix file, or at a random
+    position if offset is "random"
+    """
+    _, mix_data = _load_source(mix_cache, mix, audio.sample_rate)
+
+    if offset == "random":
+        start = numpy.random.randint(len(mix_data))
+    else:
+        start = _frames(audio, offset)
 
-    mix_data = numpy.frombuffer(
-        mix_audio.samples, dtype=mix_audio.sound.array_type
-    ).astype(numpy.float64)
-    return _mix(audio, mix_data, snr)
+    # the (mono) mix is added to every channel
+    return _mix(audio, _stretch_mix(mix_data, audio.data.shape[-1], start), snr)
 
 
-def apply_noise(audio, color, snr):
-    noise_data = noise(len(audio.samples), color=color)
+def apply_noise(audio, color, snr, seed=None):
+    # one draw for every channel, each getting its own stretch of the noise
+    rng = numpy.random.RandomState(seed)
+    noise_data = noise_bank.draw(color, audio.data.size, rng)
+    noise_data = noise_data.reshape(audio.data.shape)
     return _mix(audio, noise_data, snr)
 
 
-def apply_speedup(audio, speed):
-    return apply_resample(audio, audio.sample_rate / speed)
+def apply_speedup(audio, speed, quality="medium"):
+    return apply_resample(audio, audio.sample_rate / speed, quality)
 
 
-def apply_resample(audio, new_sample_rate):
+def apply_resample(audio, new_sample_rate, quality="medium"):
+    # truncated to an integer rate like pydub's set_frame_rate, but converted
+    # with a polyphase filter rather than its unfiltered interpolation
     int_sample_rate = int(new_sample_rate)
-    return Audio(sound=audio.sound.set_frame_rate(int_sample_rate), old_audio=audio)
+    if int_sample_rate == audio.sample_rate:
+        return audio
+    resampled = resample(audio.data, audio.sample_rate, int_sample_rate, quality)
+    return Audio(data=resampled, sample_rate=int_sample_rate, old_audio=audio)
+
+
+def apply_pitch_shift(audio, octaves, engine="resample", quality="medium"):
+    if engine != "resample":
+        shifted = pitch_shift(audio.data, octaves, audio.sample_rate, engine, quality)
+        return Audio(data=shifted, old_audio=audio)
+
+    new_sample_rate = int(audio.sample_rate * (2.0**octaves))
+    return apply_resample(audio, new_sample_rate, quality)
+
+
+def apply_dynamic_range_compression(
+    audio, threshold, ratio, attack, release, knee=0.0, sample_accurate=False
+):
+    """
+    Feed-forward compressor with the detector of pydub's
+    compress_dynamic_range: the RMS of the last `attack` ms (over every
+    channel) sets a target attenuation, which the gain ramps up to linearly in
+    `attack` ms and releases from with a `release` ms time constant. knee is
+    the width in dB of a soft knee centred on the threshold.
+
+    The ramp is updated every millisecond with the gain interpolated in
+    between, or every sample (compiled with numba) if sample_accurate.
+    """
+    x = audio.data
+    n_samples = x.shape[-1]
+    if n_samples == 0:
+        return audio
 
+    frames = x.reshape(-1, n_samples)
+    out = numpy.empty_like(frames)
+
+    samples_per_ms = audio.sample_rate / 1000.0
+    look = max(1, int(attack * samples_per_ms))
+    step = 1 if sample_accurate else max(1, int(round(samples_per_ms)))
+    ramp = _compiled_compressor_ramp() if sample_accurate else _compressor_ramp
+    # how far the attenuation moves toward its target at every step
+    attack_rate = step / (attack * samples_per_ms) if attack > 0 else numpy.inf
+    release_rate = min(1.0, step / (release * samples_per_ms)) if release > 0 else 1.0
+
+    # the attenuation (in dB) at step position k * step applies to that
+    # sample, and is interpolated for the samples in between; sample 0 has an
+    # empty detector window, so no attenuation
+    attenuation = 0.0
+    chunk = _COMPRESSOR_CHUNK * step
+    for start in range(0, n_samples, chunk):
+        stop = min(start + chunk, n_samples)
+        positions = numpy.arange(start + step, stop + step, step)
+
+        # mean power over every channel of the window before each position
+        low = max(start + step - look, 0)
+        power = numpy.mean(
+            numpy.square(frames[:, low:stop], dtype=numpy.float64), axis=0
+        )
+        cumulative = numpy.concatenate(([0.0], numpy.cumsum(power)))
+        ends = numpy.minimum(positions, stop)
+        begins = numpy.minimum(numpy.maximum(positions - look, low), ends - 1)
+        window = (cumulative[ends - low] - cumulative[begins - low]) / (ends - begins)
+        level = 10 * numpy.log10(numpy.maximum(window, 1e-20))
 
-def apply_pitch_shift(audio, octaves):
-    new_sample_rate = int(audio.sample_rate * (2.0 ** octaves))
-    return apply_resample(audio, new_sample_rate)
+        targets = _compressor_gain_curve(level - threshold, ratio, knee)
+        attenuations = ramp(targets, attenuation, attack_rate, release_rate)
 
+        gains = 10 ** (-numpy.concatenate(([attenuation], attenuations)) / 20)
+        if step > 1:
+            gains = numpy.interp(
+                numpy.arange(start, stop),
+                numpy.concatenate(([start], positions)),
+                gains,
+            )
+        out[:, start:stop] = frames[:, start:stop] * gains[: stop - start]
+        attenuation = attenuations[-1]
 
-def apply_dynamic_range_compression(audio, threshold, ratio, attack, release):
-    return Audio(
-        sound=pydub_effects.compress_dynamic_range(
-            audio.sound, threshold, ratio, attack, release
-        ),
-        old_audio=audio,
-    )
+    return Audio(data=out.reshape(x.shape), old_audio=audio)
 
 
 def apply_impulse_response(audio, ir_path):
-    ir = Audio(path=ir_path)
-
-    if ir.sample_rate != audio.sample_rate:
-        ir = apply_resample(ir, audio.sample_rate)
-
-    conv_s = scipy_signal.fftconvolve(audio.samples, ir.samples)
-    conv_s = _normalize(conv_s, audio.sound.sample_width * 8)
+    key, ir = _load_source(ir_cache, ir_path, audio.sample_rate)
 
-    conv_s = array.array(audio.sound.array_type, conv_s.astype(audio.sound.array_type))
+    n_fft = _ir_fft_size(len(ir))
+    conv_s = _overlap_add(audio.data, _ir_spectrum(key, ir, n_fft), len(ir), n_fft)
+    return Audio(data=_normalize(conv_s), old_audio=audio)
 
-    conv = Audio(samples=conv_s, old_audio=audio)
-    return conv
 
-
-def apply_time_stretch(audio, factor):
-    samples = numpy.frombuffer(audio.samples, dtype=audio.sound.array_type).astype(
-        numpy.float64
-    )
-    stretched = librosa.effects.time_stretch(samples, factor)
-    stretched = _normalize(stretched, audio.sound.sample_width * 8)
-
-    return Audio(
-        samples=array.array(
-            audio.sound.array_type, stretched.astype(audio.sound.array_type)
-        ),
-        old_audio=audio,
+def apply_time_stretch(audio, factor, engine="phase_vocoder"):
+    stretched = time_stretch(
+        audio.data, factor, audio.sample_rate, engine, normalize=True
     )
+    return Audio(data=stretched.astype(audio.data.dtype, copy=False), old_audio=audio)
 
 
 def trim(audio):
-    samples = numpy.frombuffer(audio.samples, dtype=audio.sound.array_type).astype(
-        numpy.float64
-    )
-    trimmed, _ = librosa.effects.trim(samples)
-    trimmed = _normalize(trimmed, audio.sound.sample_width * 8)
-
-    return Audio(
-        samples=array.array(
-            audio.sound.array_type, trimmed.astype(audio.sound.array_type)
-        ),
-        old_audio=audio,
-    )
+    trimmed, _ = librosa.effects.trim(audio.data)
+    return Audio(data=_normalize(trimmed), old_audio=audio)
 
 
 def apply_eq(audio, frequency, q, db):
-    fx = AudioEffectsChain().equalizer(frequency, q, db)
+    return apply_multiband_eq(audio, [(frequency, q, db)])
 
-    samples = numpy.frombuffer(audio.samples, dtype=audio.sound.array_type).astype(
-        numpy.float64
-    )
-
-    samples = fx(samples)
-    samples = _normalize(samples, audio.sound.sample_width * 8)
 
+def apply_multiband_eq(audio, bands):
+    """
+    Peaking EQ at every (frequency, q, gain in dB) band, as one pass of a
+    biquad cascade, then peak normalized
+    """
+    sos = _peaking_eq_sos(bands, audio.sample_rate)
+    filtered = scipy_signal.sosfilt(sos, audio.data)
     return Audio(
-        samples=array.array(
-            audio.sound.array_type, samples.astype(audio.sound.array_type)
-        ),
+        data=_normalize(filtered).astype(audio.data.dtype, copy=False),
         old_audio=audio,
     )
 
 
 def apply_delay(audio, n_samples):
-    samples = (
-        array.array(audio.sound.array_type, [0 for _ in range(n_samples)])
-        + audio.samples
-    )
-    return Audio(samples=samples, old_audio=audio)
-
-
-def apply_clipping(audio, n_samples, percent_samples):
+    silence = numpy.zeros(audio.data.shape[:-1] + (n_samples,), dtype=audio.data.dtype)
+    samples = numpy.concatenate((silence, audio.data), axis=-1)
+    return Audio(data=samples, old_audio=audio)
+
+
+def apply_clipping(audio, n_samples, percent_samples, threshold_samples=0):
+    """
+    Scale the audio so that n_samples of it (or a fraction percent_samples)
+    reach full scale, clip it there and normalize; without either, scale it to
+    a fixed level of its mean power first
+
+    The threshold is found by selection rather than a sort. With
+    threshold_samples, it's estimated from a strided subsample of at most that
+    many samples: treating those m samples as independent draws, the DKW
+    inequality bounds the fraction of samples actually clipped to within
+    sqrt(ln(2 / delta) / (2 * m)) of the one asked for, with probability
+    1 - delta, e.g. within 0.27 percentage points for m = 1e6 and
+    delta = 1e-6. A stride that lines up with a period of the signal can do
+    worse.
+    """
     if n_samples != 0 and percent_samples != 0.0:
         raise ValueError("only specify one of samples or percent_samples")
 
@@ -187,94 +383,107 @@ def apply_clipping(audio, n_samples, percent_samples):
 
     eps = numpy.spacing(1)
 
-    samples = numpy.frombuffer(audio.samples, dtype=audio.sound.array_type).astype(
-        numpy.complex
-    )
+    # the only copy of the input, clipped and scaled in place
+    samples = audio.data.astype(numpy.float32)
 
     if n_samples == 0 and percent_samples == 0.0:
         quant_measured = max(
-            numpy.quantile(numpy.mean(numpy.power(samples, 2.2)), 0.95), eps
+            numpy.mean(numpy.power(numpy.abs(samples), 2.2), dtype=numpy.float64), eps
         )
         quant_wanted = db2mag(-5)
-        samples_out = samples * (quant_wanted / quant_measured)
+        samples *= numpy.float32(quant_wanted / quant_measured)
     else:
-        sorted_samples = numpy.abs(samples)
-        sorted_samples.sort()
-        num_samples = len(sorted_samples)
+        num_samples = samples.size
         if n_samples == 0:
             n_samples = int(percent_samples * num_samples)
-        divisor = numpy.min(sorted_samples[num_samples - n_samples + 1 : num_samples])
-        divisor = max(divisor, eps)
-        samples_out = samples / divisor
+        divisor = max(
+            _clipping_threshold(
+                samples, num_samples - n_samples + 1, threshold_samples
+            ),
+            eps,
+        )
+        samples *= numpy.float32(1.0 / divisor)
 
-    samples_out = numpy.clip(samples_out, -1, 1)
-    samples_out *= 0.99
+    numpy.clip(samples, -1, 1, out=samples)
+    # clipping and normalizing leaves the peak at full scale
+    peak = max(samples.max(), -samples.min()) if samples.size else 0
+    if peak > 0:
+        samples *= numpy.float32(1.0 / peak)
 
-    samples_out = _normalize(samples_out, audio.sound.sample_width * 8)
+    return Audio(data=samples, old_audio=audio)
 
-    return Audio(
-        samples=array.array(
-            audio.sound.array_type, samples_out.astype(audio.sound.array_type)
-        ),
-        old_audio=audio,
-    )
+
+def _clipping_threshold(samples, rank, threshold_samples):
+    # the magnitude at rank in ascending order, from a strided subsample of
+    # at most threshold_samples (if given) at the same relative rank
+    flat = samples.reshape(-1)
+    if threshold_samples and flat.size > threshold_samples:
+        stride = -(-flat.size // threshold_samples)
+        magnitudes = numpy.abs(flat[::stride])
+        rank = int(rank * len(magnitudes) / flat.size)
+    else:
+        magnitudes = numpy.abs(flat)
+    rank = min(max(rank, 0), len(magnitudes) - 1)
+    magnitudes.partition(rank)
+    return float(magnitudes[rank])
 
 
 # straight from matlab
 def apply_wow_flutter(audio, intensity, frequency, upsampling_factor):
-    audio_out = audio.samples
+    audio_out = audio.data.copy()
 
-    fs_oversampled = audio.sample_rate * upsampling_factor
     a_m = intensity / 100.0
     f_m = frequency
 
-    num_samples = len(audio.samples)
-    len_secs = len(audio.sound) / 1000.0
+    len_secs = len(audio) / 1000.0
     num_full_periods = math.floor(len_secs * f_m)
-    num_samples_to_warp = numpy.round(num_full_periods * audio.sample_rate / f_m)
-
-    old_sample_positions_to_new_oversampled_positions = numpy.round(
-        _time_assignment_new_to_old(
-            numpy.arange(1, num_samples_to_warp) / audio.sample_rate, a_m, f_m
+    num_samples_to_warp = int(numpy.round(num_full_periods * audio.sample_rate / f_m))
+
+    # the original reads the warped positions, rounded to the nearest sample
+    # of a copy upsampled by upsampling_factor; rounding to the same grid and
+    # interpolating linearly from the original samples gives the same result
+    # without the upsampled copy, one chunk at a time to bound the temporaries
+    # a thousandth of the grid spacing is far below what the rounding can see
+    tolerance = 1e-3 / (audio.sample_rate * upsampling_factor)
+    for start in range(1, num_samples_to_warp, _WOW_FLUTTER_CHUNK):
+        new_positions = numpy.arange(
+            start, min(start + _WOW_FLUTTER_CHUNK, num_samples_to_warp)
         )
-        * fs_oversampled
-    )
-
-    audio_upsampled = apply_resample(audio, fs_oversampled).samples
-
-    for i, pos in enumerate(old_sample_positions_to_new_oversampled_positions):
-        audio_out[1 + i] = audio_upsampled[int(numpy.round(pos))]
+        warped = (
+            _time_assignment_new_to_old(
+                new_positions / audio.sample_rate, a_m, f_m, tolerance
+            )
+            * audio.sample_rate
+        )
+        warped = numpy.round(warped * upsampling_factor) / upsampling_factor
+        audio_out[..., new_positions] = _interpolate(audio.data, warped)
 
-    return Audio(samples=audio_out, sample_rate=fs_oversampled, old_audio=audio)
+    return Audio(data=audio_out, old_audio=audio)
 
 
 # from matlab
 def apply_aliasing(audio, dest_frequency):
-    n_samples = len(audio.samples)
-    n_samples_new = int(numpy.round(n_samples / audio.sample_rate * dest_frequency))
-    t_old = numpy.arange(0.0, n_samples) / audio.sample_rate
-    t_new = numpy.arange(0.0, n_samples_new) / dest_frequency
-
-    audio_samples = numpy.frombuffer(
-        audio.samples, dtype=audio.sound.array_type
-    ).astype(numpy.float64)
+    n_samples = audio.data.shape[-1]
+    n_samples_new = max(
+        1, int(numpy.round(n_samples / audio.sample_rate * dest_frequency))
+    )
 
-    interp = scipy_interpolate.interp1d(t_old, audio_samples, kind="nearest")
-    tmp = numpy.asarray([interp(t_new[x]) for x in range(len(t_new))], dtype=numpy.int)
+    # nearest neighbour decimation, as a single gather of the closest samples
+    nearest = numpy.rint(
+        numpy.arange(n_samples_new) * (audio.sample_rate / dest_frequency)
+    ).astype(numpy.intp)
+    numpy.minimum(nearest, n_samples - 1, out=nearest)
+    decimated = audio.data[..., nearest]
 
-    tmp_audio = Audio(
-        samples=array.array(audio.sound.array_type, tmp),
-        old_audio=audio,
-        sample_rate=dest_frequency,
-    )
-    return apply_resample(tmp_audio, audio.sample_rate)
+    # back up to the original rate by linear interpolation, like pydub's
+    # set_frame_rate, but at the exact (possibly fractional) rate
+    positions = numpy.arange(n_samples) * (dest_frequency / audio.sample_rate)
+    return Audio(data=_interpolate(decimated, positions), old_audio=audio)
 
 
 # quadratic distortion, approximated with sine (chebyshev polynomials?)
 def apply_harmonic_distortion(audio, num_passes):
-    audio_samples = numpy.frombuffer(
-        audio.samples, dtype=audio.sound.array_type
-    ).astype(numpy.float64)
+    audio_samples = audio.data
 
     # normalize to between -1 and 1
     a_min = audio_samples.min()
@@ -288,106 +497,281 @@ def apply_harmonic_distortion(audio, num_passes):
     # scale it back up?
     audio_samples = numpy.interp(audio_samples, (-1.0, +1.0), (a_min, a_max))
 
-    return Audio(
-        samples=array.array(audio.sound.array_type, audio_samples.astype(numpy.int)),
-        old_audio=audio,
-    )
+    return Audio(data=audio_samples, old_audio=audio)
 
 
-def trim(audio):
-    samples = numpy.frombuffer(audio.samples, dtype=audio.sound.array_type).astype(
-        numpy.float64
-    )
-    trimmed, _ = librosa.effects.trim(samples)
-    trimmed = _normalize(trimmed, audio.sound.sample_width * 8)
+def _mix(audio, mix_data, snr):
+    mix_data = numpy.asarray(mix_data)[..., : audio.data.shape[-1]]
 
-    return Audio(
-        samples=array.array(
-            audio.sound.array_type, trimmed.astype(audio.sound.array_type)
-        ),
-        old_audio=audio,
-    )
+    Ps = audio.power
+    Pn = numpy.mean(numpy.square(mix_data, dtype=numpy.float64))
 
+    k_factor = math.sqrt((Ps / Pn) * (10 ** (-snr / 10)))
 
-def _mix(audio, mix_data, snr):
-    Ps = 0
-    Pn = 0
+    # the float buffer has headroom, the add saturates when converted to PCM
+    mixed = audio.data + (mix_data * k_factor).astype(audio.data.dtype)
+    return Audio(data=mixed, old_audio=audio)
 
-    for i in range(len(audio.samples)):
-        Ps += abs(audio.samples[i]) * abs(audio.samples[i])
-        Pn += abs(mix_data[i]) * abs(mix_data[i])
-    Ps /= len(audio.samples)
-    Pn /= len(audio.samples)
 
-    k_factor = math.sqrt((Ps / Pn) * (10 ** (-snr / 10)))
-    mix_data *= k_factor
+def _stretch_mix(mix_data, n_samples, start=0):
+    # loop the mix to n_samples beginning at start, as a view when no looping
+    # is needed and a single tile otherwise
+    start %= len(mix_data)
+    if start + n_samples <= len(mix_data):
+        return mix_data[start : start + n_samples]
 
-    # some necessary casting to avoid fucking with the length of the audio file
-    mix_data = array.array(
-        audio.sound.array_type, mix_data.astype(audio.sound.array_type)
-    )
+    reps = -(-(start + n_samples) // len(mix_data))
+    return numpy.tile(mix_data, reps)[start : start + n_samples]
+
+
+def _load_source(cache, path, sample_rate):
+    # decode (and resample) a file once per cache, keyed on mtime so an edited
+    # file is decoded again
+    key = (os.path.abspath(path), os.stat(path).st_mtime_ns, sample_rate)
+
+    data = cache.get(key)
+    if data is None:
+        source = Audio(path=path)
+        if source.sample_rate != sample_rate:
+            source = apply_resample(source, sample_rate)
+
+        data = source.data
+        data.setflags(write=False)
+        cache.put(key, data)
+    return key, data
+
+
+def _ir_spectrum(key, ir, n_fft):
+    spectrum_key = key + (n_fft,)
+
+    spectrum = ir_cache.get(spectrum_key)
+    if spectrum is None:
+        spectrum = scipy_fft.rfft(ir, n_fft)
+        spectrum.setflags(write=False)
+        ir_cache.put(spectrum_key, spectrum)
+    return spectrum
 
-    for i in range(len(mix_data)):
-        try:
-            mix_data[i] += audio.samples[i]
-        except OverflowError:
-            try:
-                mix_data[i] = numpy.finfo(mix_data.typecode).max
-            except ValueError:
-                mix_data[i] = numpy.iinfo(mix_data.typecode).max
-    a = Audio(samples=mix_data, old_audio=audio)
-    return a
-
-
-def _stretch_mix(audio, mix_audio):
-    if len(mix_audio.samples) > len(audio.samples):
-        mix_audio = Audio(
-            samples=mix_audio.samples[: len(audio.samples)], old_audio=mix_audio
-        )
-    elif len(mix_audio.samples) < len(audio.samples):
-        m_s = mix_audio.samples
-        while len(m_s) < len(audio.samples):
-            m_s += m_s[
-                : min(
-                    len(audio.samples) - len(mix_audio.samples), len(mix_audio.samples)
-                )
-            ]
-        mix_audio = Audio(samples=m_s, old_audio=mix_audio)
 
-    return mix_audio
+def _ir_fft_size(ir_len):
+    # the FFT size only depends on the IR, so every input convolved with the
+    # same IR reuses one cached spectrum; blocks are at least 3x the IR length
+    return 1 << int(math.ceil(math.log2(4 * ir_len)))
+
+
+def _overlap_add(x, ir_spectrum, ir_len, n_fft):
+    """
+    Full linear convolution of x (along its last axis) with an IR, given the
+    IR's n_fft spectrum
+    """
+    lead = x.shape[:-1]
+    block_len = n_fft - ir_len + 1
+    n_out = x.shape[-1] + ir_len - 1
+    n_blocks = -(-x.shape[-1] // block_len)
+
+    blocks = numpy.zeros(lead + (n_blocks * block_len,), dtype=x.dtype)
+    blocks[..., : x.shape[-1]] = x
+    blocks = blocks.reshape(lead + (n_blocks, block_len))
+
+    y = scipy_fft.irfft(scipy_fft.rfft(blocks, n_fft, axis=-1) * ir_spectrum, n_fft)
+
+    # each block's tail (ir_len - 1 <= block_len samples) spills into the next
+    out = numpy.zeros(lead + ((n_blocks + 1) * block_len,), dtype=y.dtype)
+    out[..., : n_blocks * block_len] = y[..., :block_len].reshape(lead + (-1,))
+    tails = numpy.zeros(lead + (n_blocks, block_len), dtype=y.dtype)
+    tails[..., : ir_len - 1] = y[..., block_len:]
+    out[..., block_len:] += tails.reshape(lead + (-1,))
+    return out[..., :n_out]
+
+
+def _interpolate(data, positions):
+    # linear interpolation along the last axis at fractional sample positions
+    positions = numpy.clip(positions, 0, data.shape[-1] - 1)
+    before = positions.astype(numpy.intp)
+    after = numpy.minimum(before + 1, data.shape[-1] - 1)
+    fraction = (positions - before).astype(data.dtype)
+    return data[..., before] + fraction * (data[..., after] - data[..., before])
 
 
 # thanks https://github.com/limmor1/Convolve
-def _normalize(y, bitwidth):
+def _normalize(y):
     if abs(numpy.amax(y)) > abs(numpy.amin(y)):
         larger = numpy.amax(y)
     else:
         larger = abs(numpy.amin(y))
-    y = y / larger * ((2 ** bitwidth / 2) - 1)
-    return y
+    return y / larger
+
+
+# same first order RC filters as pydub.effects.low_pass_filter and
+# high_pass_filter, as transfer functions for scipy.signal.lfilter
+def _rc_low_pass(cutoff, sample_rate):
+    rc = 1.0 / (cutoff * 2 * math.pi)
+    dt = 1.0 / sample_rate
+    alpha = dt / (rc + dt)
+    return numpy.array([alpha]), numpy.array([1.0, alpha - 1.0])
+
+
+def _rc_high_pass(cutoff, sample_rate):
+    rc = 1.0 / (cutoff * 2 * math.pi)
+    dt = 1.0 / sample_rate
+    alpha = rc / (rc + dt)
+    return numpy.array([alpha, -alpha]), numpy.array([1.0, -alpha])
+
+
+@functools.lru_cache(maxsize=256)
+def _filter_sos(btype, cutoff, sample_rate, filter_type, order, ripple, attenuation):
+    """
+    Second-order sections of a lowpass, highpass or bandpass filter (whose
+    cutoff is a (low, high) pair), designed once per set of parameters and
+    shared, so never modify them (sosfilt won't take a read-only array)
+    """
+    cutoffs = cutoff if btype == "bandpass" else (cutoff,)
+    if filter_type == "rc":
+        # a band pass is pydub's high pass into its low pass
+        designs = {"lowpass": [_rc_low_pass], "highpass": [_rc_high_pass]}
+        designs["bandpass"] = designs["highpass"] + designs["lowpass"]
+        sos = numpy.array(
+            [
+                _sos_section(*design(c, sample_rate))
+                for design, c in zip(designs[btype], cutoffs)
+            ]
+        )
+    else:
+        if max(cutoffs) >= sample_rate / 2:
+            raise ValueError(
+                "cutoff {0} Hz is not below the Nyquist frequency of {1} Hz".format(
+                    max(cutoffs), sample_rate / 2
+                )
+            )
+        sos = scipy_signal.iirfilter(
+            order,
+            cutoff,
+            rp=ripple,
+            rs=attenuation,
+            btype=btype,
+            ftype=filter_type,
+            fs=sample_rate,
+            output="sos",
+        )
+    return sos
 
 
-# copied straight from matlab
-@numba.jit
-def _times_assignment_old_to_new(x, a_m, f_m):
-    time_assigned = [0.0 for _ in len(x)]
+def _sos_section(b, a):
+    # pad first order filters out to a biquad
+    return numpy.concatenate(
+        (numpy.pad(b, (0, 3 - len(b))), numpy.pad(a, (0, 3 - len(a))))
+    )
 
-    for i, elem in enumerate(x):
-        time_assigned[i] = (
-            x[i] + a_m + math.sin(2.0 * math.pi * f_m * x[i]) / (2.0 * math.pi * f_m)
-        )
 
-    return numpy.ndarray(time_assigned)
+def _sos_filter(x, sos, rc, zi=None):
+    """Returns the filtered signal and the filter state to continue from"""
+    if x.shape[-1] == 0:
+        return x, zi
+    if zi is None:
+        zi = _sos_initial_state(sos, rc, x[..., 0])
+    return scipy_signal.sosfilt(sos, x, zi=zi)
+
+
+def _sos_initial_state(sos, rc, first_sample):
+    """
+    sosfilt's initial state for a signal starting with first_sample (of every
+    channel): pydub starts its RC filters with y[0] = x[0], which every
+    section then passes on, and other designs start from rest
+    """
+    first_sample = numpy.asarray(first_sample, dtype=numpy.float64)
+    zi = numpy.zeros((len(sos),) + first_sample.shape + (2,))
+    if rc:
+        b0 = sos[:, 0].reshape((-1,) + (1,) * first_sample.ndim)
+        zi[..., 0] = (1.0 - b0) * first_sample
+    return zi
+
+
+# RBJ cookbook peaking EQ, the same biquad as sox's equalizer effect
+def _peaking_eq(frequency, q, gain_db, sample_rate):
+    w0 = 2.0 * math.pi * frequency / sample_rate
+    alpha = math.sin(w0) / (2.0 * q)
+    amp = 10 ** (gain_db / 40.0)
+
+    b = numpy.array([1.0 + alpha * amp, -2.0 * math.cos(w0), 1.0 - alpha * amp])
+    a = numpy.array([1.0 + alpha / amp, -2.0 * math.cos(w0), 1.0 - alpha / amp])
+    return b / a[0], a / a[0]
+
+
+def _peaking_eq_sos(bands, sample_rate):
+    sos = numpy.empty((len(bands), 6))
+    for i, (frequency, q, gain_db) in enumerate(bands):
+        if frequency >= sample_rate / 2:
+            raise ValueError(
+                "equalizer frequency {0} Hz is not below the Nyquist frequency "
+                "of {1} Hz".format(frequency, sample_rate / 2)
+            )
+        sos[i] = numpy.concatenate(_peaking_eq(frequency, q, gain_db, sample_rate))
+    return sos
+
+
+_COMPRESSOR_CHUNK = 1 << 16
+
+
+def _compressor_gain_curve(over, ratio, knee):
+    # attenuation in dB for a level `over` dB above the threshold
+    slope = 1.0 - 1.0 / ratio
+    if knee <= 0:
+        return slope * numpy.maximum(over, 0.0)
+    return numpy.where(
+        over > knee / 2,
+        slope * over,
+        slope * numpy.square(numpy.clip(over + knee / 2, 0.0, None)) / (2 * knee),
+    )
 
 
-@numba.jit
-def _time_assignment_new_to_old(y, a_m, f_m):
-    time_assigned = y
+def _compressor_ramp(targets, attenuation, attack_rate, release_rate):
+    # attack linearly up to each step's target (all of it in 1 / attack_rate
+    # steps, like pydub), release exponentially back down to it
+    out = numpy.empty(len(targets))
+    for k in range(len(targets)):
+        target = targets[k]
+        if target > attenuation:
+            attenuation = min(attenuation + target * attack_rate, target)
+        else:
+            attenuation = max(attenuation - attenuation * release_rate, target)
+        out[k] = attenuation
+    return out
+
+
+_compiled = {}
+
+
+def _compiled_compressor_ramp():
+    # compiled on first use only, numba caches the machine code on disk
+    if "compressor_ramp" not in _compiled:
+        _compiled["compressor_ramp"] = numba.njit(cache=True)(_compressor_ramp)
+    return _compiled["compressor_ramp"]
+
+
+def _db_to_float(db):
+    return 10 ** (db / 20)
 
-    for k in range(1, 41):
-        for i, elem in enumerate(y):
-            time_assigned[i] = y[i] - a_m * math.sin(
-                2.0 * math.pi * f_m * time_assigned[i]
-            ) / (2.0 * math.pi * f_m)
+
+def _frames(audio, millis):
+    # same rounding as pydub's millisecond slicing
+    return int(millis * audio.sample_rate / 1000)
+
+
+_WOW_FLUTTER_CHUNK = 1 << 18
+
+
+def _time_assignment_new_to_old(y, a_m, f_m, tolerance, max_iterations=40):
+    # solve x = y - a_m * sin(2 pi f_m x) / (2 pi f_m) by fixed point iteration,
+    # which contracts by a factor of about a_m per step, stopping once no
+    # position moves by more than tolerance seconds
+    w = 2.0 * math.pi * f_m
+    time_assigned = y
+    for _ in range(max_iterations):
+        updated = y - a_m * numpy.sin(w * time_assigned) / w
+        converged = (
+            numpy.max(numpy.abs(updated - time_assigned), initial=0.0) < tolerance
+        )
+        time_assigned = updated
+        if converged:
+            break
 
     return time_assigned
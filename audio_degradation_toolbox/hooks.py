@@ -0,0 +1,96 @@
+"""
+Per-step events emitted by Degradation, and hooks that consume them
+
+A hook is any callable taking a StepEvent; Degradation calls each of its
+hooks after every step of the plan (a fused filter counts as one step).
+"""
+
+from collections import namedtuple
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+StepEvent = namedtuple(
+    "StepEvent",
+    [
+        # path of the degraded file, if it was loaded from one
+        "input",
+        "name",
+        "params",
+        "wall_time",
+        "cpu_time",
+        "input_samples",
+        "output_samples",
+        # growth of the process's peak RSS during the step in bytes, or None
+        # where it can't be measured
+        "memory_delta",
+    ],
+)
+
+
+class StepTimer(object):
+    """Measures one step: start() before it runs, then event(...) after"""
+
+    def start(self):
+        self._max_rss = _max_rss()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+
+    def event(self, input, name, params, input_samples, output_samples):
+        wall_time = time.perf_counter() - self._wall
+        cpu_time = time.process_time() - self._cpu
+        max_rss = _max_rss()
+        return StepEvent(
+            input,
+            name,
+            params,
+            wall_time,
+            cpu_time,
+            input_samples,
+            output_samples,
+            None if max_rss is None else max_rss - self._max_rss,
+        )
+
+
+def _max_rss():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def print_step(event):
+    """Hook printing the "Applied degradation ..." line the CLI shows"""
+    if event.name == "fused_filter":
+        params = "steps: {0}".format(
+            ", ".join(s["name"] for s in event.params["steps"])
+        )
+    else:
+        params = ", ".join(
+            "{0}: {1}".format(k, v) for k, v in event.params.items() if v is not None
+        )
+    print(
+        "Applied degradation {0}{1}".format(
+            event.name, " with params {0}".format(params) if params else ""
+        )
+    )
+
+
+class Trace(object):
+    """Hook recording every event, to be dumped as a JSON trace"""
+
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, event):
+        self.events.append(event)
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump({"steps": [e._asdict() for e in self.events]}, f, indent=2)
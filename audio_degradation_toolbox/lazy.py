@@ -0,0 +1,18 @@
+import importlib
+import types
+
+
+def lazy_import(name):
+    """
+    Module placeholder that imports the named module on first attribute
+    access, so heavy dependencies only load for the degradations that use them
+    """
+    return _LazyModule(name)
+
+
+class _LazyModule(types.ModuleType):
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__name__)
+        # later lookups find the attributes directly and skip __getattr__
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
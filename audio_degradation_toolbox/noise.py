@@ -0,0 +1,133 @@
+"""
+A per-process bank of pre-generated colored noise
+
+Synthesizing colored noise shapes a full-length spectrum, which is paid again
+for every file. Instead, one long buffer per color is generated the first time
+it's used, from a fixed seed, and noise is cut from it at random offsets, which
+costs a slice. The offsets come from a RandomState, so the same seed gives the
+same noise in any process.
+
+Noise longer than the bank isn't cut from it, which would repeat it audibly,
+but read from a LongNoise: chunks as long as the bank, each synthesized from a
+seed drawn from the RandomState in turn and crossfaded into the next, so it
+can be read in blocks of any size, holding one chunk at a time, and gives the
+same noise either way.
+"""
+
+from .lazy import lazy_import
+import math
+import numpy
+import zlib
+
+acoustics_generator = lazy_import("acoustics.generator")
+
+# about 47 s at 44.1 kHz, and 8 MB of float32 per color
+NOISE_BANK_SAMPLES = 1 << 21
+
+
+class NoiseBank(object):
+    def __init__(self, n_samples=NOISE_BANK_SAMPLES, seed=0):
+        self.n_samples = n_samples
+        self.seed = seed
+        self._buffers = {}
+
+    def buffer(self, color):
+        """The bank's unit power noise of a color, generated on first use"""
+        buf = self._buffers.get(color)
+        if buf is None:
+            state = numpy.random.RandomState(
+                (self.seed + zlib.crc32(color.encode())) % 2**32
+            )
+            buf = acoustics_generator.noise(self.n_samples, color, state)
+            buf = buf.astype(numpy.float32)
+            buf.setflags(write=False)
+            self._buffers[color] = buf
+        return buf
+
+    def draw(self, color, n_samples, rng):
+        """
+        n_samples of unit power noise of a color, from an offset picked with
+        rng (a numpy RandomState); more than the bank holds are synthesized
+        from rng rather than repeating the bank
+        """
+        if n_samples > self.n_samples:
+            return self.long_noise(color, rng).read(n_samples)
+        return self.segment(color, self.offset(n_samples, rng), n_samples)
+
+    def long_noise(self, color, rng):
+        """A LongNoise of a color in chunks as long as the bank, seeded from rng"""
+        return LongNoise(color, rng, self.n_samples)
+
+    def offset(self, n_samples, rng):
+        """Random start for n_samples of noise, without wrapping if they fit"""
+        return int(rng.randint(max(self.n_samples - n_samples, 0) + 1))
+
+    def segment(self, color, start, n_samples):
+        """
+        n_samples from start, wrapping around the end of the bank; the colored
+        noise is synthesized with an inverse FFT, so it's periodic and the wrap
+        is seamless
+        """
+        buf = self.buffer(color)
+        start %= self.n_samples
+        if start + n_samples <= self.n_samples:
+            return buf[start : start + n_samples]
+        return numpy.take(buf, numpy.arange(start, start + n_samples), mode="wrap")
+
+
+class LongNoise(object):
+    """
+    Unit power noise of a color of any length, read in consecutive blocks:
+    chunks of chunk_size samples, each synthesized from the next seed drawn
+    from rng, and crossfaded over a sixteenth of their length with equal power
+    """
+
+    def __init__(self, color, rng, chunk_size):
+        self.color = color
+        self.rng = rng
+        self.overlap = chunk_size // 16
+        self.chunk_size = chunk_size
+        self.hop = chunk_size - self.overlap
+        self.position = 0
+
+        # the output from chunk k * hop on, up to where chunk k + 1 fades in
+        self._index = -1
+        self._chunk = None
+        self._tail = None
+        fade = numpy.sin(
+            0.5 * math.pi * (numpy.arange(self.overlap) + 0.5) / self.overlap
+        )
+        self._fade_in = fade.astype(numpy.float32)
+        self._fade_out = self._fade_in[::-1].copy()
+
+    def read(self, n_samples):
+        """The next n_samples of the noise"""
+        out = numpy.empty(n_samples, dtype=numpy.float32)
+        done = 0
+        while done < n_samples:
+            index, offset = divmod(self.position, self.hop)
+            while self._index < index:
+                self._next_chunk()
+            take = min(n_samples - done, self.hop - offset)
+            out[done : done + take] = self._chunk[offset : offset + take]
+            done += take
+            self.position += take
+        return out
+
+    def _next_chunk(self):
+        # chunks are synthesized in order, so the seeds drawn from rng only
+        # depend on how far the noise is read
+        seed = int(self.rng.randint(2**31 - 1))
+        chunk = acoustics_generator.noise(
+            self.chunk_size, self.color, numpy.random.RandomState(seed)
+        ).astype(numpy.float32)
+        head = chunk[: self.hop]
+        if self._tail is not None:
+            head[: self.overlap] *= self._fade_in
+            head[: self.overlap] += self._tail * self._fade_out
+        self._tail = chunk[self.hop :]
+        self._chunk = head
+        self._index += 1
+
+
+noise_bank = NoiseBank()
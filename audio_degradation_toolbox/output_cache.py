@@ -0,0 +1,286 @@
+"""
+On-disk cache of degraded outputs, for re-running the same chains over the
+same inputs
+
+An output is stored under a SHA-256 of everything it depends on: the bytes of
+the input file, the resolved chain (every parameter with its default filled
+in, and IR and mix files by the hash of their contents rather than their
+path), how the input is loaded and processed, and the toolbox version. A hit
+copies (or hard links) the stored file to the output path instead of decoding
+and degrading the input. A linked output shares its file with the cache entry,
+so it must not be modified in place.
+
+Entries are evicted least recently used first, by modification time, which a
+hit refreshes, once the cache outgrows its size limit, down to 90% of it so
+that the entries aren't walked again on every store that follows. Hits, misses and the
+bytes served from the cache are counted in the cache directory across runs.
+Chains that draw random numbers (noise without a seed, or a mix at a random
+offset) are never cached.
+"""
+
+from .__version__ import __version__
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+DEFAULT_MAX_BYTES = 4 * 1024**3
+
+# eviction frees room below the limit, for the next stores to fill
+LOW_WATER_MARK = 0.9
+
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+_EMPTY_STATS = {"hits": 0, "misses": 0, "bytes_saved": 0, "entries": 0, "size": 0}
+
+
+def parse_size(text):
+    """Number of bytes in a size like 500M or 10G (powers of 1024)"""
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$", text, re.IGNORECASE)
+    if not match:
+        raise ValueError("expected a size like 500M or 10G, got {0!r}".format(text))
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+
+def format_size(nbytes):
+    if nbytes < 1024:
+        return "{0} B".format(nbytes)
+    for unit in ("KB", "MB", "GB", "TB"):
+        nbytes /= 1024.0
+        if nbytes < 1024 or unit == "TB":
+            return "{0:.1f} {1}".format(nbytes, unit)
+
+
+def uncacheable(chain):
+    """Why the output of chain isn't reproducible, or None if it is"""
+    for i, step in enumerate(chain, 1):
+        if step["name"] == "noise" and step["seed"] is None:
+            return "step {0} (noise) has no seed".format(i)
+        if step["name"] == "mix" and step["offset"] == "random":
+            return "step {0} (mix) has a random offset".format(i)
+    return None
+
+
+class OutputCache(object):
+    """
+    Degraded outputs in directory, up to max_bytes of them, served by copying
+    them or, if link, by hard linking them (which falls back to a copy across
+    file systems)
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, link=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.link = link
+
+    def key(self, input_path, chain, **options):
+        """
+        Hash of the output of chain (a Chain) on input_path, loaded and
+        processed with options (e.g. mono or block_size), or None if the
+        chain's output isn't reproducible
+        """
+        if uncacheable(chain) is not None:
+            return None
+        description = {
+            "version": __version__,
+            "chain": [_normalized(step) for step in chain],
+            "options": options,
+        }
+        digest = hashlib.sha256(json.dumps(description, sort_keys=True).encode())
+        digest.update(_file_digest(input_path).encode())
+        return digest.hexdigest()
+
+    def produce(self, input_path, output_path, chain, degrade, **options):
+        """
+        Write the output of chain on input_path to output_path, from the
+        cache if it's there and otherwise by calling degrade() and storing
+        what it wrote; returns whether it was a hit
+        """
+        key = self.key(input_path, chain, **options)
+        if key is not None and self.fetch(key, output_path):
+            return True
+        if _is_linked(output_path):
+            # written in place, it would overwrite an entry it's linked to
+            os.remove(output_path)
+        degrade()
+        if key is not None:
+            self.store(key, output_path)
+        return False
+
+    def fetch(self, key, output_path):
+        """Copy the entry for key to output_path, returning False if there's none"""
+        entry = self._entry(key)
+        try:
+            os.utime(entry)
+            self._serve(entry, output_path)
+        except FileNotFoundError:
+            # never stored, or evicted by another process in the meantime
+            with self._locked():
+                self._update_stats(misses=1)
+            return False
+        with self._locked():
+            self._update_stats(hits=1, bytes_saved=os.path.getsize(output_path))
+        return True
+
+    def store(self, key, output_path):
+        """Add output_path as the entry for key, evicting old entries to fit"""
+        nbytes = os.path.getsize(output_path)
+        entry = self._entry(key)
+        tmp = None
+        if nbytes <= self.max_bytes:
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            tmp = self._serve(output_path, entry + ".tmp-{0}".format(os.getpid()))
+
+        with self._locked():
+            if tmp is not None:
+                try:
+                    replaced = os.path.getsize(entry)
+                except FileNotFoundError:
+                    replaced = None
+                os.replace(tmp, entry)
+                self._update_stats(
+                    entries=0 if replaced is not None else 1,
+                    size=nbytes - (replaced or 0),
+                )
+            # also shrinks a cache whose limit was lowered
+            if self._read_stats()["size"] > self.max_bytes:
+                self._evict()
+
+    def stats(self):
+        """Counts of hits, misses and bytes saved, and the entries and size"""
+        with self._locked():
+            return self._read_stats()
+
+    def _evict(self):
+        # the least recently used entries first, recounting what's left
+        entries = []
+        for root, _, files in os.walk(os.path.join(self.directory, "objects")):
+            for name in files:
+                if name.endswith(".wav"):
+                    path = os.path.join(root, name)
+                    st = os.stat(path)
+                    entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+
+        size = sum(e[1] for e in entries)
+        evicted = 0
+        for _, nbytes, path in entries:
+            if size <= self.max_bytes * LOW_WATER_MARK:
+                break
+            os.remove(path)
+            size -= nbytes
+            evicted += 1
+
+        stats = self._read_stats()
+        stats.update(entries=len(entries) - evicted, size=size)
+        self._write_stats(stats)
+
+    def _serve(self, source, destination):
+        if os.path.exists(destination) and os.path.samefile(source, destination):
+            # already linked, e.g. an output served from the cache before
+            return destination
+        if self.link:
+            tmp = destination + ".link-{0}".format(os.getpid())
+            try:
+                os.link(source, tmp)
+            except OSError:
+                # e.g. across file systems; a missing source fails the copy too
+                pass
+            else:
+                os.replace(tmp, destination)
+                return destination
+        shutil.copyfile(source, destination)
+        return destination
+
+    def _entry(self, key):
+        return os.path.join(self.directory, "objects", key[:2], key + ".wav")
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # batch workers share the cache, so the stats are updated under a lock
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, "lock"), "w") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _read_stats(self):
+        stats = dict(_EMPTY_STATS)
+        try:
+            with open(os.path.join(self.directory, "stats.json")) as f:
+                stats.update(json.load(f))
+        except (FileNotFoundError, ValueError):
+            pass
+        return stats
+
+    def _write_stats(self, stats):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(stats, f)
+        os.replace(tmp, os.path.join(self.directory, "stats.json"))
+
+    def _update_stats(self, **increments):
+        stats = self._read_stats()
+        for name, increment in increments.items():
+            stats[name] += increment
+        self._write_stats(stats)
+        return stats
+
+
+def describe_stats(stats, max_bytes=None):
+    """The lines --cache-stats prints"""
+    lookups = stats["hits"] + stats["misses"]
+    return "\n".join(
+        [
+            "Entries: {0} ({1}{2})".format(
+                stats["entries"],
+                format_size(stats["size"]),
+                "" if max_bytes is None else " of " + format_size(max_bytes),
+            ),
+            "Hits: {0}, misses: {1}, hit rate: {2}".format(
+                stats["hits"],
+                stats["misses"],
+                "{0:.1%}".format(stats["hits"] / lookups) if lookups else "n/a",
+            ),
+            "Bytes saved: {0}".format(format_size(stats["bytes_saved"])),
+        ]
+    )
+
+
+def _is_linked(path):
+    try:
+        return os.stat(path).st_nlink > 1
+    except FileNotFoundError:
+        return False
+
+
+def _normalized(step):
+    # IR and mix files count by their contents, wherever they are
+    paths = [p.name for p in step.spec.params if p.path]
+    return {
+        k: {"sha256": _file_digest(v)} if k in paths else v for k, v in step.items()
+    }
+
+
+def _file_digest(path):
+    st = os.stat(path)
+    return _cached_file_digest(os.path.realpath(path), st.st_mtime_ns, st.st_size)
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_file_digest(path, mtime_ns, size):
+    # the same IR or mix file is hashed once per process while it's unchanged
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,178 @@
+"""
+Compile a chain of degradations into a plan of steps to run
+
+Consecutive linear time-invariant degradations (gain, the causal low_pass,
+high_pass and band_pass filters, equalizer and delay) are fused into a single
+second-order section cascade, applied in one pass over the samples instead of
+one pass (and one new Audio) per step. Every other degradation is passed
+through unchanged.
+"""
+
+from .audio import Audio
+from .degradations import (
+    _db_to_float,
+    _filter_sos,
+    _normalize,
+    _peaking_eq_sos,
+    _sos_initial_state,
+)
+from .lazy import lazy_import
+import numpy
+
+scipy_signal = lazy_import("scipy.signal")
+
+LINEAR_STEPS = ("gain", "low_pass", "high_pass", "band_pass", "equalizer", "delay")
+PASS_FILTERS = {"low_pass": "lowpass", "high_pass": "highpass", "band_pass": "bandpass"}
+
+
+def compile_plan(degradations, fuse=True):
+    """
+    Return the steps to run for a list of resolved degradations (see
+    chain.Chain): the degradations themselves, with runs of two or more linear
+    steps replaced by a FusedFilter
+    """
+    plan = []
+    run = []
+
+    def close_run():
+        if len(run) > 1:
+            plan.append(FusedFilter(list(run)))
+        else:
+            plan.extend(run)
+        del run[:]
+
+    for d in degradations:
+        # a zero phase filter runs backward over its whole input
+        if not fuse or d["name"] not in LINEAR_STEPS or d.get("zero_phase"):
+            close_run()
+            plan.append(d)
+            continue
+
+        run.append(d)
+        # the equalizer peak normalizes its output, which depends on the whole
+        # filtered signal, so nothing after it can join the same pass
+        if d["name"] == "equalizer":
+            close_run()
+    close_run()
+
+    return plan
+
+
+def equalizer_bands(d):
+    """(frequency, bandwidth, gain) of every band of a resolved equalizer step"""
+    if d["bands"] is not None:
+        return [(b["frequency"], b["bandwidth"], b["gain"]) for b in d["bands"]]
+    return [(d["frequency"], d["bandwidth"], d["gain"])]
+
+
+def pass_filter_sos(d, sample_rate):
+    """Second-order sections of a resolved low_pass, high_pass or band_pass step"""
+    btype = PASS_FILTERS[d["name"]]
+    if btype == "bandpass":
+        cutoff = (d["low_cutoff"], d["high_cutoff"])
+    else:
+        cutoff = d["cutoff"]
+    return _filter_sos(
+        btype,
+        cutoff,
+        sample_rate,
+        d["type"],
+        d["order"],
+        d["ripple"],
+        d["attenuation"],
+    )
+
+
+def describe_plan(plan):
+    """One line per step of a compiled plan, showing which steps were fused"""
+    return "\n".join(
+        "{0}: {1}".format(i, _describe_step(step)) for i, step in enumerate(plan, 1)
+    )
+
+
+def _describe_step(step):
+    if isinstance(step, FusedFilter):
+        return "fused_filter [{0}]".format(
+            " -> ".join(_describe_step(d) for d in step.steps)
+        )
+    params = ", ".join(
+        "{0}: {1}".format(k, v)
+        for k, v in step.items()
+        if k != "name" and v is not None
+    )
+    return "{0} ({1})".format(step["name"], params) if params else step["name"]
+
+
+class FusedFilter(object):
+    """A run of linear degradations applied as one cascade of biquads"""
+
+    name = "fused_filter"
+
+    def __init__(self, steps):
+        self.steps = steps
+
+    def apply(self, audio):
+        x = audio.data
+        if x.shape[-1] == 0:
+            return audio
+
+        # the first sample of every channel
+        first_sample = x[..., 0].astype(numpy.float64)
+        sos, zi, gain, delay, normalize = self._cascade(audio.sample_rate, first_sample)
+        if len(sos):
+            y, _ = scipy_signal.sosfilt(sos, x, zi=zi)
+        else:
+            y = x.astype(numpy.float64)
+
+        if normalize:
+            y = _normalize(y)
+        elif gain != 1.0:
+            y *= gain
+        y = y.astype(x.dtype, copy=False)
+
+        if delay:
+            silence = numpy.zeros(y.shape[:-1] + (delay,), dtype=y.dtype)
+            y = numpy.concatenate((silence, y), axis=-1)
+        return Audio(data=y, old_audio=audio)
+
+    def _cascade(self, sample_rate, first_sample):
+        """
+        Second-order sections for the run, their initial states, and the gain
+        and delay that commute with them
+
+        pydub's RC filters start from y[0] = x[0], so their state depends on
+        the first sample reaching them, which other sections (starting from
+        rest) scale by their b0; the sections after a delay see zeros first,
+        which is the same as a zero state with the delay applied last.
+        """
+        channels = numpy.shape(first_sample)
+        sections = []
+        states = []
+        gain = 1.0
+        delay = 0
+        normalize = False
+
+        for d in self.steps:
+            name = d["name"]
+            if name == "gain":
+                gain *= _db_to_float(d["volume"])
+            elif name in PASS_FILTERS:
+                sos = pass_filter_sos(d, sample_rate)
+                rc = d["type"] == "rc"
+                sections.extend(sos)
+                states.extend(_sos_initial_state(sos, rc, first_sample))
+                if not rc:
+                    first_sample = first_sample * numpy.prod(sos[:, 0])
+            elif name == "equalizer":
+                for section in _peaking_eq_sos(equalizer_bands(d), sample_rate):
+                    sections.append(section)
+                    states.append(numpy.zeros(channels + (2,)))
+                    first_sample = first_sample * section[0]
+                normalize = True
+            elif name == "delay":
+                delay += d["samples"]
+                first_sample = numpy.zeros(channels)
+
+        # sosfilt's state is (sections, channels..., 2)
+        zi = numpy.array(states).reshape((len(states),) + channels + (2,))
+        return numpy.array(sections).reshape(-1, 6), zi, gain, delay, normalize
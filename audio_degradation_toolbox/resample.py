@@ -0,0 +1,86 @@
+"""
+Polyphase resampling
+
+Sample rates are converted by a rational ratio up / down with
+scipy.signal.resample_poly, whose anti-aliasing filter is a Kaiser windowed
+sinc designed once per (up, down, quality) and cached. A quality preset trades
+the filter's length against its stopband attenuation and passband width:
+
+    fast     8 zero crossings, about 55 dB, passband to 85% of Nyquist
+    medium   16 zero crossings, about 85 dB, passband to 90% of Nyquist
+    high     32 zero crossings, about 120 dB, passband to 95% of Nyquist
+
+Ratios with a numerator or denominator above MAX_PHASES (a float ratio, or two
+nearly equal rates like 44100 and 44099 Hz) are approximated by the closest
+ratio that isn't, which keeps the filter short and detunes by less than one
+part in MAX_PHASES (0.4 cents).
+"""
+
+from .lazy import lazy_import
+import fractions
+import functools
+import numpy
+
+scipy_signal = lazy_import("scipy.signal")
+
+# quality -> zero crossings of the sinc on each side, Kaiser beta, and the
+# cutoff relative to the Nyquist frequency of the lower rate
+RESAMPLE_QUALITIES = {
+    "fast": (8, 5.0, 0.85),
+    "medium": (16, 8.6, 0.9),
+    "high": (32, 12.0, 0.95),
+}
+
+MAX_PHASES = 4096
+
+
+def resample(x, sample_rate, new_sample_rate, quality="medium"):
+    """
+    x (samples along the last axis) at sample_rate converted to the integer
+    new_sample_rate, with ceil(len * new_sample_rate / sample_rate) samples
+    """
+    ratio = fractions.Fraction(int(new_sample_rate), int(sample_rate))
+    n_samples = -(-x.shape[-1] * ratio.numerator // ratio.denominator)
+    return _fix_length(resample_ratio(x, ratio, quality), n_samples)
+
+
+def resample_ratio(x, ratio, quality="medium"):
+    """
+    x resampled to ratio times as many samples, where ratio is a float or a
+    Fraction, with the same dtype
+    """
+    ratio = _limit_phases(fractions.Fraction(ratio))
+    if ratio == 1:
+        return x.copy()
+
+    taps = _taps(ratio.numerator, ratio.denominator, quality)
+    y = scipy_signal.resample_poly(
+        x, ratio.numerator, ratio.denominator, axis=-1, window=taps
+    )
+    return y.astype(x.dtype, copy=False)
+
+
+def _limit_phases(ratio):
+    if max(ratio.numerator, ratio.denominator) <= MAX_PHASES:
+        return ratio
+    if ratio < 1:
+        return ratio.limit_denominator(MAX_PHASES)
+    return 1 / (1 / ratio).limit_denominator(MAX_PHASES)
+
+
+@functools.lru_cache(maxsize=64)
+def _taps(up, down, quality):
+    zero_crossings, beta, rolloff = RESAMPLE_QUALITIES[quality]
+    max_rate = max(up, down)
+    taps = scipy_signal.firwin(
+        2 * zero_crossings * max_rate + 1, rolloff / max_rate, window=("kaiser", beta)
+    )
+    # shared by every call, and resample_poly scales a copy
+    taps.setflags(write=False)
+    return taps
+
+
+def _fix_length(y, n_samples):
+    if y.shape[-1] >= n_samples:
+        return y[..., :n_samples]
+    return numpy.pad(y, [(0, 0)] * (y.ndim - 1) + [(0, n_samples - y.shape[-1])])
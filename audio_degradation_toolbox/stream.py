@@ -0,0 +1,570 @@
+"""
+Block-by-block degradation of long recordings with bounded memory
+
+The input is read in fixed-size blocks and every step that can work on a block
+at a time does so, carrying its filter or convolution state from one block to
+the next. Steps that need a statistic of their whole input (e.g. the signal
+power for an SNR, or the peak for normalization) spill the stream so far to a
+temporary file while measuring it, then continue from that file. Steps that
+need the whole signal at once fall back to a full-buffer pass, which is
+reported on stderr.
+"""
+
+from .audio import Audio, _float_to_pcm
+from .lazy import lazy_import
+from .chain import Chain
+from .core import Degradation
+from .degradations import (
+    ir_cache,
+    mix_cache,
+    _db_to_float,
+    _ir_fft_size,
+    _ir_spectrum,
+    _load_source,
+    _overlap_add,
+    _peaking_eq_sos,
+    _sos_filter,
+    _stretch_mix,
+    trim,
+)
+from .noise import noise_bank
+from .plan import equalizer_bands, pass_filter_sos
+from pydub import AudioSegment
+from pydub.utils import mediainfo
+import math
+import numpy
+import subprocess
+import sys
+import tempfile
+import wave
+
+scipy_signal = lazy_import("scipy.signal")
+
+BLOCK_SIZE = 65536
+
+
+def stream_degradations(
+    input_path, output_path, degradations, block_size=BLOCK_SIZE, trim_on_load=False
+):
+    """
+    Apply degradations (a Chain, or a list validated up front) to input_path
+    block by block, writing a WAV file
+    """
+    chain = degradations if isinstance(degradations, Chain) else Chain(degradations)
+    with tempfile.TemporaryDirectory(prefix="audio-degradation-toolbox-") as tmp_dir:
+        spills = _TempFiles(tmp_dir)
+        source = _open_source(input_path, block_size)
+
+        pending = []
+        if trim_on_load:
+            source = _full_buffer_pass(source, pending, spills, {"name": "trim"})
+
+        for d in chain:
+            processors = _processors(d, source.sample_rate)
+            if processors is None:
+                source = _full_buffer_pass(source, pending, spills, d)
+                pending = []
+                continue
+
+            for processor in processors:
+                if processor.needs_stats:
+                    source, stats = _measure(source, pending, spills)
+                    processor.prepare(stats)
+                    pending = []
+                pending.append(processor)
+
+        with _WavSink(output_path, source.sample_rate, source.sample_width) as sink:
+            for block in _run(source, pending):
+                sink.write(block)
+
+
+class _Stats(object):
+    def __init__(self):
+        self.n_samples = 0
+        self.sum_squares = 0.0
+        self.min = 0.0
+        self.max = 0.0
+
+    def update(self, block):
+        if len(block) == 0:
+            return
+        if self.n_samples == 0:
+            self.min = self.max = float(block[0])
+        self.n_samples += len(block)
+        self.sum_squares += float(numpy.dot(block, block))
+        self.min = min(self.min, float(numpy.min(block)))
+        self.max = max(self.max, float(numpy.max(block)))
+
+    @property
+    def power(self):
+        return self.sum_squares / self.n_samples if self.n_samples else 0.0
+
+    @property
+    def peak(self):
+        return max(abs(self.min), abs(self.max))
+
+
+def _run(source, processors):
+    """Yield the blocks of source pushed through processors, then their tails"""
+    for block in source.blocks():
+        for processor in processors:
+            block = processor.process(block)
+        yield block
+
+    # each processor's tail still has to go through the ones after it
+    for i, processor in enumerate(processors):
+        block = processor.flush()
+        for downstream in processors[i + 1 :]:
+            block = downstream.process(block)
+        yield block
+
+
+def _measure(source, processors, spills):
+    stats = _Stats()
+    if not processors:
+        for block in source.blocks():
+            stats.update(block)
+        return source, stats
+
+    spill = spills.new(source.sample_rate, source.sample_width, source.block_size)
+    with spill:
+        for block in _run(source, processors):
+            stats.update(block)
+            spill.write(block)
+    return spill, stats
+
+
+def _full_buffer_pass(source, processors, spills, d):
+    print(
+        "Streaming: degradation {0} needs the whole signal, running it on a full buffer".format(
+            d["name"]
+        ),
+        file=sys.stderr,
+    )
+    blocks = list(_run(source, processors))
+    audio = Audio(
+        data=numpy.concatenate(blocks) if blocks else numpy.zeros(0),
+        sample_rate=source.sample_rate,
+        old_audio=source,
+    )
+    del blocks
+
+    deg = Degradation(audio=audio)
+    del audio
+    if d["name"] == "trim":
+        deg.file_audio = trim(deg.file_audio)
+    else:
+        deg.apply_degradation(d)
+
+    # spill the result so the rest of the stream doesn't hold it in memory
+    spill = spills.new(
+        deg.file_audio.sample_rate, deg.file_audio.sample_width, source.block_size
+    )
+    with spill:
+        spill.write(deg.file_audio.data)
+    return spill
+
+
+def _processors(d, sample_rate):
+    """Block processors for a degradation, or None if it needs the whole signal"""
+    make = _PROCESSORS.get(d["name"])
+    return make(d, sample_rate) if make else None
+
+
+def _equalizer(d, sample_rate):
+    sos = _peaking_eq_sos(equalizer_bands(d), sample_rate)
+    return [_SOSFilter(sos), _PeakNormalize()]
+
+
+def _pass_filter(d, sample_rate):
+    # a zero phase filter needs its whole input to run backward
+    if d["zero_phase"]:
+        return None
+    return [_SOSFilter(pass_filter_sos(d, sample_rate), rc=d["type"] == "rc")]
+
+
+def _mix(d, sample_rate):
+    _, mix_data = _load_source(mix_cache, d["path"], sample_rate)
+    if d["offset"] == "random":
+        start = numpy.random.randint(len(mix_data))
+    else:
+        start = int(d["offset"] * sample_rate / 1000)
+    return [_Mix(mix_data, d["snr"], start)]
+
+
+def _impulse_response(d, sample_rate):
+    key, ir = _load_source(ir_cache, d["path"], sample_rate)
+    n_fft = _ir_fft_size(len(ir))
+    return [_Convolve(_ir_spectrum(key, ir, n_fft), len(ir), n_fft), _PeakNormalize()]
+
+
+# degradation name -> processors(resolved step, sample_rate)
+_PROCESSORS = {
+    "gain": lambda d, sr: [_Scale(_db_to_float(d["volume"]))],
+    "normalize": lambda d, sr: [_PeakNormalize(headroom=0.1)],
+    "low_pass": _pass_filter,
+    "high_pass": _pass_filter,
+    "band_pass": _pass_filter,
+    "equalizer": _equalizer,
+    "noise": lambda d, sr: [_Noise(d["color"], d["snr"], d["seed"])],
+    "mix": _mix,
+    "impulse_response": _impulse_response,
+    "delay": lambda d, sr: [_Delay(d["samples"])],
+    "harmonic_distortion": lambda d, sr: [_HarmonicDistortion(d["num_passes"])],
+}
+
+
+class _Processor(object):
+    # set when prepare() needs statistics of the processor's whole input
+    needs_stats = False
+
+    def prepare(self, stats):
+        pass
+
+    def process(self, block):
+        raise NotImplementedError
+
+    def flush(self):
+        return numpy.zeros(0)
+
+
+class _Scale(_Processor):
+    def __init__(self, factor):
+        self.factor = factor
+
+    def process(self, block):
+        return block * self.factor
+
+
+class _PeakNormalize(_Scale):
+    needs_stats = True
+
+    def __init__(self, headroom=0.0):
+        super().__init__(1.0)
+        self.headroom = headroom
+
+    def prepare(self, stats):
+        if stats.peak != 0:
+            self.factor = _db_to_float(-self.headroom) / stats.peak
+
+
+class _SOSFilter(_Processor):
+    def __init__(self, sos, rc=False):
+        self.sos = sos
+        self.rc = rc
+        self.zi = None
+
+    def process(self, block):
+        # _sos_filter picks the initial state (pydub's, for RC sections) from
+        # the first block
+        block, self.zi = _sos_filter(block, self.sos, self.rc, self.zi)
+        return block
+
+
+class _Noise(_Processor):
+    needs_stats = True
+
+    def __init__(self, color, snr, seed):
+        self.color = color
+        self.snr = snr
+        self.k_factor = 0.0
+        self.rng = numpy.random.RandomState(seed)
+        self.position = 0
+        self.long_noise = None
+
+    def prepare(self, stats):
+        # same noise and scale as a full-buffer pass: an offset into the bank,
+        # or past the bank's length, long noise read in blocks, whose power is
+        # measured first by reading a copy of it
+        if stats.n_samples > noise_bank.n_samples:
+            probe = numpy.random.RandomState()
+            probe.set_state(self.rng.get_state())
+            noise_power = _long_noise_power(
+                noise_bank.long_noise(self.color, probe), stats.n_samples
+            )
+            self.long_noise = noise_bank.long_noise(self.color, self.rng)
+        else:
+            self.position = noise_bank.offset(stats.n_samples, self.rng)
+            noise_power = _looped_power(
+                noise_bank.buffer(self.color), self.position, stats.n_samples
+            )
+        if noise_power > 0:
+            self.k_factor = math.sqrt(
+                (stats.power / noise_power) * (10 ** (-self.snr / 10))
+            )
+
+    def process(self, block):
+        if self.long_noise is not None:
+            noise = self.long_noise.read(len(block))
+        else:
+            noise = noise_bank.segment(self.color, self.position, len(block))
+            self.position += len(block)
+        return block + self.k_factor * noise
+
+
+class _Mix(_Processor):
+    needs_stats = True
+
+    def __init__(self, mix_data, snr, start):
+        self.mix_data = mix_data
+        self.snr = snr
+        self.position = start % len(mix_data)
+        self.k_factor = 0.0
+
+    def prepare(self, stats):
+        mix_power = _looped_power(self.mix_data, self.position, stats.n_samples)
+        self.k_factor = math.sqrt((stats.power / mix_power) * (10 ** (-self.snr / 10)))
+
+    def process(self, block):
+        mixed = block + self.k_factor * _stretch_mix(
+            self.mix_data, len(block), self.position
+        )
+        self.position = (self.position + len(block)) % len(self.mix_data)
+        return mixed
+
+
+class _Convolve(_Processor):
+    def __init__(self, ir_spectrum, ir_len, n_fft):
+        self.ir_spectrum = ir_spectrum
+        self.ir_len = ir_len
+        self.n_fft = n_fft
+        self.tail = numpy.zeros(ir_len - 1)
+
+    def process(self, block):
+        if len(block) == 0:
+            return block
+        y = _overlap_add(block, self.ir_spectrum, self.ir_len, self.n_fft)
+        # the convolution is ir_len - 1 longer than the block, so the previous
+        # tail always fits and the new one is always ir_len - 1 long
+        y[: len(self.tail)] += self.tail
+        self.tail = y[len(block) :].copy()
+        return y[: len(block)]
+
+    def flush(self):
+        tail, self.tail = self.tail, numpy.zeros(0)
+        return tail
+
+
+class _Delay(_Processor):
+    def __init__(self, n_samples):
+        self.buffer = numpy.zeros(n_samples)
+
+    def process(self, block):
+        delayed = numpy.concatenate((self.buffer, block))
+        self.buffer = delayed[len(block) :]
+        return delayed[: len(block)]
+
+    def flush(self):
+        buffer, self.buffer = self.buffer, numpy.zeros(0)
+        return buffer
+
+
+class _HarmonicDistortion(_Processor):
+    needs_stats = True
+
+    def __init__(self, num_passes):
+        self.num_passes = num_passes
+
+    def prepare(self, stats):
+        self.range = (stats.min, stats.max)
+
+    def process(self, block):
+        block = numpy.interp(block, self.range, (-1.0, +1.0))
+        for _ in range(self.num_passes):
+            block = numpy.sin(block * (math.pi / 2.0))
+        return numpy.interp(block, (-1.0, +1.0), self.range)
+
+
+def _long_noise_power(long_noise, n_samples):
+    # mean power of the first n_samples of a LongNoise, a chunk at a time
+    total = 0.0
+    for start in range(0, n_samples, long_noise.chunk_size):
+        block = long_noise.read(min(long_noise.chunk_size, n_samples - start))
+        total += numpy.sum(numpy.square(block, dtype=numpy.float64))
+    return total / n_samples
+
+
+def _looped_power(data, start, n_samples):
+    # mean power of data looped to n_samples from start, without building it
+    if n_samples == 0:
+        return 0.0
+    cumulative = numpy.concatenate(
+        ([0.0], numpy.cumsum(numpy.square(data, dtype=numpy.float64)))
+    )
+
+    def sum_to(end):
+        full, rest = divmod(end, len(data))
+        return full * cumulative[-1] + cumulative[rest]
+
+    return (sum_to(start + n_samples) - sum_to(start)) / n_samples
+
+
+def _open_source(path, block_size):
+    try:
+        return _WavSource(path, block_size)
+    except (wave.Error, EOFError):
+        return _FFmpegSource(path, block_size)
+
+
+class _WavSource(object):
+    """PCM WAV input read with the wave module, downmixed to mono"""
+
+    def __init__(self, path, block_size):
+        with wave.open(path, "rb") as f:
+            self.sample_rate = f.getframerate()
+            self.channels = f.getnchannels()
+            self.file_width = f.getsampwidth()
+        self.path = path
+        self.block_size = block_size
+        self.format = "wav"
+        # pydub widens 24 bit audio to 32 bit
+        self.sample_width = 4 if self.file_width == 3 else self.file_width
+
+    def blocks(self):
+        with wave.open(self.path, "rb") as f:
+            while True:
+                frames = f.readframes(self.block_size)
+                if not frames:
+                    break
+                yield _downmix(self._to_float(frames), self.channels)
+
+    def _to_float(self, frames):
+        if self.file_width == 1:
+            return (numpy.frombuffer(frames, dtype=numpy.uint8) - 128.0) / 128.0
+        if self.file_width == 3:
+            raw = numpy.frombuffer(frames, dtype=numpy.uint8).reshape(-1, 3)
+            padded = numpy.zeros((len(raw), 4), dtype=numpy.uint8)
+            padded[:, 1:] = raw
+            return padded.view("<i4").ravel() / float(2**31)
+        dtype = "<i{0}".format(self.file_width)
+        return numpy.frombuffer(frames, dtype=dtype) / float(
+            2 ** (8 * self.file_width - 1)
+        )
+
+
+class _FFmpegSource(object):
+    """Any other input, decoded to float samples through an ffmpeg pipe"""
+
+    def __init__(self, path, block_size):
+        info = mediainfo(path)
+        if "sample_rate" not in info:
+            raise ValueError("Couldn't read audio stream info from {0}".format(path))
+        self.sample_rate = int(info["sample_rate"])
+        self.channels = _int_info(info, "channels") or 1
+        bits = max(
+            _int_info(info, "bits_per_raw_sample"), _int_info(info, "bits_per_sample")
+        )
+        self.sample_width = 4 if bits > 16 else 2
+        self.path = path
+        self.block_size = block_size
+        self.format = path.split(".")[-1]
+
+    def blocks(self):
+        frame_bytes = 4 * self.channels
+        proc = subprocess.Popen(
+            [
+                AudioSegment.converter,
+                "-v",
+                "error",
+                "-i",
+                self.path,
+                "-f",
+                "f32le",
+                "-",
+            ],
+            stdout=subprocess.PIPE,
+            stdin=subprocess.DEVNULL,
+        )
+        try:
+            while True:
+                data = proc.stdout.read(self.block_size * frame_bytes)
+                if not data:
+                    break
+                data = data[: len(data) - len(data) % frame_bytes]
+                block = numpy.frombuffer(data, dtype="<f4").astype(numpy.float64)
+                yield _downmix(block, self.channels)
+        finally:
+            proc.stdout.close()
+            if proc.wait() != 0:
+                raise RuntimeError(
+                    "ffmpeg failed to decode {0} ({1})".format(
+                        self.path, proc.returncode
+                    )
+                )
+
+
+def _int_info(info, key):
+    # ffprobe reports unknown values as "N/A"
+    try:
+        return int(info.get(key))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _downmix(interleaved, channels):
+    if channels == 1:
+        return interleaved
+    return interleaved.reshape(-1, channels).mean(axis=1)
+
+
+class _TempFiles(object):
+    def __init__(self, tmp_dir):
+        self.tmp_dir = tmp_dir
+
+    def new(self, sample_rate, sample_width, block_size):
+        f = tempfile.NamedTemporaryFile(dir=self.tmp_dir, delete=False)
+        f.close()
+        return _RawSpill(f.name, sample_rate, sample_width, block_size)
+
+
+class _RawSpill(object):
+    """Intermediate float32 samples on disk, written once and then read back"""
+
+    def __init__(self, path, sample_rate, sample_width, block_size):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.block_size = block_size
+        self.format = "wav"
+
+    def __enter__(self):
+        self._f = open(self.path, "wb")
+        return self
+
+    def __exit__(self, *exc):
+        self._f.close()
+
+    def write(self, block):
+        self._f.write(numpy.asarray(block, dtype="<f4").tobytes())
+
+    def blocks(self):
+        with open(self.path, "rb") as f:
+            while True:
+                block = numpy.fromfile(f, dtype="<f4", count=self.block_size)
+                if len(block) == 0:
+                    break
+                yield block.astype(numpy.float64)
+
+
+class _WavSink(object):
+    def __init__(self, path, sample_rate, sample_width):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+
+    def __enter__(self):
+        self._f = wave.open(self.path, "wb")
+        self._f.setnchannels(1)
+        self._f.setsampwidth(self.sample_width)
+        self._f.setframerate(self.sample_rate)
+        return self
+
+    def __exit__(self, *exc):
+        self._f.close()
+
+    def write(self, block):
+        pcm = _float_to_pcm(numpy.asarray(block), self.sample_width)
+        if self.sample_width == 1:
+            # 8 bit WAV is unsigned
+            pcm = (pcm.astype(numpy.int16) + 128).astype(numpy.uint8)
+        self._f.writeframes(pcm.tobytes())
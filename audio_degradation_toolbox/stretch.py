@@ -0,0 +1,305 @@
+"""
+Time stretching and duration-preserving pitch shifting
+
+Two engines change the duration of a buffer without changing its pitch:
+
+    phase_vocoder   librosa's phase vocoder (same STFT size and hop), run in
+                    float32 and vectorized over frames, for quality
+    wsola           waveform similarity overlap-add in the time domain, which
+                    is much faster and keeps transients sharper, but can
+                    double or smear very tonal material
+
+A pitch shift stretches the buffer by the pitch ratio and resamples it back
+to its original length with the resample module.
+
+The STFTs of buffers are kept in stft_cache, keyed on a hash of their
+contents, so spectral steps on the same audio (e.g. the variants of one
+augmented input) analyze it once, while a buffer refilled in place is analyzed
+anew. Only analyses are cached: a spectrogram the phase vocoder synthesized
+isn't the STFT of the audio resynthesized from it.
+"""
+
+from .cache import LRUCache
+from .lazy import lazy_import
+from .resample import _fix_length, resample_ratio
+import hashlib
+import math
+import numpy
+
+numba = lazy_import("numba")
+scipy_fft = lazy_import("scipy.fft")
+
+N_FFT = 2048
+HOP_LENGTH = N_FFT // 4
+
+STRETCH_ENGINES = ("phase_vocoder", "wsola")
+
+# spectrograms of buffers, by the hash of their contents
+stft_cache = LRUCache(max_bytes=512 * 1024 * 1024)
+
+# frames transformed at a time, to bound the windowed copy of the signal
+_STFT_CHUNK = 4096
+
+
+def time_stretch(x, rate, sample_rate, engine="phase_vocoder", normalize=False):
+    """
+    x (samples along the last axis) played rate times faster, i.e. with
+    round(len / rate) samples, at the same pitch, and peak normalized if
+    normalize
+    """
+    n_samples = int(round(x.shape[-1] / rate))
+    if engine == "wsola":
+        y = wsola(x, rate, sample_rate, n_samples)
+        if normalize:
+            y *= _inverse_peak(y)
+        return y
+
+    y = istft(phase_vocoder(stft(x), rate), n_samples)
+    if normalize:
+        y *= _inverse_peak(y)
+    return y
+
+
+def pitch_shift(x, octaves, sample_rate, engine="phase_vocoder", quality="medium"):
+    """
+    x shifted by octaves, with the same number of samples, resampled back at
+    one of the resample module's qualities
+    """
+    ratio = 2.0**octaves
+    stretched = time_stretch(x, 1 / ratio, sample_rate, engine)
+    shifted = resample_ratio(stretched, 1 / ratio, quality)
+    return _fix_length(shifted, x.shape[-1]).astype(x.dtype, copy=False)
+
+
+def stft(x):
+    """
+    Centered STFT of x as complex64 (..., frames, bins), like librosa's stft
+    with its default zero padding, cached for the contents of x
+    """
+    key = _key(x)
+    cached = stft_cache.get(key)
+    if cached is not None:
+        return cached
+
+    window = _window()
+    padded = numpy.pad(
+        x.astype(numpy.float32, copy=False),
+        [(0, 0)] * (x.ndim - 1) + [(N_FFT // 2, N_FFT // 2)],
+    )
+    n_frames = 1 + (padded.shape[-1] - N_FFT) // HOP_LENGTH
+    step = padded.strides[-1]
+    frames = numpy.lib.stride_tricks.as_strided(
+        padded,
+        shape=padded.shape[:-1] + (n_frames, N_FFT),
+        strides=padded.strides[:-1] + (step * HOP_LENGTH, step),
+        writeable=False,
+    )
+    spectrogram = numpy.empty(
+        frames.shape[:-1] + (N_FFT // 2 + 1,), dtype=numpy.complex64
+    )
+    for start in range(0, frames.shape[-2], _STFT_CHUNK):
+        chunk = slice(start, start + _STFT_CHUNK)
+        spectrogram[..., chunk, :] = scipy_fft.rfft(frames[..., chunk, :] * window)
+
+    spectrogram.setflags(write=False)
+    return stft_cache.put(key, spectrogram)
+
+
+def istft(spectrogram, n_samples):
+    """Inverse of stft, overlap-adding n_samples of float32"""
+    window = _window()
+    n_frames = spectrogram.shape[-2]
+    overlap = N_FFT // HOP_LENGTH
+
+    # overlap-add the frames as blocks of HOP_LENGTH samples: block j of the
+    # output sums block k of frame j - k for every k
+    y = numpy.zeros(
+        spectrogram.shape[:-2] + (n_frames + overlap - 1, HOP_LENGTH),
+        dtype=numpy.float32,
+    )
+    for start in range(0, n_frames, _STFT_CHUNK):
+        chunk = spectrogram[..., start : start + _STFT_CHUNK, :]
+        frames = scipy_fft.irfft(chunk, N_FFT).astype(numpy.float32, copy=False)
+        frames = (frames * window).reshape(frames.shape[:-1] + (overlap, HOP_LENGTH))
+        for k in range(overlap):
+            y[..., start + k : start + k + frames.shape[-3], :] += frames[..., k, :]
+    y = y.reshape(y.shape[:-2] + (-1,))
+
+    # divide out the overlapping squared windows, except where they vanish
+    envelope = numpy.zeros((n_frames + overlap - 1, HOP_LENGTH), dtype=numpy.float32)
+    squared = numpy.square(window).reshape(overlap, HOP_LENGTH)
+    for k in range(overlap):
+        envelope[k : k + n_frames] += squared[k]
+    envelope = envelope.reshape(-1)
+    nonzero = envelope > numpy.finfo(numpy.float32).tiny
+    y[..., nonzero] /= envelope[nonzero]
+
+    return _fix_length(y[..., N_FFT // 2 :], n_samples)
+
+
+def phase_vocoder(spectrogram, rate):
+    """
+    Spectrogram (..., frames, bins) with its frames interpolated at steps of
+    rate, and their phases advanced to match, like librosa's phase_vocoder
+    """
+    n_frames, n_bins = spectrogram.shape[-2:]
+    steps = numpy.arange(0, n_frames, rate)
+    # expected phase advance of every bin over a hop
+    advance = numpy.linspace(0, math.pi * HOP_LENGTH, n_bins)
+    advance32 = advance.astype(numpy.float32)
+
+    # magnitudes and phases of every frame, and two frames of silence past
+    # the end, as librosa pads
+    silence = numpy.zeros(spectrogram.shape[:-2] + (2, n_bins), dtype=numpy.float32)
+    magnitudes = numpy.concatenate((numpy.abs(spectrogram), silence), axis=-2)
+    angles = numpy.concatenate((numpy.angle(spectrogram), silence), axis=-2)
+
+    out = numpy.empty(
+        spectrogram.shape[:-2] + (len(steps), n_bins), dtype=numpy.complex64
+    )
+    phase = angles[..., :1, :].astype(numpy.float64)
+    for start in range(0, len(steps), _STFT_CHUNK):
+        chunk = steps[start : start + _STFT_CHUNK]
+        index = chunk.astype(numpy.intp)
+        alpha = (chunk - index).astype(numpy.float32)[:, None]
+
+        magnitude = magnitudes[..., index, :]
+        magnitude += alpha * (magnitudes[..., index + 1, :] - magnitude)
+
+        # the phase of every output frame is the phase of the first plus the
+        # measured advances of the frames before it, accumulated in float64
+        delta = angles[..., index + 1, :] - angles[..., index, :]
+        delta -= advance32
+        delta -= numpy.float32(2 * math.pi) * numpy.round(
+            delta * numpy.float32(0.5 / math.pi)
+        )
+        accumulated = numpy.cumsum(delta + advance, axis=-2)
+        accumulated[..., 1:, :] = accumulated[..., :-1, :]
+        accumulated[..., :1, :] = 0.0
+        accumulated += phase
+        phase = accumulated[..., -1:, :] + (delta[..., -1:, :] + advance)
+        # keep the accumulator small, so its float64 precision holds up
+        phase = numpy.mod(phase, 2 * math.pi)
+        phases = numpy.mod(accumulated, 2 * math.pi).astype(numpy.float32)
+
+        frames = out[..., start : start + len(chunk), :]
+        frames.real = magnitude * numpy.cos(phases)
+        frames.imag = magnitude * numpy.sin(phases)
+    return out
+
+
+def wsola(x, rate, sample_rate, n_samples):
+    """
+    n_samples of x played rate times faster: 20 ms Hann windowed frames at
+    50% overlap, each taken from within 10 ms of where it nominally starts at
+    the offset whose first half (the part overlapping the frame before it) is
+    most similar to the continuation of that frame
+    """
+    frame = 2 * max(8, int(0.01 * sample_rate))
+    hop = frame // 2
+    tolerance = hop
+    # the similarity search runs on a mono guide decimated to about 8 kHz,
+    # then is refined around its best offset at the full rate
+    decimation = max(1, sample_rate // 8000)
+
+    n_frames = -(-(n_samples + hop) // hop) + 1
+    # frame k starts at k * hop of the output, padded with hop in front, and
+    # nominally at k * hop * rate of the input, padded the same way
+    padded = numpy.pad(
+        x.reshape(-1, x.shape[-1]).astype(numpy.float32, copy=False),
+        [(0, 0), (hop, int(n_frames * hop * rate) + frame + tolerance)],
+    )
+    guide = padded[0] if len(padded) == 1 else padded.mean(axis=0)
+    n_coarse = len(guide) // decimation
+    coarse = sum(
+        guide[i : n_coarse * decimation : decimation] for i in range(decimation)
+    )
+
+    search, overlap_add = _compiled_wsola()
+    starts = search(
+        guide, coarse, n_frames, frame, hop, hop * rate, tolerance, decimation
+    )
+    y = numpy.zeros((len(padded), (n_frames + 1) * hop), dtype=numpy.float32)
+    overlap_add(padded, starts, _periodic_hann(frame), y)
+    return _fix_length(y[:, hop:].reshape(x.shape[:-1] + (-1,)), n_samples)
+
+
+def _wsola_search(guide, coarse, n_frames, frame, hop, analysis_hop, tolerance, d):
+    # start of every frame in the input, chosen one after the other
+    starts = numpy.zeros(n_frames, dtype=numpy.int64)
+    limit = len(guide) - frame
+    for k in range(1, n_frames):
+        natural = starts[k - 1] + hop
+        nominal = int(k * analysis_hop)
+
+        best = nominal
+        best_score = -numpy.inf
+        c_natural = natural // d
+        for c in range((nominal - tolerance) // d, (nominal + tolerance) // d + 1):
+            if c < 0 or c * d > limit or c + hop // d > len(coarse):
+                continue
+            score = 0.0
+            for i in range(hop // d):
+                score += coarse[c_natural + i] * coarse[c + i]
+            if score > best_score:
+                best_score = score
+                best = c * d
+
+        coarse_best = best
+        best_score = -numpy.inf
+        for p in range(coarse_best - d, coarse_best + d + 1):
+            if p < 0 or p > limit:
+                continue
+            score = 0.0
+            for i in range(hop):
+                score += guide[natural + i] * guide[p + i]
+            if score > best_score:
+                best_score = score
+                best = p
+        starts[k] = best
+    return starts
+
+
+def _wsola_overlap_add(x, starts, window, out):
+    # frame k of every channel, windowed, added at k * hop of the output
+    hop = len(window) // 2
+    for k in range(len(starts)):
+        for channel in range(x.shape[0]):
+            for i in range(len(window)):
+                out[channel, k * hop + i] += window[i] * x[channel, starts[k] + i]
+
+
+_compiled = {}
+
+
+def _compiled_wsola():
+    # compiled on first use only, numba caches the machine code on disk; the
+    # similarity sums may be reordered to vectorize them
+    if "wsola" not in _compiled:
+        _compiled["wsola"] = (
+            numba.njit(cache=True, fastmath=True)(_wsola_search),
+            numba.njit(cache=True)(_wsola_overlap_add),
+        )
+    return _compiled["wsola"]
+
+
+def _inverse_peak(y):
+    peak = numpy.max(numpy.abs(y)) if y.size else 0
+    return numpy.float32(1.0 / peak if peak > 0 else 1.0)
+
+
+def _key(x):
+    # the contents rather than the buffer, which a caller may refill in place;
+    # hashing costs a fraction of the transform
+    digest = hashlib.blake2b(numpy.ascontiguousarray(x), digest_size=16).digest()
+    return (digest, x.shape, x.dtype.str, N_FFT, HOP_LENGTH)
+
+
+def _window():
+    return _periodic_hann(N_FFT)
+
+
+def _periodic_hann(n):
+    return (0.5 - 0.5 * numpy.cos(2 * math.pi * numpy.arange(n) / n)).astype(
+        numpy.float32
+    )
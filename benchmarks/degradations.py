@@ -0,0 +1,354 @@
+"""
+Throughput and memory of every degradation and preset on synthetic input
+
+Each case (one degradation or preset, at one duration and sample rate) runs
+in a fresh interpreter, so its peak RSS isn't inflated by the cases before it.
+An untimed pass over a second of audio first loads the lazily imported
+dependencies and fills the per-process caches (noise bank, filter designs,
+compiled code), so every duration measures the steady-state cost a batch
+worker pays per file. Throughput is reported as a realtime factor: seconds of
+audio degraded per second of wall time.
+
+    $ python benchmarks/degradations.py [--durations 1 60 1800]
+        [--sample-rates 16000 44100 48000] [--cases gain mp3 preset:strong_mp3]
+        [--output results.json] [--baseline baseline.json] [--tolerance 0.2]
+        [--data-dir .]
+
+With --baseline, cases whose realtime factor dropped or whose peak RSS grew
+by more than --tolerance (a fraction) are listed and the exit status is 1.
+benchmarks/baseline.json, on the machine named in it, was written by
+
+    $ python benchmarks/degradations.py --durations 60 --sample-rates 44100
+        --output benchmarks/baseline.json
+
+with the samples pulled from Git LFS. Timings don't carry over to other
+machines, so regenerate it from the base revision before comparing there, and
+leave shorter durations out: their sub-millisecond cases swing by more than
+the tolerance from run to run.
+The presets' relative sample paths are resolved from --data-dir. The toolbox
+is imported from this checkout, so it doesn't need to be installed.
+"""
+
+from pydub import AudioSegment
+import argparse
+import contextlib
+import json
+import numpy
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PRESETS_DIR = os.path.join(REPO_DIR, "presets")
+
+# the child processes run this file too, from --data-dir
+sys.path.insert(0, REPO_DIR)
+from audio_degradation_toolbox.chain import DEGRADATIONS  # noqa: E402
+
+# the parameters of a representative step for every registered degradation;
+# {ir} and {mix} are replaced by synthetic files
+CASE_PARAMS = {
+    "noise": {"color": "pink", "snr": 20},
+    "mp3": {"bitrate": 128},
+    "gain": {"volume": 6.0},
+    "normalize": {},
+    "low_pass": {"cutoff": 3000.0},
+    "high_pass": {"cutoff": 200.0},
+    "band_pass": {
+        "low_cutoff": 300.0,
+        "high_cutoff": 3400.0,
+        "type": "ellip",
+        "order": 4,
+    },
+    "trim_millis": {"amount": 100, "offset": 0},
+    "mix": {"path": "{mix}", "snr": 10.0, "offset": "random"},
+    "speedup": {"speed": 1.1},
+    "resample": {"rate": 8000},
+    "pitch_shift": {"octaves": 0.5},
+    "dynamic_range_compression": {},
+    "impulse_response": {"path": "{ir}"},
+    "equalizer": {"frequency": 1000.0, "bandwidth": 1.0, "gain": -6.0},
+    "time_stretch": {"factor": 1.2},
+    "delay": {"samples": 4800},
+    "clipping": {"percent_samples": 1.0},
+    "wow_flutter": {},
+    "aliasing": {"dest_frequency": 8000.0},
+    "harmonic_distortion": {},
+}
+
+
+def degradation_cases():
+    """
+    Every registered degradation, raising ValueError if one has no case
+    parameters (or a case is left over from one that's gone)
+    """
+    missing = sorted(set(DEGRADATIONS) - set(CASE_PARAMS))
+    unknown = sorted(set(CASE_PARAMS) - set(DEGRADATIONS))
+    if missing or unknown:
+        raise ValueError(
+            "CASE_PARAMS is out of date: {0}".format(
+                "; ".join(
+                    "{0} {1}".format(what, ", ".join(names))
+                    for what, names in (
+                        ("no case for", missing),
+                        ("not registered:", unknown),
+                    )
+                    if names
+                )
+            )
+        )
+    return sorted(DEGRADATIONS)
+
+
+def all_cases():
+    cases = degradation_cases()
+    for preset in sorted(os.listdir(PRESETS_DIR)):
+        if preset.endswith(".json"):
+            cases.append("preset:" + preset[: -len(".json")])
+    return cases
+
+
+def synthetic_audio(seconds, sample_rate):
+    # a few harmonics of a slowly gliding tone over a noise floor, as 16 bit PCM
+    rng = numpy.random.RandomState(0)
+    t = numpy.arange(int(seconds * sample_rate)) / sample_rate
+    phase = 2 * numpy.pi * (220.0 * t + 20.0 * numpy.sin(2 * numpy.pi * 0.1 * t))
+    data = sum(0.2 / k * numpy.sin(k * phase) for k in range(1, 5))
+    data += 0.01 * rng.standard_normal(len(t))
+    return AudioSegment(
+        data=(data * 32767).astype(numpy.int16).tobytes(),
+        sample_width=2,
+        frame_rate=sample_rate,
+        channels=1,
+    )
+
+
+def write_fixtures(tmp_dir):
+    """A 0.5 s decaying IR and 2 s of noise to mix, as 48 kHz WAV files"""
+    rng = numpy.random.RandomState(1)
+    paths = {}
+    for name, data in (
+        ("ir", rng.standard_normal(24000) * numpy.exp(-numpy.arange(24000) / 4000.0)),
+        ("mix", 0.3 * rng.standard_normal(96000)),
+    ):
+        paths[name] = os.path.join(tmp_dir, name + ".wav")
+        with wave.open(paths[name], "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(48000)
+            pcm = numpy.clip(data / numpy.max(numpy.abs(data)), -1, 1) * 32767
+            f.writeframes(pcm.astype(numpy.int16).tobytes())
+    return paths
+
+
+def case_degradations(case, fixtures):
+    if case.startswith("preset:"):
+        with open(os.path.join(PRESETS_DIR, case[len("preset:") :] + ".json")) as f:
+            return json.load(f)
+
+    step = {"name": case}
+    for key, value in CASE_PARAMS[case].items():
+        step[key] = value.format(**fixtures) if isinstance(value, str) else value
+    return [step]
+
+
+def run_case(case, seconds, sample_rate, fixtures):
+    """Runs in the child: degrade synthetic audio and measure it"""
+    from audio_degradation_toolbox.audio import Audio
+    from audio_degradation_toolbox.chain import Chain
+    from audio_degradation_toolbox.core import Degradation
+
+    chain = Chain(case_degradations(case, fixtures))
+
+    # imports, noise synthesis, filter designs and numba compilation aren't
+    # part of the per-file cost
+    warm_up = Degradation(audio=Audio(sound=synthetic_audio(1.0, sample_rate)))
+    warm_up.apply_degradations(chain)
+    warm_up.file_audio.samples
+    del warm_up
+
+    audio = Audio(sound=synthetic_audio(seconds, sample_rate))
+    input_rss = _max_rss_mb()
+
+    deg = Degradation(audio=audio)
+    del audio
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    deg.apply_degradations(chain)
+    # the PCM conversion is part of the cost of every run that gets exported
+    deg.file_audio.samples
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+
+    return {
+        "wall_seconds": wall,
+        "cpu_seconds": cpu,
+        "realtime_factor": seconds / wall if wall > 0 else float("inf"),
+        "input_rss_mb": input_rss,
+        "peak_rss_mb": _max_rss_mb(),
+    }
+
+
+def _max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0)
+
+
+def spawn_case(case, seconds, sample_rate, fixtures, data_dir, timeout):
+    args = json.dumps([case, seconds, sample_rate, fixtures])
+    try:
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--run-case", args],
+            cwd=data_dir,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        return {"error": "timed out after {0} s".format(timeout)}
+    if proc.returncode != 0:
+        lines = proc.stderr.strip().splitlines()
+        return {
+            "error": lines[-1] if lines else "exit status {0}".format(proc.returncode)
+        }
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline, tolerance):
+    """Descriptions of the cases that got slower or bigger than the baseline"""
+    previous = {_key(r): r for r in baseline["results"] if "error" not in r}
+    regressions = []
+    for result in results:
+        before = previous.get(_key(result))
+        if before is None or "error" in result:
+            continue
+        if result["realtime_factor"] < before["realtime_factor"] * (1 - tolerance):
+            regressions.append(
+                "{0}: realtime factor {1:.1f}x -> {2:.1f}x".format(
+                    _label(result), before["realtime_factor"], result["realtime_factor"]
+                )
+            )
+        if result["peak_rss_mb"] > before["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(
+                "{0}: peak RSS {1:.0f} MB -> {2:.0f} MB".format(
+                    _label(result), before["peak_rss_mb"], result["peak_rss_mb"]
+                )
+            )
+    return regressions
+
+
+def _key(result):
+    return (result["case"], result["seconds"], result["sample_rate"])
+
+
+def _label(result):
+    return "{0} {1} s @ {2} Hz".format(*_key(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--durations", type=float, nargs="+", default=[1.0, 60.0, 1800.0]
+    )
+    parser.add_argument(
+        "--sample-rates", type=int, nargs="+", default=[16000, 44100, 48000]
+    )
+    parser.add_argument("--cases", nargs="+", default=None)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--timeout", type=float, default=3600.0)
+    parser.add_argument("--data-dir", default=REPO_DIR)
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        # degradations log to stdout, which is reserved for the result
+        with contextlib.redirect_stdout(sys.stderr):
+            result = run_case(*json.loads(args.run_case))
+        print(json.dumps(result))
+        return
+
+    try:
+        cases = args.cases or all_cases()
+    except ValueError as e:
+        parser.error(str(e))
+    results = []
+    print(
+        "{0:<28} {1:>8} {2:>6} {3:>10} {4:>10} {5:>10}".format(
+            "case", "seconds", "rate", "wall s", "realtime", "peak MB"
+        )
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fixtures = write_fixtures(tmp_dir)
+        for case in cases:
+            for seconds in args.durations:
+                for sample_rate in args.sample_rates:
+                    result = {
+                        "case": case,
+                        "seconds": seconds,
+                        "sample_rate": sample_rate,
+                    }
+                    result.update(
+                        spawn_case(
+                            case,
+                            seconds,
+                            sample_rate,
+                            fixtures,
+                            args.data_dir,
+                            args.timeout,
+                        )
+                    )
+                    results.append(result)
+                    if "error" in result:
+                        print(
+                            "{0:<28} {1:>8g} {2:>6} FAILED {3}".format(
+                                case, seconds, sample_rate, result["error"]
+                            )
+                        )
+                        continue
+                    print(
+                        "{0:<28} {1:>8g} {2:>6} {3:>10.3f} {4:>9.1f}x {5:>10.0f}".format(
+                            case,
+                            seconds,
+                            sample_rate,
+                            result["wall_seconds"],
+                            result["realtime_factor"],
+                            result["peak_rss_mb"],
+                        )
+                    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions against {0}:".format(args.baseline))
+            for regression in regressions:
+                print("  " + regression)
+            sys.exit(1)
+        print("\nNo regressions against {0}".format(args.baseline))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Startup cost of the toolbox: python -X importtime for a fresh interpreter
+importing a module, with the slowest imports and any heavy dependency that got
+pulled in eagerly
+
+    $ python benchmarks/import_time.py [--module audio_degradation_toolbox.cli]
+        [--top 15] [--max-ms 500]
+
+Exits with status 1 if the total import time is over --max-ms.
+"""
+
+import argparse
+import subprocess
+import sys
+
+# only meant to be imported by the degradations that use them
+HEAVY_MODULES = (
+    "acoustics",
+    "librosa",
+    "numba",
+    "scipy.fft",
+    "scipy.signal",
+)
+
+
+def import_times(module):
+    """(module, self us, cumulative us) for every import, in import order"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import {0}".format(module)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    ).stderr
+
+    times = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        times.append((name.strip(), int(self_us), int(cumulative_us)))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--module", default="audio_degradation_toolbox.cli")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--max-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    times = import_times(args.module)
+    total_ms = sum(self_us for _, self_us, _ in times) / 1000.0
+
+    print("{0:>10} {1:>10}  {2}".format("self ms", "cumul ms", "module"))
+    slowest = sorted(times, key=lambda t: t[2], reverse=True)[: args.top]
+    for name, self_us, cumulative_us in slowest:
+        print(
+            "{0:>10.1f} {1:>10.1f}  {2}".format(
+                self_us / 1000.0, cumulative_us / 1000.0, name
+            )
+        )
+
+    imported = {name for name, _, _ in times}
+    heavy = [m for m in HEAVY_MODULES if m in imported]
+    print("\nimport {0}: {1:.1f} ms".format(args.module, total_ms))
+    print("heavy modules imported: {0}".format(", ".join(heavy) if heavy else "none"))
+
+    if args.max_ms is not None and total_ms > args.max_ms:
+        print(
+            "over the {0:.1f} ms budget".format(args.max_ms),
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
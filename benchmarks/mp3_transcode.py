@@ -0,0 +1,61 @@
+"""
+Per-call cost of the mp3 degradation: one ffmpeg encode through pipes and an
+in-process decode, against the old round trip through a temporary mp3 file
+
+    $ python benchmarks/mp3_transcode.py [--repeat 10]
+"""
+
+from audio_degradation_toolbox.audio import Audio
+from audio_degradation_toolbox.degradations import (
+    _mp3_transcode_pipe,
+    _mp3_transcode_tempfile,
+)
+from pydub import AudioSegment
+import argparse
+import numpy
+import timeit
+
+
+def synthetic_audio(seconds, sample_rate=44100):
+    t = numpy.arange(int(seconds * sample_rate)) / sample_rate
+    data = 0.5 * numpy.sin(2 * numpy.pi * 440.0 * t)
+    pcm = (data * 32767).astype(numpy.int16)
+    return Audio(
+        sound=AudioSegment(
+            data=pcm.tobytes(), sample_width=2, frame_rate=sample_rate, channels=1
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--bitrate", type=int, default=128)
+    args = parser.parse_args()
+
+    print(
+        "{0:>8} {1:>12} {2:>12} {3:>8}".format(
+            "seconds", "tempfile ms", "pipe ms", "speedup"
+        )
+    )
+    for seconds in (1, 5, 30):
+        audio = synthetic_audio(seconds)
+        timings = []
+        for fn in (_mp3_transcode_tempfile, _mp3_transcode_pipe):
+            timings.append(
+                min(
+                    timeit.repeat(
+                        lambda: fn(audio, args.bitrate), number=1, repeat=args.repeat
+                    )
+                )
+                * 1000.0
+            )
+        print(
+            "{0:>8} {1:>12.1f} {2:>12.1f} {3:>7.2f}x".format(
+                seconds, timings[0], timings[1], timings[0] / timings[1]
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,34 @@
 import unittest
-from audio_degradation_toolbox.core import Degradation
+from audio_degradation_toolbox.core import Degradation, degrade
+from audio_degradation_toolbox.audio import Audio
+from audio_degradation_toolbox.batch import output_path_for, run_batch
+from audio_degradation_toolbox.stream import stream_degradations
+from audio_degradation_toolbox.chain import Chain
+from audio_degradation_toolbox.plan import FusedFilter, compile_plan, describe_plan
+from audio_degradation_toolbox.augment import Augmentation
+from audio_degradation_toolbox.noise import NoiseBank, noise_bank
+from audio_degradation_toolbox.hooks import Trace, print_step
+from audio_degradation_toolbox.output_cache import OutputCache, parse_size
+from audio_degradation_toolbox.stretch import stft_cache
+from audio_degradation_toolbox.degradations import (
+    apply_clipping,
+    ir_cache,
+    mix_cache,
+    _filter_sos,
+    _mp3_transcode_pipe,
+    _mp3_transcode_tempfile,
+    _stretch_mix,
+)
 import numpy
 import scipy.signal as scipy_signal
 import math
 import copy
+import json
 import numba
+import os
+import subprocess
+import sys
+import tempfile
 
 
 # https://gist.github.com/sebpiq/4128537
@@ -38,7 +62,7 @@ def goertzel(samples, sample_rate, *freqs):
             d2, d1 = d1, y
 
         results.append(
-            (0.5 * w_real * d1 - d2, w_imag * d1, d2 ** 2 + d1 ** 2 - w_real * d1 * d2)
+            (0.5 * w_real * d1 - d2, w_imag * d1, d2**2 + d1**2 - w_real * d1 * d2)
         )
         freqs.append(f * sample_rate)
 
@@ -90,6 +114,75 @@ class TestAllDegradations(unittest.TestCase):
         # noise won't affect the length
         self.assertEqual(len(self.d.file_audio.sound), 3664)
 
+    def test_noise_snr(self):
+        before = numpy.frombuffer(
+            self.d.file_audio.samples, dtype=self.d.file_audio.sound.array_type
+        ).astype(numpy.float64)
+
+        self.d.apply_degradation({"name": "noise", "color": "white", "snr": 20})
+        after = numpy.frombuffer(
+            self.d.file_audio.samples, dtype=self.d.file_audio.sound.array_type
+        ).astype(numpy.float64)
+
+        snr = 10 * numpy.log10(
+            numpy.mean(before**2) / numpy.mean((after - before) ** 2)
+        )
+        self.assertAlmostEqual(snr, 20.0, delta=0.5)
+
+    def test_noise_seed(self):
+        def noisy(seed, color="pink"):
+            d = copy.deepcopy(self.d)
+            d.apply_degradation({"name": "noise", "color": color, "seed": seed})
+            return d.file_audio.data
+
+        numpy.testing.assert_array_equal(noisy(5), noisy(5))
+        self.assertFalse(numpy.array_equal(noisy(5), noisy(6)))
+        self.assertFalse(numpy.array_equal(noisy(None), noisy(None)))
+        self.assertFalse(numpy.array_equal(noisy(5), noisy(5, "brown")))
+
+    def test_noise_bank(self):
+        bank = NoiseBank(n_samples=4096)
+        rng = numpy.random.RandomState(0)
+        noise = bank.draw("pink", 1000, rng)
+        self.assertEqual(len(noise), 1000)
+        self.assertTrue(numpy.shares_memory(noise, bank.buffer("pink")))
+
+        # the bank is periodic, so wrapping around it is seamless
+        buf = bank.buffer("brown")
+        wrapped = bank.segment("brown", 4000, 200)
+        numpy.testing.assert_array_equal(wrapped[:96], buf[4000:])
+        numpy.testing.assert_array_equal(wrapped[96:], buf[:104])
+        self.assertLess(abs(wrapped[96] - wrapped[95]), 4 * numpy.std(numpy.diff(buf)))
+
+        # longer than the bank is synthesized rather than repeated, and the
+        # same whichever blocks it's read in
+        long_noise = bank.draw("brown", 20000, numpy.random.RandomState(1))
+        self.assertEqual(len(long_noise), 20000)
+        self.assertFalse(numpy.allclose(long_noise[:4096], long_noise[4096:8192]))
+        reader = bank.long_noise("brown", numpy.random.RandomState(1))
+        blocks = [reader.read(n) for n in (1, 999, 4096, 10000, 4904)]
+        numpy.testing.assert_array_equal(numpy.concatenate(blocks), long_noise)
+        # the crossfades keep the power and don't click
+        self.assertAlmostEqual(numpy.mean(numpy.square(long_noise)), 1.0, delta=0.3)
+        step = numpy.max(numpy.abs(numpy.diff(long_noise)))
+        self.assertLess(step, 6 * numpy.std(numpy.diff(bank.buffer("brown"))))
+
+    def test_mix_saturates(self):
+        mix = {
+            "name": "mix",
+            "path": "./samples/Viola.arco.ff.sulC.E3.stereo.aiff",
+            "snr": -20.0,
+        }
+        self.d.apply_degradation(mix)
+        mixed = numpy.frombuffer(
+            self.d.file_audio.samples, dtype=self.d.file_audio.sound.array_type
+        )
+
+        # mixing a signal with a louder copy of itself has to clip, not wrap
+        limits = numpy.iinfo(mixed.dtype)
+        self.assertEqual(numpy.max(mixed), limits.max)
+        self.assertEqual(numpy.min(mixed), limits.min)
+
     def test_mp3(self):
         mp3s = [
             {"name": "mp3"},
@@ -97,10 +190,21 @@ class TestAllDegradations(unittest.TestCase):
             {"name": "mp3", "bitrate": 64},
         ]
 
+        n_samples = self.d.file_audio.data.shape[-1]
         for mp3 in mp3s:
             self.d.apply_degradation(mp3)
 
-        self.assertTrue(len(self.d.file_audio.sound) > 3664)
+        self.assertEqual(self.d.file_audio.data.shape[-1], n_samples)
+
+    def test_mp3_alignment(self):
+        # the encoder delay and padding are trimmed on either path
+        data = numpy.zeros((2, 44100), dtype=numpy.float32)
+        data[:, 2000] = 0.9
+        audio = Audio(data=data, sample_rate=44100)
+        for transcode in (_mp3_transcode_pipe, _mp3_transcode_tempfile):
+            out = transcode(audio, 320).data
+            self.assertEqual(out.shape, data.shape)
+            self.assertEqual(list(numpy.argmax(numpy.abs(out), axis=-1)), [2000, 2000])
 
     def test_gain(self):
         prev_max = numpy.max(
@@ -132,6 +236,20 @@ class TestAllDegradations(unittest.TestCase):
         normalize = {"name": "normalize"}
         self.d.apply_degradation(normalize)
 
+    def test_numpy_steps_stay_lazy(self):
+        steps = [
+            {"name": "gain", "volume": -3.0},
+            {"name": "noise", "color": "white", "snr": 30},
+            {"name": "delay", "samples": 100},
+            {"name": "normalize"},
+        ]
+        for step in steps:
+            self.d.apply_degradation(step)
+            # no pydub round trip happened between numpy-only steps
+            self.assertIsNone(self.d.file_audio._sound)
+
+        self.assertEqual(len(self.d.file_audio.sound), 3666)
+
     def test_low_pass(self):
         # our input is E3 aka 160ish hz
         old_pwr = goertzel(
@@ -160,6 +278,57 @@ class TestAllDegradations(unittest.TestCase):
 
         self.assertTrue(new_pwr < old_pwr)
 
+    def test_filter_designs(self):
+        noise = numpy.random.RandomState(0).standard_normal(44100)
+
+        def stopband_db(step):
+            # power above 4 kHz relative to below 1 kHz
+            f, pwr = scipy_signal.welch(degrade(noise, 44100, [step])[0], 44100)
+            return 10 * numpy.log10(pwr[f > 4000].mean() / pwr[f < 1000].mean())
+
+        rc = stopband_db({"name": "low_pass", "cutoff": 2000})
+        for filter_type in ("butter", "cheby1", "cheby2", "ellip", "bessel"):
+            step = {"name": "low_pass", "cutoff": 2000, "type": filter_type}
+            self.assertLess(stopband_db(dict(step, order=8)), rc - 20, filter_type)
+
+    def test_band_pass(self):
+        noise = numpy.random.RandomState(0).standard_normal(44100)
+        for filter_type in ("rc", "butter"):
+            step = {
+                "name": "band_pass",
+                "low_cutoff": 500,
+                "high_cutoff": 2000,
+                "type": filter_type,
+            }
+            f, pwr = scipy_signal.welch(degrade(noise, 44100, [step])[0], 44100)
+            passband = pwr[(f > 800) & (f < 1200)].mean()
+            self.assertLess(pwr[f < 100].mean(), passband, filter_type)
+            self.assertLess(pwr[f > 10000].mean(), passband, filter_type)
+
+    def test_zero_phase(self):
+        impulse = numpy.zeros(4001)
+        impulse[2000] = 1.0
+        step = {"name": "low_pass", "cutoff": 1000, "type": "butter", "order": 4}
+        causal, _ = degrade(impulse, 44100, [step])
+        zero_phase, _ = degrade(impulse, 44100, [dict(step, zero_phase=True)])
+
+        # the response is symmetric around the impulse instead of lagging it
+        self.assertEqual(numpy.argmax(zero_phase), 2000)
+        self.assertGreater(numpy.argmax(causal), 2000)
+        numpy.testing.assert_allclose(
+            zero_phase[:2000], zero_phase[:2000:-1], atol=1e-9
+        )
+
+    def test_filter_design_cache(self):
+        step = {"name": "high_pass", "cutoff": 321.0, "type": "ellip", "order": 6}
+        self.d.apply_degradation(step)
+        misses = _filter_sos.cache_info().misses
+        self.d.apply_degradation(step)
+        self.assertEqual(_filter_sos.cache_info().misses, misses)
+
+        with self.assertRaises(ValueError):
+            self.d.apply_degradation(dict(step, cutoff=30000))
+
     def test_trim_millis(self):
         trim_left = {"name": "trim_millis"}
         trim_right = {"name": "trim_millis", "offset": -1, "amount": 500}
@@ -182,6 +351,29 @@ class TestAllDegradations(unittest.TestCase):
 
         self.assertTrue(new_pwr > old_pwr)
 
+    def test_stretch_mix(self):
+        mix_data = numpy.arange(5)
+        numpy.testing.assert_array_equal(_stretch_mix(mix_data, 3, 1), [1, 2, 3])
+        numpy.testing.assert_array_equal(
+            _stretch_mix(mix_data, 12, 3), [3, 4, 0, 1, 2, 3, 4, 0, 1, 2, 3, 4]
+        )
+
+    def test_mix_cache(self):
+        mix_cache.clear()
+        mix = {
+            "name": "mix",
+            "path": "./samples/Noise_OldDustyRecording.wav",
+            "offset": "random",
+        }
+        for _ in range(3):
+            d = copy.deepcopy(self.orig_d)
+            d.apply_degradation(mix)
+            self.assertEqual(len(d.file_audio.sound), 3664)
+
+        # decoded once, reused for the other two
+        self.assertEqual(mix_cache.misses, 1)
+        self.assertEqual(mix_cache.hits, 2)
+
     def test_speedup(self):
         speedup = {"name": "speedup", "speed": 1.05}
         old_fs = self.d.file_audio.sample_rate
@@ -201,6 +393,32 @@ class TestAllDegradations(unittest.TestCase):
         self.d.apply_degradation(resample)
         self.assertEqual(self.d.file_audio.sample_rate, 96000)
 
+    def test_resample_quality(self):
+        # a tone above the new Nyquist frequency is filtered out, not aliased
+        t = numpy.arange(44100) / 44100.0
+        tone = 0.5 * numpy.sin(2 * math.pi * 15000 * t)
+        d = Degradation(audio=Audio(data=tone, sample_rate=44100))
+        for quality, attenuation_db in (("fast", 40), ("medium", 70), ("high", 100)):
+            step = {"name": "resample", "rate": 16000, "quality": quality}
+            resampled = copy.deepcopy(d)
+            resampled.apply_degradation(step)
+
+            data = resampled.file_audio.data
+            self.assertEqual(resampled.file_audio.sample_rate, 16000)
+            self.assertEqual(len(data), 16000)
+            self.assertIsNone(resampled.file_audio._sound)
+            residual_db = 10 * math.log10(numpy.mean(data[500:-500] ** 2) / 0.125)
+            self.assertLess(residual_db, -attenuation_db, quality)
+
+        # in band content passes
+        tone = 0.5 * numpy.sin(2 * math.pi * 1000 * t)
+        d = Degradation(audio=Audio(data=tone, sample_rate=44100))
+        d.apply_degradation({"name": "resample", "rate": 48000})
+        expected = 0.5 * numpy.sin(2 * math.pi * 1000 * numpy.arange(48000) / 48000.0)
+        numpy.testing.assert_allclose(
+            d.file_audio.data[500:-500], expected[500:-500], atol=1e-3
+        )
+
     def test_pitch_shift(self):
         # our input is E3 aka 160ish hz
         old_pwr = goertzel(
@@ -236,6 +454,41 @@ class TestAllDegradations(unittest.TestCase):
 
             self.assertTrue(new_pwr < old_pwr)
 
+    def test_compression_modes(self):
+        step = {"name": "dynamic_range_compression", "threshold": -30.0}
+        hop = copy.deepcopy(self.d)
+        hop.apply_degradation(step)
+        self.d.apply_degradation(dict(step, sample_accurate=True))
+
+        # updating the gain every millisecond only smooths the envelope
+        numpy.testing.assert_allclose(
+            hop.file_audio.data, self.d.file_audio.data, atol=0.05
+        )
+
+    def test_compression_knee(self):
+        # a tone just under the threshold is only attenuated by a soft knee
+        t = numpy.arange(44100) / 44100.0
+        tone = 10 ** (-21 / 20.0) * math.sqrt(2) * numpy.sin(2 * math.pi * 1000 * t)
+        step = {"name": "dynamic_range_compression", "threshold": -20.0}
+        hard, _ = degrade(tone, 44100, [step])
+        soft, _ = degrade(tone, 44100, [dict(step, knee=12.0)])
+        numpy.testing.assert_allclose(hard, tone, atol=1e-6)
+        # once the attack has settled
+        self.assertLess(
+            numpy.max(numpy.abs(soft[22050:])), 0.95 * numpy.max(numpy.abs(tone))
+        )
+
+    def test_compression_linked_channels(self):
+        # both channels get the gain of their combined level
+        t = numpy.arange(44100) / 44100.0
+        loud = 0.9 * numpy.sin(2 * math.pi * 440 * t)
+        stereo = numpy.stack([loud, 0.01 * numpy.sin(2 * math.pi * 440 * t)])
+        out, _ = degrade(stereo, 44100, [{"name": "dynamic_range_compression"}])
+        gains = out[:, 22050:] / stereo[:, 22050:]
+        mask = numpy.abs(stereo[:, 22050:]).min(axis=0) > 1e-3
+        numpy.testing.assert_allclose(gains[0, mask], gains[1, mask], rtol=1e-3)
+        self.assertLess(gains[0, mask].mean(), 0.9)
+
     def test_ir(self):
         old_pwr = goertzel(
             self.d.file_audio.samples, self.d.file_audio.sample_rate, (162, 164)
@@ -249,6 +502,20 @@ class TestAllDegradations(unittest.TestCase):
 
         self.assertTrue(new_pwr > old_pwr)
 
+    def test_ir_cache(self):
+        ir_cache.clear()
+        ir = {"name": "impulse_response", "path": "./samples/IR_GreatHall.wav"}
+        first = copy.deepcopy(self.d)
+        first.apply_degradation(ir)
+        misses = ir_cache.misses
+
+        # the decoded IR and its spectrum are reused, and so is the result
+        self.d.apply_degradation(ir)
+        self.assertEqual(ir_cache.misses, misses)
+        numpy.testing.assert_array_equal(
+            first.file_audio.samples, self.d.file_audio.samples
+        )
+
     def test_eq(self):
         old_pwr = goertzel(
             self.d.file_audio.samples, self.d.file_audio.sample_rate, (162, 164)
@@ -262,11 +529,92 @@ class TestAllDegradations(unittest.TestCase):
 
         self.assertTrue(new_pwr > old_pwr)
 
+    def test_multiband_eq(self):
+        bands = [
+            {"frequency": 100, "bandwidth": 0.7, "gain": 4.0},
+            {"frequency": 1000, "gain": -6.0},
+            {"frequency": 8000, "bandwidth": 2.0, "gain": 3.0},
+        ]
+        steps = copy.deepcopy(self.d)
+        for band in bands:
+            steps.apply_degradation(dict(band, name="equalizer"))
+        self.d.apply_degradation({"name": "equalizer", "bands": bands})
+
+        # peak normalizing commutes with the filters, so one pass over every
+        # band matches a step per band
+        numpy.testing.assert_allclose(
+            self.d.file_audio.data, steps.file_audio.data, atol=1e-5
+        )
+
+        with self.assertRaises(ValueError):
+            self.d.apply_degradation({"name": "equalizer", "frequency": 30000})
+
     def test_time_stretch(self):
         ts = {"name": "time_stretch", "factor": 2.0}
         self.d.apply_degradation(ts)
         self.assertTrue(3664 / 2.1 <= len(self.d.file_audio.sound) <= 3664 / 2.0)
 
+    def test_time_stretch_engines(self):
+        for engine in ("phase_vocoder", "wsola"):
+            d = copy.deepcopy(self.d)
+            d.apply_degradation(
+                {"name": "time_stretch", "factor": 0.8, "engine": engine}
+            )
+            self.assertEqual(len(d.file_audio.sound), 3664 / 0.8, engine)
+            self.assertAlmostEqual(numpy.max(numpy.abs(d.file_audio.data)), 1.0, 5)
+
+    def test_pitch_shift_engines(self):
+        t = numpy.arange(44100) / 44100.0
+        tone = 0.5 * numpy.sin(2 * math.pi * 440 * t)
+        for engine in ("phase_vocoder", "wsola"):
+            step = {"name": "pitch_shift", "octaves": 1.0, "engine": engine}
+            shifted, _ = degrade(tone, 44100, [step])
+
+            # the same duration and sample rate, an octave up
+            self.assertEqual(shifted.shape, tone.shape)
+            f, pwr = scipy_signal.welch(shifted, 44100, nperseg=8192)
+            self.assertAlmostEqual(f[numpy.argmax(pwr)], 880, delta=10)
+
+    def test_stft_cache(self):
+        stft_cache.clear()
+        chain = [
+            {"name": "time_stretch", "factor": 1.25},
+            {"name": "pitch_shift", "octaves": -0.5, "engine": "phase_vocoder"},
+        ]
+        first = copy.deepcopy(self.d)
+        first.apply_degradations(chain)
+        # the pitch shift analyzes the stretched audio, and whether that's
+        # cached doesn't change the output
+        self.assertEqual((stft_cache.misses, stft_cache.hits), (2, 0))
+        stft_cache.clear()
+        again = copy.deepcopy(self.d)
+        again.apply_degradation(chain[0])
+        stft_cache.clear()
+        again.apply_degradation(chain[1])
+        numpy.testing.assert_array_equal(again.file_audio.data, first.file_audio.data)
+
+        # the same input isn't analyzed again
+        stft_cache.clear()
+        audio = first.file_audio
+        for factor in (0.9, 1.1):
+            Degradation(audio=audio).apply_degradation(
+                {"name": "time_stretch", "factor": factor}
+            )
+        self.assertEqual((stft_cache.misses, stft_cache.hits), (1, 1))
+
+    def test_stft_cache_refilled_buffer(self):
+        # a buffer refilled in place between calls is analyzed anew, and
+        # degrades like a fresh array with the same contents
+        rng = numpy.random.RandomState(0)
+        clips = rng.standard_normal((2, 44100)).astype(numpy.float32) * 0.1
+        chain = Chain([{"name": "time_stretch", "factor": 1.2}])
+        buf = clips[0].copy()
+        degrade(buf, 44100, chain)
+        buf[:] = clips[1]
+        out, _ = degrade(buf, 44100, chain)
+        fresh, _ = degrade(clips[1].copy(), 44100, chain)
+        numpy.testing.assert_array_equal(out, fresh)
+
     def test_delay(self):
         delay = {"name": "delay", "samples": 44100}
         self.d.apply_degradation(delay)
@@ -288,6 +636,31 @@ class TestAllDegradations(unittest.TestCase):
 
         self.assertTrue(new_pwr > old_pwr)
 
+    def test_clipping_threshold(self):
+        rng = numpy.random.RandomState(0)
+        data = rng.standard_normal((2, 100000)).astype(numpy.float32)
+        audio = Audio(data=data.copy(), sample_rate=44100)
+
+        # the threshold is the magnitude sorted at the rank asked for
+        clipped = apply_clipping(audio, 0, 0.1).data
+        magnitudes = numpy.sort(numpy.abs(data).ravel())
+        threshold = magnitudes[len(magnitudes) - 20000 + 1]
+        expected = numpy.clip(data / threshold, -1, 1)
+        numpy.testing.assert_allclose(clipped, expected, atol=1e-6)
+        numpy.testing.assert_array_equal(audio.data, data)
+
+        # a subsample of 10000 clips the fraction asked for within its bound
+        # (1.6 percentage points for delta = 1e-6)
+        clipped = apply_clipping(audio, 0, 0.1, threshold_samples=10000).data
+        fraction = numpy.mean(numpy.abs(clipped) >= 1 - 1e-6)
+        self.assertLess(abs(fraction - 0.1), 0.016)
+        numpy.testing.assert_array_equal(audio.data, data)
+
+        self.d.apply_degradation(
+            {"name": "clipping", "samples": 100, "threshold_samples": 1000}
+        )
+        self.assertAlmostEqual(numpy.max(numpy.abs(self.d.file_audio.data)), 1.0, 5)
+
     def test_wow_flutter(self):
         old_pwr = goertzel(
             self.d.file_audio.samples, self.d.file_audio.sample_rate, (162, 164)
@@ -310,6 +683,15 @@ class TestAllDegradations(unittest.TestCase):
             )
             self.assertTrue(new_pwr < old_pwr)
 
+    def test_wow_flutter_keeps_rate(self):
+        orig = self.d.file_audio
+        self.d.apply_degradation({"name": "wow_flutter", "intensity": 3.0})
+
+        # the warp only moves samples around, at the original sample rate
+        self.assertEqual(self.d.file_audio.sample_rate, orig.sample_rate)
+        self.assertEqual(len(self.d.file_audio.data), len(orig.data))
+        self.assertFalse(numpy.allclose(self.d.file_audio.data, orig.data))
+
     def test_aliasing(self):
         old_pwr = goertzel(
             self.d.file_audio.samples, self.d.file_audio.sample_rate, (162, 164)
@@ -323,6 +705,14 @@ class TestAllDegradations(unittest.TestCase):
         )
         self.assertTrue(new_pwr < old_pwr)
 
+    def test_aliasing_keeps_rate(self):
+        orig = self.d.file_audio
+        self.d.apply_degradation({"name": "aliasing", "dest_frequency": 8000.5})
+
+        self.assertEqual(self.d.file_audio.sample_rate, orig.sample_rate)
+        self.assertEqual(len(self.d.file_audio.data), len(orig.data))
+        self.assertEqual(self.d.file_audio.data.dtype, orig.data.dtype)
+
     def test_harmonic_distortion(self):
         _, old_pwr = scipy_signal.welch(
             self.d.file_audio.samples, self.d.file_audio.sample_rate
@@ -340,5 +730,786 @@ class TestAllDegradations(unittest.TestCase):
         self.assertTrue(new_pwr > old_pwr)
 
 
+class TestBatch(unittest.TestCase):
+    def test_output_path_for(self):
+        self.assertEqual(
+            output_path_for("in/a/clip.flac", "a", "out"),
+            os.path.join("out", "a", "clip.wav"),
+        )
+        self.assertEqual(
+            output_path_for("clip.flac", "", "out/{stem}_{name}.wav"),
+            "out/clip_clip.flac.wav",
+        )
+
+    def test_run_batch(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            failures = run_batch(
+                [
+                    "./samples/IR_GoogleNexusOneFrontMic.wav",
+                    "./samples/does_not_exist.wav",
+                ],
+                out_dir,
+                [{"name": "gain", "volume": -3.0}],
+                jobs=2,
+            )
+
+            # the missing file is reported without stopping the others
+            self.assertEqual(failures, 1)
+            self.assertTrue(
+                os.path.isfile(os.path.join(out_dir, "IR_GoogleNexusOneFrontMic.wav"))
+            )
+
+    def test_run_batch_trace(self):
+        trace = Trace()
+        with tempfile.TemporaryDirectory() as out_dir:
+            run_batch(
+                [
+                    "./samples/IR_GoogleNexusOneFrontMic.wav",
+                    "./samples/IR_GreatHall.wav",
+                ],
+                out_dir,
+                [{"name": "gain", "volume": -3.0}, {"name": "normalize"}],
+                jobs=2,
+                trace=trace,
+            )
+
+        self.assertEqual(len(trace.events), 4)
+        self.assertEqual(
+            sorted(os.path.basename(e.input) for e in trace.events if e.name == "gain"),
+            ["IR_GoogleNexusOneFrontMic.wav", "IR_GreatHall.wav"],
+        )
+
+
+class TestStream(unittest.TestCase):
+    input_path = "./samples/Viola.arco.ff.sulC.E3.stereo.aiff"
+
+    def _compare(self, degradations):
+        d = Degradation(self.input_path)
+        for degradation in degradations:
+            d.apply_degradation(degradation)
+
+        with tempfile.TemporaryDirectory() as out_dir:
+            out_path = os.path.join(out_dir, "out.wav")
+            stream_degradations(
+                self.input_path, out_path, degradations, block_size=10000
+            )
+            streamed = Audio(out_path)
+
+        self.assertEqual(streamed.sample_rate, d.file_audio.sample_rate)
+        self.assertEqual(len(streamed.data), len(d.file_audio.data))
+        return d.file_audio.data, streamed.data
+
+    def test_matches_full_buffer(self):
+        full, streamed = self._compare(
+            [
+                {"name": "impulse_response", "path": "./samples/IR_GreatHall.wav"},
+                {"name": "low_pass", "cutoff": 3000},
+                {"name": "delay", "samples": 12345},
+                {"name": "harmonic_distortion", "num_passes": 2},
+                {"name": "high_pass", "cutoff": 100},
+                {
+                    "name": "mix",
+                    "path": "./samples/Noise_OldDustyRecording.wav",
+                    "snr": 10,
+                    "offset": 250,
+                },
+                {"name": "normalize"},
+            ]
+        )
+        numpy.testing.assert_allclose(streamed, full, atol=1e-3)
+
+    def test_seeded_noise(self):
+        full, streamed = self._compare(
+            [
+                {"name": "low_pass", "cutoff": 3000},
+                {"name": "noise", "color": "pink", "snr": 10, "seed": 3},
+            ]
+        )
+        numpy.testing.assert_allclose(streamed, full, atol=1e-3)
+
+    def test_multiband_eq(self):
+        full, streamed = self._compare(
+            [
+                {
+                    "name": "equalizer",
+                    "bands": [
+                        {"frequency": 200, "gain": 6.0},
+                        {"frequency": 2000, "bandwidth": 0.5, "gain": -6.0},
+                    ],
+                },
+            ]
+        )
+        numpy.testing.assert_allclose(streamed, full, atol=1e-3)
+
+    def test_long_noise(self):
+        # past the bank's length, the stream reads the same long noise
+        saved = noise_bank.n_samples, noise_bank._buffers
+        noise_bank.n_samples, noise_bank._buffers = 8192, {}
+        try:
+            full, streamed = self._compare(
+                [{"name": "noise", "color": "pink", "snr": 10, "seed": 3}]
+            )
+        finally:
+            noise_bank.n_samples, noise_bank._buffers = saved
+        numpy.testing.assert_allclose(streamed, full, atol=1e-3)
+
+    def test_iir_filters(self):
+        full, streamed = self._compare(
+            [
+                {"name": "band_pass", "type": "butter", "order": 4},
+                {"name": "low_pass", "cutoff": 2000, "type": "cheby1", "order": 6},
+                {"name": "band_pass", "low_cutoff": 100, "high_cutoff": 8000},
+                # zero phase filters fall back to a full buffer
+                {"name": "high_pass", "cutoff": 150, "zero_phase": True},
+            ]
+        )
+        numpy.testing.assert_allclose(streamed, full, atol=1e-3)
+
+    def test_full_buffer_fallback(self):
+        full, streamed = self._compare(
+            [
+                {"name": "gain", "volume": -6.0},
+                {"name": "resample", "rate": 22050},
+                {"name": "gain", "volume": 3.0},
+            ]
+        )
+        numpy.testing.assert_allclose(streamed, full, atol=1e-3)
+
+
+class TestPlan(unittest.TestCase):
+    chain = [
+        {"name": "low_pass", "cutoff": 5000},
+        {"name": "gain", "volume": -3.0},
+        {"name": "high_pass", "cutoff": 133.33},
+        {"name": "delay", "samples": 100},
+        {"name": "low_pass", "cutoff": 3000},
+        {"name": "normalize"},
+        {"name": "high_pass", "cutoff": 200},
+    ]
+
+    def test_compile_plan(self):
+        plan = compile_plan(self.chain)
+
+        self.assertEqual(len(plan), 3)
+        self.assertIsInstance(plan[0], FusedFilter)
+        self.assertEqual(plan[0].steps, self.chain[:5])
+        self.assertEqual(plan[1:], self.chain[5:])
+        self.assertEqual(compile_plan(self.chain, fuse=False), self.chain)
+
+        description = describe_plan(plan)
+        self.assertIn("1: fused_filter [low_pass (cutoff: 5000) -> gain", description)
+        self.assertIn("3: high_pass (cutoff: 200)", description)
+
+    def test_fused_matches_steps(self):
+        fused = Degradation("./samples/Viola.arco.ff.sulC.E3.stereo.aiff")
+        steps = copy.deepcopy(fused)
+
+        fused.apply_degradations(self.chain)
+        for d in self.chain:
+            steps.apply_degradation(d)
+
+        self.assertEqual(len(fused.file_audio.data), len(steps.file_audio.data))
+        numpy.testing.assert_allclose(
+            fused.file_audio.data, steps.file_audio.data, atol=1e-5
+        )
+
+    def test_fused_multiband_eq(self):
+        chain = [
+            {"name": "high_pass", "cutoff": 80},
+            {
+                "name": "equalizer",
+                "bands": [
+                    {"frequency": 250, "gain": 3.0},
+                    {"frequency": 4000, "bandwidth": 2.0, "gain": -9.0},
+                ],
+            },
+        ]
+        fused = Degradation("./samples/Viola.arco.ff.sulC.E3.stereo.aiff")
+        steps = copy.deepcopy(fused)
+
+        fused.apply_degradations(chain)
+        for d in chain:
+            steps.apply_degradation(d)
+
+        numpy.testing.assert_allclose(
+            fused.file_audio.data, steps.file_audio.data, atol=1e-5
+        )
+
+    def test_fused_iir_filters(self):
+        chain = [
+            {"name": "low_pass", "cutoff": 6000},
+            {"name": "high_pass", "cutoff": 100, "type": "butter", "order": 4},
+            {"name": "delay", "samples": 50},
+            {"name": "band_pass", "type": "ellip", "order": 3},
+            {"name": "high_pass", "cutoff": 300},
+            {"name": "gain", "volume": -3.0},
+            {"name": "low_pass", "cutoff": 3000, "zero_phase": True},
+        ]
+        plan = compile_plan(Chain(chain).steps)
+        self.assertIsInstance(plan[0], FusedFilter)
+        self.assertEqual(len(plan[0].steps), 6)
+        self.assertEqual(plan[1]["name"], "low_pass")
+
+        fused = Degradation("./samples/Viola.arco.ff.sulC.E3.stereo.aiff")
+        steps = copy.deepcopy(fused)
+
+        fused.apply_degradations(chain)
+        for d in chain:
+            steps.apply_degradation(d)
+
+        numpy.testing.assert_allclose(
+            fused.file_audio.data, steps.file_audio.data, atol=1e-5
+        )
+
+
+class TestMultichannel(unittest.TestCase):
+    def setUp(self):
+        mono = Degradation("./samples/Viola.arco.ff.sulC.E3.stereo.aiff")
+        self.mono = mono.file_audio
+        self.stereo = Audio(
+            data=numpy.stack((self.mono.data, 0.5 * self.mono.data)),
+            old_audio=self.mono,
+        )
+
+    def test_load(self):
+        d = Degradation("./samples/Viola.arco.ff.sulC.E3.stereo.aiff", mono=False)
+        self.assertEqual(d.file_audio.channels, 2)
+        self.assertEqual(d.file_audio.data.shape, (2, len(self.mono.data)))
+        self.assertEqual(len(d.file_audio), 3664)
+
+    def test_channels_processed_together(self):
+        chain = [
+            {"name": "low_pass", "cutoff": 3000},
+            {"name": "delay", "samples": 100},
+            {"name": "impulse_response", "path": "./samples/IR_GreatHall.wav"},
+            {"name": "wow_flutter"},
+            {"name": "trim_millis", "amount": 50},
+        ]
+        mono = Degradation(audio=self.mono)
+        mono.apply_degradations(chain)
+        stereo = Degradation(audio=self.stereo)
+        stereo.apply_degradations(chain)
+
+        left, right = stereo.file_audio.data
+        numpy.testing.assert_allclose(left, mono.file_audio.data, atol=1e-5)
+        numpy.testing.assert_allclose(right, 0.5 * left, atol=1e-5)
+
+    def test_noise_per_channel(self):
+        d = Degradation(audio=self.stereo)
+        d.apply_degradation({"name": "noise", "color": "white", "snr": 0})
+        noise = d.file_audio.data - self.stereo.data
+
+        self.assertEqual(noise.shape, self.stereo.data.shape)
+        self.assertFalse(numpy.allclose(noise[0], noise[1]))
+
+    def test_export(self):
+        d = Degradation(audio=self.stereo)
+        d.apply_degradation({"name": "resample", "rate": 22050})
+
+        with tempfile.TemporaryDirectory() as out_dir:
+            out_path = os.path.join(out_dir, "out.wav")
+            d.file_audio.export(out_path)
+            exported = Audio(out_path, mono=False)
+
+        self.assertEqual(exported.channels, 2)
+        self.assertEqual(exported.sample_rate, 22050)
+        numpy.testing.assert_allclose(exported.data, d.file_audio.data, atol=1e-4)
+
+
+class TestChain(unittest.TestCase):
+    def test_presets(self):
+        for preset in sorted(os.listdir("./presets")):
+            chain = Chain.load(os.path.join("./presets", preset))
+            self.assertTrue(len(chain) > 0)
+
+    def test_invalid_steps(self):
+        degradations = [
+            {"name": "low_pass", "cutof": 3000},
+            {"name": "mix", "path": "./samples/missing.wav", "snr": "loud"},
+            {"name": "normalization"},
+            {"name": "clipping", "samples": 10, "percent_samples": 1.0},
+            {"name": "delay", "samples": 2.5},
+            {"name": "equalizer"},
+            {"name": "equalizer", "bands": [{"frequency": 100}, {"frequency": -1}]},
+            {"name": "dynamic_range_compression", "sample_accurate": 1},
+            {"name": "low_pass", "order": 4},
+            {"name": "band_pass", "low_cutoff": 3000, "high_cutoff": 300},
+        ]
+        with self.assertRaises(ValueError) as cm:
+            Chain(degradations)
+
+        message = str(cm.exception)
+        for expected in (
+            "step 1 (low_pass): unknown parameter cutof",
+            "step 2 (mix): path is not a file",
+            "step 2 (mix): snr must be a number",
+            "step 3 (normalization): unknown degradation",
+            "step 4 (clipping): only specify one of",
+            "step 5 (delay): samples must be an integer",
+            "step 6 (equalizer): specify one of frequency or bands",
+            "step 7 (equalizer): band 2: frequency must be positive",
+            "step 8 (dynamic_range_compression): sample_accurate must be true or false",
+            "step 9 (low_pass): rc filters are first order",
+            "step 10 (band_pass): low_cutoff must be below high_cutoff",
+        ):
+            self.assertIn(expected, message)
+
+    def test_defaults(self):
+        chain = Chain(
+            [
+                {"name": "noise"},
+                {
+                    "name": "mix",
+                    "path": "./samples/restaurant08.wav",
+                    "offset": "random",
+                },
+            ]
+        )
+        self.assertEqual(
+            chain.steps[0],
+            {"name": "noise", "color": "pink", "snr": 20.0, "seed": None},
+        )
+        self.assertEqual(chain.steps[1]["offset"], "random")
+
+    def test_reuse(self):
+        chain = Chain(
+            [
+                {"name": "gain", "volume": -3},
+                {"name": "high_pass", "cutoff": 200},
+                {"name": "aliasing"},
+            ]
+        )
+        first = Degradation("./samples/Viola.arco.ff.sulC.E3.stereo.aiff")
+        second = copy.deepcopy(first)
+        first.apply_degradations(chain)
+        second.apply_degradations(chain)
+
+        numpy.testing.assert_array_equal(first.file_audio.data, second.file_audio.data)
+
+
+class TestImports(unittest.TestCase):
+    def test_heavy_dependencies_load_lazily(self):
+        heavy = ("acoustics", "librosa", "numba", "pysndfx", "scipy.signal")
+        imported = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, audio_degradation_toolbox.cli; print(' '.join(sys.modules))",
+            ],
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+            check=True,
+        ).stdout.split()
+
+        self.assertEqual([m for m in heavy if m in imported], [])
+
+    def test_unknown_degradation(self):
+        d = Degradation("./samples/Viola.arco.ff.sulC.E3.stereo.aiff")
+        with self.assertRaises(ValueError):
+            d.apply_degradation({"name": "normalization"})
+
+
+class TestArrayApi(unittest.TestCase):
+    chain = [
+        {"name": "low_pass", "cutoff": 3000},
+        {"name": "gain", "volume": -3.0},
+        {"name": "impulse_response", "path": "./samples/IR_GreatHall.wav"},
+        {"name": "clipping", "percent_samples": 1.0},
+    ]
+
+    def setUp(self):
+        self.d = Degradation("./samples/Viola.arco.ff.sulC.E3.stereo.aiff")
+        self.data = self.d.file_audio.data.astype(numpy.float32)
+
+    def test_matches_degradation(self):
+        out, sample_rate = degrade(self.data, self.d.file_audio.sample_rate, self.chain)
+        self.d.apply_degradations(self.chain)
+
+        self.assertEqual(out.dtype, numpy.float32)
+        self.assertEqual(sample_rate, self.d.file_audio.sample_rate)
+        numpy.testing.assert_allclose(out, self.d.file_audio.data, atol=1e-5)
+
+    def test_no_input_copy(self):
+        audio = Audio(data=self.data, sample_rate=44100)
+        self.assertIs(audio.data, self.data)
+
+        before = self.data.copy()
+        stereo = numpy.stack((self.data, 0.5 * self.data))
+        out, _ = degrade(stereo, 44100, Chain(self.chain))
+        self.assertEqual(out.shape[0], 2)
+        numpy.testing.assert_array_equal(stereo[0], before)
+
+        # nothing to do still gives the caller a buffer of its own
+        out, _ = degrade(self.data, 44100, [])
+        self.assertFalse(numpy.may_share_memory(out, self.data))
+        numpy.testing.assert_array_equal(out, before)
+
+    def test_refilled_buffer(self):
+        chain = Chain(
+            self.chain
+            + [
+                {"name": "time_stretch", "factor": 0.9},
+                {"name": "pitch_shift", "octaves": 0.25, "engine": "phase_vocoder"},
+                {"name": "noise", "seed": 1},
+            ]
+        )
+        buf = self.data.copy()
+        degrade(buf, 44100, chain)
+        buf *= -0.5
+        out, _ = degrade(buf, 44100, chain)
+        fresh, _ = degrade(-0.5 * self.data, 44100, chain)
+        numpy.testing.assert_array_equal(out, fresh)
+
+    def test_sample_rate(self):
+        out, sample_rate = degrade(
+            self.data,
+            44100,
+            [{"name": "speedup", "speed": 2.0}, {"name": "resample", "rate": 16000}],
+        )
+        # speedup plays the audio at half the rate it resampled it to
+        self.assertEqual(sample_rate, 16000)
+        self.assertAlmostEqual(out.shape[-1] / self.data.shape[-1], 16000 / 44100, 3)
+
+    def test_invalid_arrays(self):
+        with self.assertRaises(ValueError):
+            degrade((self.data * 32767).astype(numpy.int16), 44100, self.chain)
+        with self.assertRaises(ValueError):
+            degrade(self.data.reshape(1, 1, -1), 44100, self.chain)
+
+
+class TestAugment(unittest.TestCase):
+    irs = ["./samples/IR_GreatHall.wav", "./samples/IR_GoogleNexusOneFrontMic.wav"]
+    augmentation = [
+        {"name": "impulse_response", "path": {"choice": irs}},
+        {"name": "low_pass", "cutoff": {"loguniform": [1000, 8000]}},
+        {"name": "gain", "volume": {"normal": [-3.0, 1.0]}},
+        {"name": "delay", "samples": {"randint": [0, 10]}},
+        {
+            "name": "mix",
+            "path": "./samples/Noise_OldDustyRecording.wav",
+            "snr": {"uniform": [10, 40]},
+            "offset": "random",
+        },
+    ]
+
+    def setUp(self):
+        self.audio = Degradation(
+            "./samples/Viola.arco.ff.sulC.E3.stereo.aiff"
+        ).file_audio
+
+    def test_variants(self):
+        before = self.audio.data.copy()
+        ir_cache.clear()
+        variants = list(Augmentation(self.augmentation).variants(self.audio, 8, seed=3))
+
+        self.assertEqual([v.index for v in variants], list(range(8)))
+        for v in variants:
+            ir, low_pass, gain, delay, mix = v.degradations
+            self.assertIn(ir["path"], self.irs)
+            self.assertTrue(1000 <= low_pass["cutoff"] < 8000)
+            self.assertIsInstance(delay["samples"], int)
+            self.assertTrue(0 <= delay["samples"] <= 10)
+            self.assertTrue(10 <= mix["snr"] < 40)
+        self.assertGreater(len({v.degradations[3]["samples"] for v in variants}), 1)
+
+        # each IR is only decoded and transformed once, and the input is left
+        # alone
+        self.assertEqual(
+            ir_cache.misses, 2 * len({v.degradations[0]["path"] for v in variants})
+        )
+        numpy.testing.assert_array_equal(self.audio.data, before)
+
+    def test_seed(self):
+        augmentation = Augmentation(self.augmentation)
+        first = list(augmentation.variants(self.audio, 3, seed=7))
+        again = list(augmentation.variants(self.audio, 3, seed=7))
+        other = list(augmentation.variants(self.audio, 3, seed=8))
+
+        for a, b in zip(first, again):
+            self.assertEqual(a.degradations, b.degradations)
+            numpy.testing.assert_array_equal(a.audio.data, b.audio.data)
+        self.assertNotEqual(
+            [v.degradations for v in first], [v.degradations for v in other]
+        )
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError) as e:
+            Augmentation(
+                [
+                    {"name": "noise", "snr": {"gaussian": [0, 1]}},
+                    {"name": "low_pass", "cutoff": {"uniform": [-100, 1000]}},
+                    {"name": "delay", "samples": {"randint": [10, 1]}},
+                    {"name": "impulse_response", "path": {"choice": ["nope.wav"]}},
+                ]
+            )
+        message = str(e.exception)
+        self.assertIn("step 1 (noise): snr: expected a distribution", message)
+        self.assertIn("step 2 (low_pass): cutoff must be positive", message)
+        self.assertIn("step 3 (delay): samples: randint needs low <= high", message)
+        self.assertIn("step 4 (impulse_response): path is not a file", message)
+
+    def test_normal_clipped(self):
+        # draws far outside the range of bounded parameters are clipped into
+        # it, so every sampled chain is valid
+        augmentation = Augmentation(
+            [
+                {"name": "mp3", "bitrate": {"normal": [64, 1000]}},
+                {"name": "low_pass", "cutoff": {"normal": [100.0, 1000.0]}},
+                {"name": "delay", "samples": {"normal": [10, 100]}},
+                {"name": "gain", "volume": {"normal": [0.0, 100.0]}},
+            ]
+        )
+        rng = numpy.random.RandomState(0)
+        samples = [augmentation.sample(rng) for _ in range(200)]
+        for degradations in samples:
+            Chain(degradations)
+        bitrates = [d[0]["bitrate"] for d in samples]
+        self.assertEqual({min(bitrates), max(bitrates)}, {8, 320})
+        self.assertTrue(all(isinstance(b, int) for b in bitrates))
+        self.assertGreater(min(d[1]["cutoff"] for d in samples), 0)
+        self.assertEqual(min(d[2]["samples"] for d in samples), 0)
+        # unbounded parameters are drawn as they are
+        self.assertLess(min(d[3]["volume"] for d in samples), -100.0)
+
+    def test_integer_parameters(self):
+        augmentation = Augmentation(
+            [
+                {"name": "delay", "samples": {"uniform": [0, 100]}},
+                {"name": "mp3", "bitrate": {"loguniform": [8, 320]}},
+            ]
+        )
+        rng = numpy.random.RandomState(0)
+        for _ in range(50):
+            degradations = augmentation.sample(rng)
+            Chain(degradations)
+            self.assertIsInstance(degradations[0]["samples"], int)
+            self.assertIsInstance(degradations[1]["bitrate"], int)
+
+    def test_name_distribution(self):
+        with self.assertRaises(ValueError) as e:
+            Augmentation(
+                [
+                    {"name": {"choice": ["gain", "normalize"]}},
+                    {"name": ["gain"]},
+                    {"name": "gain", "volume": {"uniform": [0, 1, 2]}},
+                ]
+            )
+        message = str(e.exception)
+        self.assertIn("step 1 ({'choice': ['gain', 'normalize']}): name can't", message)
+        self.assertIn("step 2 (['gain']): name must be a string", message)
+        self.assertIn("step 3 (gain): volume: uniform needs two numbers", message)
+
+
+class TestHooks(unittest.TestCase):
+    path = "./samples/Viola.arco.ff.sulC.E3.stereo.aiff"
+
+    def test_step_events(self):
+        trace = Trace()
+        d = Degradation(self.path, hooks=[trace])
+        n_samples = len(d.file_audio.data)
+        d.apply_degradations(
+            [
+                {"name": "gain", "volume": -3.0},
+                {"name": "delay", "samples": 100},
+                {"name": "resample", "rate": 22050},
+            ]
+        )
+
+        # gain and delay are fused into one step
+        self.assertEqual([e.name for e in trace.events], ["fused_filter", "resample"])
+        fused, resample = trace.events
+        self.assertEqual(fused.input, self.path)
+        self.assertEqual([s["name"] for s in fused.params["steps"]], ["gain", "delay"])
+        self.assertEqual(fused.input_samples, n_samples)
+        self.assertEqual(fused.output_samples, n_samples + 100)
+        self.assertEqual(resample.params, {"rate": 22050, "quality": "medium"})
+        self.assertEqual(resample.output_samples, len(d.file_audio.data))
+        for e in trace.events:
+            self.assertGreaterEqual(e.wall_time, 0.0)
+            self.assertGreaterEqual(e.cpu_time, 0.0)
+            self.assertGreaterEqual(e.memory_delta, 0)
+
+    def test_trace_dump(self):
+        trace = Trace()
+        d = Degradation(self.path)
+        d.add_hook(trace)
+        d.apply_degradation({"name": "normalize"})
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            trace_path = os.path.join(tmp_dir, "trace.json")
+            trace.dump(trace_path)
+            with open(trace_path) as f:
+                steps = json.load(f)["steps"]
+
+        self.assertEqual(len(steps), 1)
+        self.assertEqual(steps[0]["name"], "normalize")
+        self.assertEqual(steps[0]["params"], {})
+        self.assertIn("wall_time", steps[0])
+
+    def test_print_step(self):
+        d = Degradation(self.path, hooks=[print_step])
+        with tempfile.TemporaryFile("w+") as out:
+            stdout, sys.stdout = sys.stdout, out
+            try:
+                d.apply_degradation({"name": "noise", "color": "white", "snr": 20})
+            finally:
+                sys.stdout = stdout
+            out.seek(0)
+            self.assertEqual(
+                out.read(),
+                "Applied degradation noise with params color: white, snr: 20.0\n",
+            )
+
+
+class TestOutputCache(unittest.TestCase):
+    path = "./samples/IR_GoogleNexusOneFrontMic.wav"
+    chain = Chain(
+        [
+            {"name": "gain", "volume": -3.0},
+            {"name": "impulse_response", "path": "./samples/IR_GreatHall.wav"},
+        ]
+    )
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = OutputCache(os.path.join(self.tmp.name, "cache"))
+        self.calls = 0
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def degrade(self, output_path, nbytes=1000):
+        def degrade():
+            self.calls += 1
+            with open(output_path, "wb") as f:
+                f.write(b"x" * nbytes)
+
+        return degrade
+
+    def test_key(self):
+        key = self.cache.key(self.path, self.chain, mono=True)
+        self.assertEqual(len(key), 64)
+
+        # defaults spelled out, or an IR with the same contents elsewhere,
+        # are the same chain
+        ir = os.path.join(self.tmp.name, "ir.wav")
+        with open("./samples/IR_GreatHall.wav", "rb") as src, open(ir, "wb") as dst:
+            dst.write(src.read())
+        same = Chain(
+            [
+                {"name": "gain", "volume": -3.0},
+                {"name": "impulse_response", "path": ir},
+            ]
+        )
+        self.assertEqual(self.cache.key(self.path, same, mono=True), key)
+
+        with open(ir, "ab") as f:
+            f.write(b"\0")
+        self.assertNotEqual(self.cache.key(self.path, same, mono=True), key)
+        self.assertNotEqual(self.cache.key(self.path, self.chain, mono=False), key)
+        self.assertNotEqual(
+            self.cache.key("./samples/IR_GreatHall.wav", self.chain, mono=True), key
+        )
+
+        # random chains aren't cached
+        self.assertIsNone(self.cache.key(self.path, Chain([{"name": "noise"}])))
+        self.assertIsNotNone(
+            self.cache.key(self.path, Chain([{"name": "noise", "seed": 1}]))
+        )
+
+    def test_produce(self):
+        out = os.path.join(self.tmp.name, "out.wav")
+        for hit in (False, True, True):
+            self.assertEqual(
+                self.cache.produce(self.path, out, self.chain, self.degrade(out)), hit
+            )
+            self.assertEqual(os.path.getsize(out), 1000)
+        self.assertEqual(self.calls, 1)
+
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 1))
+        self.assertEqual(stats["bytes_saved"], 2000)
+        self.assertEqual((stats["entries"], stats["size"]), (1, 1000))
+
+    def test_eviction(self):
+        self.cache.max_bytes = 2500
+        out = os.path.join(self.tmp.name, "out.wav")
+        chains = [Chain([{"name": "gain", "volume": v}]) for v in (1.0, 2.0, 3.0)]
+        keys = [self.cache.key(self.path, c) for c in chains]
+        for i, key in enumerate(keys[:2]):
+            self.degrade(out)()
+            self.cache.store(key, out)
+            os.utime(self.cache._entry(key), (i, i))
+
+        # a hit makes the first entry the most recently used one
+        self.assertTrue(self.cache.fetch(keys[0], out))
+        self.degrade(out)()
+        self.cache.store(keys[2], out)
+
+        self.assertEqual(
+            [os.path.exists(self.cache._entry(k)) for k in keys], [True, False, True]
+        )
+        stats = self.cache.stats()
+        self.assertEqual((stats["entries"], stats["size"]), (2, 2000))
+
+        # entries larger than the whole cache aren't stored
+        self.degrade(out, 3000)()
+        self.cache.store(keys[1], out)
+        self.assertFalse(os.path.exists(self.cache._entry(keys[1])))
+
+    def test_eviction_low_water_mark(self):
+        # evicting makes room below the limit rather than just under it
+        self.cache.max_bytes = 2100
+        out = os.path.join(self.tmp.name, "out.wav")
+        chains = [Chain([{"name": "gain", "volume": v}]) for v in (1.0, 2.0, 3.0, 4.0)]
+        keys = [self.cache.key(self.path, c) for c in chains]
+        for i, key in enumerate(keys):
+            self.degrade(out, 700)()
+            self.cache.store(key, out)
+            os.utime(self.cache._entry(key), (i, i))
+
+        self.assertEqual(
+            [os.path.exists(self.cache._entry(k)) for k in keys],
+            [False, False, True, True],
+        )
+        stats = self.cache.stats()
+        self.assertEqual((stats["entries"], stats["size"]), (2, 1400))
+
+    def test_link(self):
+        self.cache.link = True
+        out = os.path.join(self.tmp.name, "out.wav")
+        self.cache.produce(self.path, out, self.chain, self.degrade(out))
+        self.assertTrue(self.cache.produce(self.path, out, self.chain, None))
+        self.assertEqual(os.stat(out).st_nlink, 2)
+        self.assertEqual(sorted(os.listdir(self.tmp.name)), ["cache", "out.wav"])
+
+        # a miss doesn't write through the link into the cached entry
+        other = Chain([{"name": "normalize"}])
+        self.cache.produce(self.path, out, other, self.degrade(out, 10))
+        key = self.cache.key(self.path, self.chain)
+        self.assertEqual(os.path.getsize(self.cache._entry(key)), 1000)
+
+    def test_run_batch(self):
+        inputs = [
+            "./samples/IR_GoogleNexusOneFrontMic.wav",
+            "./samples/IR_GreatHall.wav",
+        ]
+        out_dir = os.path.join(self.tmp.name, "out")
+        for _ in range(2):
+            run_batch(inputs, out_dir, self.chain, jobs=2, cache=self.cache)
+
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 2))
+        self.assertEqual(stats["entries"], 2)
+        self.assertEqual(len(os.listdir(out_dir)), 2)
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size("1024"), 1024)
+        self.assertEqual(parse_size("500M"), 500 * 1024**2)
+        self.assertEqual(parse_size("1.5GiB"), 3 * 1024**3 // 2)
+        with self.assertRaises(ValueError):
+            parse_size("5X")
+
+
 if __name__ == "__main__":
     unittest.main()